@@ -19,6 +19,7 @@ from ..end_points.vc_api import VC_API
 from fastapi.responses import StreamingResponse
 from io import BytesIO
 import bittensor as bt
+import lib.protocol
 from fastapi.responses import FileResponse, HTMLResponse
 from mimetypes import guess_type
 from os.path import exists
@@ -269,7 +270,7 @@ async def vc_service(audio_file: Annotated[UploadFile, File()], prompt: str = Fo
             with open(temp_file_path, 'wb+') as f:
                 f.write(await audio_file.read())  # Write the contents to a temporary file
             waveform, sample_rate = torchaudio.load(temp_file_path)  
-            input_audio = waveform.tolist()
+            input_audio = vc_api.encode_clone_input(waveform, sample_rate)
 
             # Choose a VC axon randomly
             uid, axon = random.choice(filtered_axons)
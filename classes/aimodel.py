@@ -3,6 +3,7 @@ import argparse
 import bittensor as bt
 import sys
 import asyncio
+import threading
 import traceback
 from datasets import load_dataset
 import torch
@@ -24,11 +25,16 @@ import subprocess
 from huggingface_hub import hf_hub_download
 from lib import __spec_version__ as spec_version
 from classes.corcel_prompt import CorcelAPI
+from lib.scheduler import ScoringScheduler, SERVICE_PRIORITIES
+from lib.metagraph_index import MetagraphIndex
 
 class AIModelService:
     _scores = None
+    _api = None
     _base_initialized = False  # New class-level flag
     version: int = spec_version
+    # Shared by all services: output files and wandb uploads are written from the scoring pool threads
+    output_lock = threading.Lock()
 
     def __init__(self):
         self.config = self.get_config()
@@ -39,6 +45,7 @@ class AIModelService:
         self.subtensor = bt.subtensor(config=self.config)
         self.dendrite = bt.dendrite(wallet=self.wallet)
         self.metagraph = self.subtensor.metagraph(self.config.netuid)
+        self.metagraph_index = MetagraphIndex(self.metagraph)
 
         if not AIModelService._base_initialized:
             bt.logging.info(f"Wallet: {self.wallet}")
@@ -47,7 +54,10 @@ class AIModelService:
             bt.logging.info(f"Metagraph: {self.metagraph}")
 
             AIModelService._base_initialized = True
-        self.api = CorcelAPI()
+        # One pooled API client is shared by all services
+        if AIModelService._api is None:
+            AIModelService._api = CorcelAPI()
+        self.api = AIModelService._api
         self.priority_uids(self.metagraph)
         self.p = inflect.engine()
         self.vcdnp = self.config.vcdnp
@@ -55,6 +65,9 @@ class AIModelService:
             AIModelService._scores = self.metagraph.E.clone().detach()
         self.scores = AIModelService._scores
         self.uid = self.metagraph.hotkeys.index(self.wallet.hotkey.ss58_address)
+        self.scheduler = ScoringScheduler.get_instance(
+            max_workers=self.config.scoring_workers,
+            model_concurrency=self.parse_scoring_concurrency(self.config.scoring_concurrency))
 
 
     def get_config(self):
@@ -65,6 +78,12 @@ class AIModelService:
         parser.add_argument("--netuid", type=int, default=16, help="The chain subnet uid.")
         parser.add_argument("--vcdnp", type=int, default=15, help="Number of miners to query for each forward call.")
         parser.add_argument("--auto_update", type=str, default='yes', help="Auto update option for github repository updates.")
+        parser.add_argument("--scoring_device", type=str, default=None, help="Device for the resident scoring models, defaults to cuda when available.")
+        parser.add_argument("--scoring_workers", type=int, default=None, help="Threads in the shared scoring pool, defaults to min(8, cpu count).")
+        parser.add_argument("--vc_similarity", type=str, default="mel", choices=["mel", "speaker"], help="Voice clone similarity backend: mel spectrogram cosine or speaker embedding cosine.")
+        parser.add_argument("--vc_embedding_store", type=str, default=None, help="Directory for stored reference speaker embeddings, defaults to ~/.cache/audio_subnet/speaker_embeddings.")
+        parser.add_argument("--vc_audio_payload", action="store_true", default=False, help="Send the Voice Clone reference as an AudioPayload instead of a list. Enable once miners are updated, older miners reject it.")
+        parser.add_argument("--scoring_concurrency", type=str, default=None, help="Concurrent jobs per scoring model ('speech', which VC shares, and 'clap'), e.g. 'clap=2'. Tune to the available VRAM.")
 
         # Add Bittensor specific arguments
         bt.subtensor.add_args(parser)
@@ -75,6 +94,17 @@ class AIModelService:
         config = bt.config(parser)
         return config
     
+    def parse_scoring_concurrency(self, value):
+        concurrency = {}
+        if value:
+            for item in value.split(','):
+                model, _, slots = item.partition('=')
+                try:
+                    concurrency[model.strip()] = max(1, int(slots))
+                except ValueError:
+                    bt.logging.error(f"Ignoring invalid scoring concurrency '{item}', expected model=slots")
+        return concurrency
+
     def priority_uids(self, metagraph):
         hotkeys = metagraph.hotkeys  # List of hotkeys
         coldkeys = metagraph.coldkeys  # List of coldkeys
@@ -196,11 +226,16 @@ class AIModelService:
 
         bt.logging(self.config, logging_dir=self.config.full_path)
 
+    def sync_metagraph(self):
+        '''Sync the metagraph and rebuild its index.'''
+        self.metagraph.sync(subtensor=self.subtensor)
+        self.metagraph_index = MetagraphIndex(self.metagraph)
+
     def update_score(self, axon, new_score, service, ax):
             try:
-                uids = self.metagraph.uids.tolist()
-                zipped_uids = list(zip(uids, self.metagraph.axons))
-                uid_index = list(zip(*filter(lambda x: x[1] == axon, zipped_uids)))[0][0]
+                uid_index = self.metagraph_index.uid_for_axon(axon)
+                if uid_index is None:
+                    raise ValueError(f"axon {axon.hotkey} is not in the metagraph")
                 # if uid_index in ax:
                 #     alpha = self.config.alpha
                 #     self.scores[uid_index] = alpha * self.scores[uid_index] * (1 - alpha) * new_score * 0.0
@@ -215,9 +250,9 @@ class AIModelService:
     def punish(self, axon, service, punish_message):
         '''Punish the axon for returning an invalid response'''
         try:
-            uids = self.metagraph.uids.tolist()
-            zipped_uids = list(zip(uids, self.metagraph.axons))
-            uid_index = list(zip(*filter(lambda x: x[1] == axon, zipped_uids)))[0][0]
+            uid_index = self.metagraph_index.uid_for_axon(axon)
+            if uid_index is None:
+                raise ValueError(f"axon {axon.hotkey} is not in the metagraph")
             alpha = self.config.alpha
             self.scores[uid_index] = alpha * self.scores[uid_index] + (1 - alpha) * (-0.1)
             if self.scores[uid_index] < 0:
@@ -237,5 +272,64 @@ class AIModelService:
             bt.logging.error("Failed to get git commit hash. '.git' folder is missing")
             return None
         
+    async def query_as_completed(self, axons, synapse, timeout):
+        '''
+        Query the axons concurrently and yield (axon, response) pairs in the order
+        the responses arrive, so slow miners do not hold back the fast ones.
+        '''
+        async def call(axon):
+            response = await self.dendrite.call(target_axon=axon, synapse=synapse.copy(), timeout=timeout, deserialize=True)
+            return axon, response
+
+        for future in asyncio.as_completed([call(axon) for axon in axons]):
+            try:
+                yield await future
+            except Exception as e:
+                bt.logging.error(f"An error occurred while querying an axon: {e}")
+
+    async def run_scoring(self, service, model, func, *args):
+        '''
+        Run a blocking scoring job on the shared scheduler and await its result.
+        The event loop shared by all services stays free while the job runs.
+        '''
+        future = self.scheduler.submit(model, func, *args, priority=SERVICE_PRIORITIES.get(service, len(SERVICE_PRIORITIES)))
+        return await asyncio.wrap_future(future)
+
+    async def score_arrivals(self, queue, prompt, service, model):
+        '''
+        Score validated (axon, response) pairs from the queue until None is received.
+        Everything that arrived while the previous batch was scored is scored together
+        by the service's score_responses, and the scores are applied on the event loop.
+        '''
+        finished = False
+        while not finished:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            finished = None in batch
+            batch = [item for item in batch if item is not None]
+            if batch:
+                results = await self.run_scoring(service, model, self.score_responses, batch, prompt)
+                self.apply_scores(results)
+
+    async def start_round(self, coro, max_rounds=2):
+        '''
+        Start a round in the background and return once fewer than max_rounds are in flight,
+        so the next round can be queried while the previous one is still being scored.
+        '''
+        if not hasattr(self, 'rounds'):
+            self.rounds = set()
+        while len(self.rounds) >= max_rounds:
+            await asyncio.wait(set(self.rounds), return_when=asyncio.FIRST_COMPLETED)
+        task = asyncio.create_task(coro)
+        self.rounds.add(task)
+        task.add_done_callback(self.finish_round)
+        return task
+
+    def finish_round(self, task):
+        self.rounds.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            bt.logging.error(f"An error occurred in a validation round: {task.exception()}")
+
     async def run_async(self):
         raise NotImplementedError
\ No newline at end of file
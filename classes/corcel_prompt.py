@@ -1,9 +1,10 @@
 import requests
+from requests.adapters import HTTPAdapter
 import bittensor as bt
 import os
 
 class CorcelAPI:
-    def __init__(self):
+    def __init__(self, timeout=60, pool_size=4):
         self.base_url = "https://api.corcel.io/v1/text/cortext/chat"
         self.api_key = os.environ.get('CORCEL_API_KEY')
         if self.api_key is None:
@@ -15,9 +16,13 @@ class CorcelAPI:
             "accept": "application/json",
             "content-type": "application/json"
         }
+        # One pooled session keeps the connection to the API alive across requests
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
     
     def post_request(self, data):
-        response = requests.post(self.base_url, headers=self.headers, json=data)
+        response = self.session.post(self.base_url, headers=self.headers, json=data, timeout=self.timeout)
         # Check the HTTP status code
         if response.status_code == 200:
             # If status code is 200, parse the response
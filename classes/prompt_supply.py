@@ -0,0 +1,65 @@
+import asyncio
+import random
+import bittensor as bt
+
+
+class PromptSupply:
+    '''
+    Bounded queue of ready-to-use prompts for one validator service.
+
+    A background task fills the queue: it fetches a prompt from the Corcel API,
+    falls back to the HuggingFace prompt pool when the API fails, normalizes the
+    prompt and drops prompts longer than max_length. The validator loop then only
+    dequeues a prompt that is ready, and the API is called only for prompts that
+    are actually used.
+    '''
+    def __init__(self, service, fetch, prompts, normalize, max_length=256, size=4):
+        self.service = service
+        self.fetch = fetch            # Blocking Corcel API call, e.g. CorcelAPI.get_TTS
+        self.prompts = prompts        # HuggingFace prompt pool, loaded once by the service
+        self.normalize = normalize    # e.g. AIModelService.convert_numeric_values
+        self.max_length = max_length
+        self.queue = asyncio.Queue(maxsize=size)
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.fill())
+        return self.task
+
+    async def get(self):
+        '''Returns (prompt, source) where source is "Corcel API" or "HuggingFace Dataset".'''
+        self.start()
+        return await self.queue.get()
+
+    async def fill(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                item = await loop.run_in_executor(None, self.next_prompt)
+                await self.queue.put(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                bt.logging.error(f"An error occurred while preparing a {self.service} prompt: {e}")
+                await asyncio.sleep(5)
+
+    def next_prompt(self):
+        try:
+            prompt = self.fetch()
+        except Exception as e:
+            bt.logging.error(f"An error occurred while fetching prompt: {e}")
+            prompt = None
+        if prompt:
+            prompt = self.normalize(prompt)
+            if len(prompt) <= self.max_length:
+                return prompt, "Corcel API"
+            bt.logging.error(f'The length of current Prompt is greater than {self.max_length}. Skipping current prompt.')
+        return self.fallback_prompt(), "HuggingFace Dataset"
+
+    def fallback_prompt(self):
+        while True:
+            prompt = self.normalize(random.choice(self.prompts))
+            if len(prompt) <= self.max_length:
+                return prompt
+            bt.logging.error(f'The length of current Prompt is greater than {self.max_length}. Skipping current prompt.')
@@ -1,5 +1,6 @@
 
 from classes.aimodel import AIModelService
+from classes.prompt_supply import PromptSupply
 import os
 import bittensor as bt
 import asyncio
@@ -16,8 +17,6 @@ import lib
 import traceback
 import pandas as pd
 import sys
-import wave
-import contextlib
 import numpy as np
 import wandb
 # Set the project root path
@@ -43,6 +42,10 @@ class MusicGenerationService(AIModelService):
         self.duration = 755  #755 tokens = 15 seconds music
         self.lock = asyncio.Lock()
         self.best_uid = self.priority_uids(self.metagraph)
+        self.prompt_supply = PromptSupply("Text-To-Music", self.api.get_TTM, self.prompts, self.convert_numeric_values)
+        # Load the CLAP model once, before the first round
+        lib.ttm_score.ClapScoringEngine.get_instance(device=self.config.scoring_device)
+        self.evaluator = lib.ttm_score.MusicQualityEvaluator()
         
 
     def load_prompts(self):
@@ -67,15 +70,9 @@ class MusicGenerationService(AIModelService):
                 traceback.print_exc()
 
     async def main_loop_logic(self, step):
-        g_prompt = None
-        try:
-            c_prompt = self.api.get_TTM()
-        except Exception as e:
-            bt.logging.error(f"An error occurred while fetching prompt: {e}")
-            c_prompt = None
         # Sync and update weights logic
         if step % 10 == 0:
-            self.metagraph.sync(subtensor=self.subtensor)
+            self.sync_metagraph()
             self.best_uid = self.priority_uids(self.metagraph)
 
         uids = self.metagraph.uids.tolist()
@@ -88,34 +85,35 @@ class MusicGenerationService(AIModelService):
             del new_scores
 
         if step % 5 == 0:
+            # Prompts are fetched, normalized and length-filtered in the background
+            g_prompt, source = await self.prompt_supply.get()
             async with self.lock:
-                # Use the API prompt if available; otherwise, load prompts from HuggingFace
-                if c_prompt:
-                    bt.logging.info(f"--------------------------------- Prompt are being used from Corcel API for Text-To-Music at Step: {step} --------------------------------- ")
-                    g_prompt = self.convert_numeric_values(c_prompt)  # Use the prompt from the API
-                else:
-                    # Fetch prompts from HuggingFace if API failed
-                    bt.logging.info(f"--------------------------------- Prompt are being used from HuggingFace Dataset for Text-To-Music at Step: {step} --------------------------------- ")
-                    g_prompts = self.load_prompts()
-                    g_prompt = random.choice(g_prompts)  # Choose a random prompt from HuggingFace
-                    g_prompt = self.convert_numeric_values(g_prompt)
-
-                while len(g_prompt) > 256:
-                    bt.logging.error(f'The length of current Prompt is greater than 256. Skipping current prompt.')
-                    g_prompt = random.choice(g_prompts)
-                    g_prompt = self.convert_numeric_values(g_prompt)
-
+                bt.logging.info(f"--------------------------------- Prompt are being used from {source} for Text-To-Music at Step: {step} --------------------------------- ")
                 filtered_axons = self.get_filtered_axons_from_combinations()
                 bt.logging.info(f"______________TTM-Prompt______________: {g_prompt}")
-                responses = self.query_network(filtered_axons,g_prompt)
-                self.process_responses(filtered_axons,responses, g_prompt)
+                # Rounds stay sequential since every round writes the same per-hotkey files
+                await self.run_round(filtered_axons, g_prompt)
 
                 if self.last_reset_weights_block + 1800 < self.current_block:
                     bt.logging.info(f"Clearing weights for validators and nodes without IPs")
                     self.last_reset_weights_block = self.current_block        
                     # set all nodes without ips set to 0
-                    self.scores = self.scores * torch.Tensor([self.metagraph.neurons[uid].axon_info.ip != '0.0.0.0' for uid in self.metagraph.uids])
+                    self.scores = self.metagraph_index.mask_weights(self.scores)
     
+    async def run_round(self, filtered_axons, prompt):
+        # Responses are queued for scoring as they arrive instead of after the slowest miner
+        queue = asyncio.Queue()
+        scorer = asyncio.create_task(self.score_arrivals(queue, prompt, "Text-To-Music", "clap"))
+        try:
+            synapse = lib.protocol.MusicGeneration(text_input=prompt, duration=self.duration)
+            async for axon, response in self.query_as_completed(filtered_axons, synapse, timeout=140):
+                if self.validate_response(axon, response):
+                    queue.put_nowait((axon, response))
+        finally:
+            queue.put_nowait(None)
+            await scorer
+        bt.logging.info(f"Scores after update in TTM: {self.scores}")
+
     def query_network(self,filtered_axons, prompt):
         # Network querying logic
         
@@ -135,28 +133,26 @@ class MusicGenerationService(AIModelService):
         bt.logging.info(f"Scores after update in TTM: {self.scores}")
 
 
-    def process_response(self, axon, response, prompt):
+    def validate_response(self, axon, response):
         try:
-            music_output = response.music_output
             if response is not None and isinstance(response, lib.protocol.MusicGeneration) and response.music_output is not None and response.dendrite.status_code == 200:
                 bt.logging.success(f"Received music output from {axon.hotkey}")
-                file = self.handle_music_output(axon, music_output, prompt, response.model_name)
-                return file
+                return True
             elif response.dendrite.status_code != 403:
                 self.punish(axon, service="Text-To-Music", punish_message=response.dendrite.status_message)
-            else:
-                pass
+        except Exception as e:
+            bt.logging.error(f'An error occurred while handling speech output: {e}')
+        return False
+
+    def process_response(self, axon, response, prompt):
+        try:
+            if self.validate_response(axon, response):
+                file = self.handle_music_output(axon, response.music_output, prompt, response.model_name)
+                return file
         except Exception as e:
             bt.logging.error(f'An error occurred while handling speech output: {e}')
 
 
-    def get_duration(self, wav_file_path):
-        with contextlib.closing(wave.open(wav_file_path,'r')) as f:
-            frames = f.getnframes()
-            rate = f.getframerate()
-            duration = frames / float(rate)
-            return duration
-        
     def score_adjustment(self, score, duration):
         conditions = [
             (lambda d: 14.5 <= d < 15, 0.9),
@@ -173,10 +169,73 @@ class MusicGenerationService(AIModelService):
 
 
     def handle_music_output(self, axon, music_output, prompt, model_name):
-        token = 0
+        results = self.score_music_outputs([(axon, music_output, model_name)], prompt)
+        if not results:
+            return None
+        _, output_path, score = results[0]
+        self.update_score(axon, score, service="Text-To-Music", ax=self.filtered_axon)
+        return output_path
+
+    def score_responses(self, responses, prompt):
+        # (axon, response) pairs that passed validate_response
+        results = self.score_music_outputs([(axon, response.music_output, response.model_name) for axon, response in responses], prompt)
+        return [(axon, score) for axon, _, score in results]
+
+    def apply_scores(self, results):
+        for axon, score in results:
+            self.update_score(axon, score, service="Text-To-Music", ax=self.filtered_axon)
+
+    def score_music_outputs(self, outputs, prompt):
+        """
+        Save the music outputs and score them together with the resident CLAP model.
+
+        Parameters:
+        outputs (list): (axon, music_output, model_name) tuples.
+        prompt (str): The input prompt used to generate the music.
+
+        Returns:
+        list: (axon, output_path, score) tuples for the outputs that could be saved.
+        """
+        saved = []
+        for axon, music_output, model_name in outputs:
+            result = self.save_music_output(axon, music_output, prompt, model_name)
+            if result is not None:
+                saved.append((axon, ) + result)
+        if not saved:
+            return []
+
+        # Score the decoded buffers, the saved files are only kept for the API and wandb
+        scores = self.score_outputs(
+            [audio_data for _, _, audio_data, _ in saved],
+            [sampling_rate for _, _, _, sampling_rate in saved],
+            prompt)
+        results = []
+        for (axon, output_path, audio_data, sampling_rate), score in zip(saved, scores):
+            duration = audio_data.shape[-1] / sampling_rate
+            bt.logging.info(f"Score output after analysing the output file: {score}")
+            try:
+                if duration < 15:
+                    score = self.score_adjustment(score, duration)
+                    bt.logging.info(f"Score updated based on short duration than the required by the client: {score}")
+                else:
+                    bt.logging.info(f"Duration is greater than 15 seconds. No need to penalize the score.")
+            except Exception as e:
+                bt.logging.error(f"Error in penalizing the score: {e}")
+            bt.logging.info(f"Aggregated Score from Smoothness, SNR and Consistancy Metric: {score}")
+            results.append((axon, output_path, score))
+        return results
+
+    def save_music_output(self, axon, music_output, prompt, model_name):
+        """
+        Normalize the music output, save it as a .wav file and upload it to wandb.
+
+        Returns:
+        tuple: (output_path, audio_data, sampling_rate) where audio_data is the
+        normalized waveform shaped [1, samples], or None on failure.
+        """
         try:
-            # Convert the list to a tensor
-            speech_tensor = torch.Tensor(music_output)
+            # Convert the audio payload (or list from older miners) to a tensor
+            speech_tensor = torch.as_tensor(lib.protocol.decode_audio(music_output), dtype=torch.float32)
             # Normalize the speech data
             audio_data = speech_tensor / torch.max(torch.abs(speech_tensor))
 
@@ -189,39 +248,45 @@ class MusicGenerationService(AIModelService):
             # Save the audio data as a .wav file
             # After saving the audio file
             output_path = os.path.join('/tmp', f'output_music_{axon.hotkey}.wav')
-            sampling_rate = 32000
-            torchaudio.save(output_path, src=audio_data_int, sample_rate=sampling_rate)
-            bt.logging.info(f"Saved audio file to {output_path}")
-
-            try:
-                uid_in_metagraph = self.metagraph.hotkeys.index(axon.hotkey)
-                wandb.log({f"TTM prompt: {prompt}": wandb.Audio(np.array(audio_data_int_), caption=f'For HotKey: {axon.hotkey[:10]} and uid {uid_in_metagraph}', sample_rate=sampling_rate)})
-                bt.logging.success(f"TTM Audio file uploaded to wandb successfully for Hotkey {axon.hotkey} and UID {uid_in_metagraph}")
-            except Exception as e:
-                bt.logging.error(f"Error uploading TTM audio file to wandb: {e}")
+            sampling_rate = music_output.sample_rate if isinstance(music_output, lib.protocol.AudioPayload) else 32000
+            # Scoring jobs run on several scheduler threads, file writes and wandb uploads go one at a time
+            with self.output_lock:
+                torchaudio.save(output_path, src=audio_data_int, sample_rate=sampling_rate)
+                bt.logging.info(f"Saved audio file to {output_path}")
+
+                try:
+                    uid_in_metagraph = self.metagraph_index.uid_for_hotkey(axon.hotkey)
+                    wandb.log({f"TTM prompt: {prompt}": wandb.Audio(np.array(audio_data_int_), caption=f'For HotKey: {axon.hotkey[:10]} and uid {uid_in_metagraph}', sample_rate=sampling_rate)})
+                    bt.logging.success(f"TTM Audio file uploaded to wandb successfully for Hotkey {axon.hotkey} and UID {uid_in_metagraph}")
+                except Exception as e:
+                    bt.logging.error(f"Error uploading TTM audio file to wandb: {e}")
 
             # Calculate the duration
-            duration = self.get_duration(output_path)
-            token = duration * 50.2
+            duration = audio_data.shape[-1] / sampling_rate
             bt.logging.info(f"The duration of the audio file is {duration} seconds.")
-            # Score the output and update the weights
-            score = self.score_output(output_path, prompt)
-            bt.logging.info(f"Score output after analysing the output file: {score}")
-            try:
-                if duration < 15:
-                    score = self.score_adjustment(score, duration)
-                    bt.logging.info(f"Score updated based on short duration than the required by the client: {score}")
-                else:
-                    bt.logging.info(f"Duration is greater than 15 seconds. No need to penalize the score.")
-            except Exception as e:
-                bt.logging.error(f"Error in penalizing the score: {e}")
-            bt.logging.info(f"Aggregated Score from Smoothness, SNR and Consistancy Metric: {score}")
-            self.update_score(axon, score, service="Text-To-Music", ax=self.filtered_axon)
-            return output_path
+            return output_path, audio_data.unsqueeze(0), sampling_rate
 
         except Exception as e:
             bt.logging.error(f"Error processing Music output: {e}")
+            return None
 
+    def score_outputs(self, waveforms, sampling_rates, prompt):
+        """
+        Score all outputs of a round with one batched CLAP pass.
+
+        Parameters:
+        waveforms (list): Output audio tensors, each shaped [channels, samples].
+        sampling_rates (list): Sampling rate of each output.
+        prompt (str): The input prompt used to generate the music.
+
+        Returns:
+        list: One score per output, 0.0 where scoring failed.
+        """
+        try:
+            return self.evaluator.evaluate_music_quality_batch(waveforms, sampling_rates, prompt)
+        except Exception as e:
+            bt.logging.error(f"Error scoring outputs: {e}")
+            return [0.0] * len(waveforms)
 
     def score_output(self, output_path, prompt):
         """
@@ -235,9 +300,8 @@ class MusicGenerationService(AIModelService):
         float: The calculated score.
         """
         try:
-            score_object = lib.ttm_score.MusicQualityEvaluator()
-            # Call the scoring function from lib.reward
-            score = score_object.evaluate_music_quality(output_path, prompt)
+            # Call the scoring function from lib.ttm_score
+            score = self.evaluator.evaluate_music_quality(output_path, prompt)
             return score
         except Exception as e:
             bt.logging.error(f"Error scoring output: {e}")
@@ -262,16 +326,8 @@ class MusicGenerationService(AIModelService):
 
 
     def get_filtered_axons(self):
-        # Get the uids of all miners in the network.
-        uids = self.metagraph.uids.tolist()
-        queryable_uids = (self.metagraph.total_stake >= 0)
-        # Remove the weights of miners that are not queryable.
-        queryable_uids = queryable_uids * torch.Tensor([self.metagraph.neurons[uid].axon_info.ip != '0.0.0.0' for uid in uids])
-        queryable_uid = queryable_uids * torch.Tensor([
-            any(self.metagraph.neurons[uid].axon_info.ip == ip for ip in lib.BLACKLISTED_IPS) or
-            any(self.metagraph.neurons[uid].axon_info.ip.startswith(prefix) for prefix in lib.BLACKLISTED_IPS_SEG)
-            for uid in uids
-        ])
+        # Miners with stake and a served IP, from the index built at the last metagraph sync
+        queryable_uids = self.metagraph_index.queryable_mask()
         active_miners = torch.sum(queryable_uids)
         dendrites_per_query = self.total_dendrites_per_query
 
@@ -287,13 +343,9 @@ class MusicGenerationService(AIModelService):
         # less than 3 set to 3
         if dendrites_per_query < self.minimum_dendrites_per_query:
                 dendrites_per_query = self.minimum_dendrites_per_query
-        # zip uids and queryable_uids, filter only the uids that are queryable, unzip, and get the uids
-        zipped_uids = list(zip(uids, queryable_uids))
-        zipped_uid = list(zip(uids, queryable_uid))
-        filtered_zipped_uids = list(filter(lambda x: x[1], zipped_uids))
-        filtered_uids = [item[0] for item in filtered_zipped_uids] if filtered_zipped_uids else []
-        filtered_zipped_uid = list(filter(lambda x: x[1], zipped_uid))
-        filtered_uid = [item[0] for item in filtered_zipped_uid] if filtered_zipped_uid else []
+        # Get the uids that are queryable, and those of them that use a blacklisted IP
+        filtered_uids = self.metagraph_index.uids_where(queryable_uids)
+        filtered_uid = self.metagraph_index.uids_where(queryable_uids & self.metagraph_index.blacklisted_ip)
         self.filtered_axon = filtered_uid
         subset_length = min(dendrites_per_query, len(filtered_uids))
         # Shuffle the order of members
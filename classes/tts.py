@@ -1,5 +1,6 @@
 
 from classes.aimodel import AIModelService
+from classes.prompt_supply import PromptSupply
 import os
 import bittensor as bt
 import asyncio
@@ -42,6 +43,9 @@ class TextToSpeechService(AIModelService):
         self.combinations = []
         self.lock = asyncio.Lock()
         self.best_uid = self.priority_uids(self.metagraph)
+        self.prompt_supply = PromptSupply("Text-To-Speech", self.api.get_TTS, self.prompts, self.convert_numeric_values)
+        # Load the scoring models once, before the first round
+        lib.reward.SpeechScoringEngine.get_instance(device=self.config.scoring_device)
         
     def load_prompts(self):
         gs_dev = load_dataset("etechgrid/Prompts_for_Voice_cloning_and_TTS")
@@ -102,46 +106,44 @@ class TextToSpeechService(AIModelService):
                 traceback.print_exc()
 
     async def main_loop_logic(self, step):
-        g_prompt = None
-        try:
-            c_prompt = self.api.get_TTS()
-        except Exception as e:
-            bt.logging.error(f"An error occurred while fetching prompt: {e}")
-            c_prompt = None
         # Sync and update weights logic
         if step % 10 == 0:
-            self.metagraph.sync(subtensor=self.subtensor)
+            self.sync_metagraph()
             bt.logging.info(f"🔄 Syncing metagraph with subtensor.")
         
         if step % 5 == 0:
+            # Prompts are fetched, normalized and length-filtered in the background
+            g_prompt, source = await self.prompt_supply.get()
             async with self.lock:
-                # Use the API prompt if available; otherwise, load prompts from HuggingFace
-                if c_prompt:
-                    bt.logging.info(f"--------------------------------- Prompt are being used from Corcel API for Text-To-Speech at Step: {step} --------------------------------- ")
-                    g_prompt = self.convert_numeric_values(c_prompt)  # Use the prompt from the API
-                else:
-                    # Fetch prompts from HuggingFace if API failed
-                    bt.logging.info(f"--------------------------------- Prompt are being used from HuggingFace Dataset for Text-To-Speech at Step: {step} --------------------------------- ")
-                    g_prompts = self.load_prompts()
-                    g_prompt = random.choice(g_prompts)  # Choose a random prompt from HuggingFace
-                    g_prompt = self.convert_numeric_values(g_prompt)
-
-                while len(g_prompt) > 256:
-                    bt.logging.error(f'The length of current Prompt is greater than 256. Skipping current prompt.')
-                    g_prompt = random.choice(g_prompts)
-                    g_prompt = self.convert_numeric_values(g_prompt)
-
+                bt.logging.info(f"--------------------------------- Prompt are being used from {source} for Text-To-Speech at Step: {step} --------------------------------- ")
                 filtered_axons = self.get_filtered_axons_from_combinations()
                 bt.logging.info(f"______________TTS-Prompt______________: {g_prompt}")
-                responses = self.query_network(filtered_axons, g_prompt)
-                self.process_responses(filtered_axons, responses, g_prompt)
-
-                if self.last_reset_weights_block + 50 < self.current_block:  
-                    bt.logging.trace(f"Clearing weights for validators and nodes without IPs")
-                    self.last_reset_weights_block = self.current_block        
-                    # set all nodes without ips set to 0
-                    self.scores = self.scores * torch.Tensor([self.metagraph.neurons[uid].axon_info.ip != '0.0.0.0' for uid in self.metagraph.uids])
+
+            # Query and score in the background, the next round starts while this one is scored
+            await self.start_round(self.run_round(filtered_axons, g_prompt))
+
+            if self.last_reset_weights_block + 50 < self.current_block:  
+                bt.logging.trace(f"Clearing weights for validators and nodes without IPs")
+                self.last_reset_weights_block = self.current_block        
+                # set all nodes without ips set to 0
+                self.scores = self.metagraph_index.mask_weights(self.scores)
                     
+    async def run_round(self, filtered_axons, prompt):
+        # Responses are queued for scoring as they arrive instead of after the slowest miner
+        queue = asyncio.Queue()
+        scorer = asyncio.create_task(self.score_arrivals(queue, prompt, "Text-To-Speech", "speech"))
+        try:
+            synapse = lib.protocol.TextToSpeech(text_input=prompt)
+            async for axon, response in self.query_as_completed(filtered_axons, synapse, timeout=50):
+                if self.validate_response(axon, response):
+                    queue.put_nowait((axon, response))
+        finally:
+            queue.put_nowait(None)
+            await scorer
+
+        bt.logging.info(f"Scores after update in TTS: {self.scores}")
+        self.update_block()
+
     def query_network(self,filtered_axons, prompt):
         # Network querying logic
         
@@ -167,32 +169,85 @@ class TextToSpeechService(AIModelService):
             bt.logging.info(f"Skipping weight update. Last update was at block {self.last_updated_block}")
 
     def process_responses(self,filtered_axons, responses, prompt):
-        for axon, response in zip(filtered_axons, responses):
-            if response is not None and isinstance(response, lib.protocol.TextToSpeech):
-                self.process_response(axon, response, prompt)
-        
+        # Collect every valid output of the round, then score them together
+        valid = [(axon, response) for axon, response in zip(filtered_axons, responses) if self.validate_response(axon, response)]
+        self.apply_scores(self.score_responses(valid, prompt))
         bt.logging.info(f"Scores after update in TTS: {self.scores}")
         self.update_block()
 
+    def score_responses(self, responses, prompt):
+        """
+        Save and score validated responses in one batched pass.
 
-    def process_response(self, axon, response, prompt):
+        Parameters:
+        responses (list): (axon, response) pairs that passed validate_response.
+        prompt (str): The input prompt used to generate the speech outputs.
+
+        Returns:
+        list: (axon, score) pairs for the outputs that could be saved.
+        """
+        outputs = []
+        for axon, response in responses:
+            saved = self.save_speech_output(axon, response.speech_output, prompt, response.model_name)
+            if saved is not None:
+                outputs.append((axon, saved))
+        if not outputs:
+            return []
+
+        scores = self.score_outputs(
+            [audio_data for _, (_, audio_data, _) in outputs],
+            [sampling_rate for _, (_, _, sampling_rate) in outputs],
+            prompt)
+        return [(axon, score) for (axon, _), score in zip(outputs, scores)]
+
+    def apply_scores(self, results):
+        # Runs on the event loop so that score updates never race each other
+        for axon, score in results:
+            bt.logging.info(f"Aggregated Score from the NISQA and WER Metric for {axon.hotkey}: {score}")
+            self.update_score(axon, score, service="Text-To-Speech", ax=self.filtered_axon)
+
+    def validate_response(self, axon, response):
         try:
-            speech_output = response.speech_output
             if response is not None and isinstance(response, lib.protocol.TextToSpeech) and response.speech_output is not None and response.dendrite.status_code == 200:
                 bt.logging.success(f"Received Text to speech output from {axon.hotkey}")
-                file = self.handle_speech_output(axon, speech_output, prompt, response.model_name)
-                return file
+                return True
             elif response.dendrite.status_code != 403:
                 self.punish(axon, service="Text-To-Speech", punish_message=response.dendrite.status_message)
-            else:
-                pass
+        except Exception as e:
+            bt.logging.error(f'An error occurred while handling speech output: {e}')
+        return False
+
+    def process_response(self, axon, response, prompt):
+        try:
+            if self.validate_response(axon, response):
+                file = self.handle_speech_output(axon, response.speech_output, prompt, response.model_name)
+                return file
         except Exception as e:
             bt.logging.error(f'An error occurred while handling speech output: {e}')
 
     def handle_speech_output(self, axon, speech_output, prompt, model_name):
         try:
-            # Convert the list to a tensor
-            speech_tensor = torch.Tensor(speech_output)
+            output_path, audio_data, sampling_rate = self.save_speech_output(axon, speech_output, prompt, model_name)
+            # Score the output and update the weights
+            score = self.score_output(audio_data, sampling_rate, prompt)
+            bt.logging.info(f"Aggregated Score from the NISQA and WER Metric: {score}")
+            self.update_score(axon, score, service="Text-To-Speech", ax=self.filtered_axon)
+            return output_path
+
+        except Exception as e:
+            bt.logging.error(f"Error processing speech output: {e}")
+
+    def save_speech_output(self, axon, speech_output, prompt, model_name):
+        """
+        Normalize the speech output, save it as a .wav file and upload it to wandb.
+
+        Returns:
+        tuple: (output_path, audio_data, sampling_rate) where audio_data is the
+        normalized waveform shaped [1, samples], or None on failure.
+        """
+        try:
+            # Convert the audio payload (or list from older miners) to a tensor
+            speech_tensor = torch.as_tensor(lib.protocol.decode_audio(speech_output), dtype=torch.float32)
             # Normalize the speech data
             audio_data = speech_tensor / torch.max(torch.abs(speech_tensor))
 
@@ -203,55 +258,69 @@ class TextToSpeechService(AIModelService):
             audio_data_int = audio_data_int_.unsqueeze(0)
 
             # Save the audio data as a .wav file
+            # One file per hotkey, overwritten on every round. Other services may still be scoring
+            # their own files in /tmp, so nothing else is deleted here.
             output_path = os.path.join('/tmp', f'output_{axon.hotkey}.wav')
-            
-            # Check if any WAV file with .wav extension exists and delete it
-            existing_wav_files = [f for f in os.listdir('/tmp') if f.endswith('.wav')]
-            for existing_file in existing_wav_files:
-                try:
-                    os.remove(os.path.join('/tmp', existing_file))
-                except Exception as e:
-                    bt.logging.error(f"Error deleting existing WAV file: {e}")
 
             # Save the audio file
-            if model_name == "suno/bark":
+            if isinstance(speech_output, lib.protocol.AudioPayload):
+                sampling_rate = speech_output.sample_rate
+            elif model_name == "suno/bark":
                 sampling_rate = 24000 
             elif model_name == "elevenlabs/eleven": 
                 sampling_rate = 44000
             else:
                 sampling_rate = 16000
-            torchaudio.save(output_path, src=audio_data_int, sample_rate=sampling_rate)
-            print(f"Saved audio file to {output_path}")
-            try:
-                uid_in_metagraph = self.metagraph.hotkeys.index(axon.hotkey)
-                wandb.log({f"Text to Speech prompt:{prompt} ": wandb.Audio(np.array(audio_data_int_), caption=f'For HotKey: {axon.hotkey[:10]} and uid {uid_in_metagraph}', sample_rate=sampling_rate)})
-                bt.logging.success(f"TTS Audio file uploaded to wandb successfully for Hotkey {axon.hotkey}")
-            except Exception as e:
-                bt.logging.error(f"Error uploading TTS audio to wandb for Hotkey {axon.hotkey}: {e}")
-            # Score the output and update the weights
-            score = self.score_output(output_path, prompt)
-            bt.logging.info(f"Aggregated Score from the NISQA and WER Metric: {score}")
-            self.update_score(axon, score, service="Text-To-Speech", ax=self.filtered_axon)
-            return output_path
+            # Scoring jobs run on several scheduler threads, file writes and wandb uploads go one at a time
+            with self.output_lock:
+                torchaudio.save(output_path, src=audio_data_int, sample_rate=sampling_rate)
+                print(f"Saved audio file to {output_path}")
+                try:
+                    uid_in_metagraph = self.metagraph_index.uid_for_hotkey(axon.hotkey)
+                    wandb.log({f"Text to Speech prompt:{prompt} ": wandb.Audio(np.array(audio_data_int_), caption=f'For HotKey: {axon.hotkey[:10]} and uid {uid_in_metagraph}', sample_rate=sampling_rate)})
+                    bt.logging.success(f"TTS Audio file uploaded to wandb successfully for Hotkey {axon.hotkey}")
+                except Exception as e:
+                    bt.logging.error(f"Error uploading TTS audio to wandb for Hotkey {axon.hotkey}: {e}")
+            return output_path, audio_data.unsqueeze(0), sampling_rate
 
         except Exception as e:
             bt.logging.error(f"Error processing speech output: {e}")
+            return None
 
+    def score_outputs(self, waveforms, sampling_rates, prompt):
+        """
+        Score all outputs of a round in one batched pass.
+
+        Parameters:
+        waveforms (list): Output audio tensors, each shaped [channels, samples].
+        sampling_rates (list): Sampling rate of each output.
+        prompt (str): The input prompt used to generate the speech outputs.
+
+        Returns:
+        list: One score per output, 0.0 where scoring failed.
+        """
+        try:
+            scores = lib.reward.SpeechScoringEngine.get_instance().score_batch(waveforms, prompt, sampling_rates)
+            return [score if score is not None else 0.0 for score in scores]
+        except Exception as e:
+            bt.logging.error(f"Error scoring outputs: {e}")
+            return [0.0] * len(waveforms)
 
-    def score_output(self, output_path, prompt):
+    def score_output(self, waveform, sampling_rate, prompt):
         """
-        Calculate a score for the output audio file based on the given prompt.
+        Calculate a score for the output audio based on the given prompt.
 
         Parameters:
-        output_path (str): Path to the output audio file.
+        waveform (torch.Tensor): The output audio, shaped [channels, samples].
+        sampling_rate (int): Sampling rate of the output audio.
         prompt (str): The input prompt used to generate the speech output.
 
         Returns:
         float: The calculated score.
         """
         try:
-            # Call the scoring function from lib.reward
-            score = lib.reward.score(output_path, prompt)
+            # Score with the resident NISQA and WER models from lib.reward
+            score = lib.reward.SpeechScoringEngine.get_instance().score(waveform, prompt, sampling_rate)
             return score
         except Exception as e:
             bt.logging.error(f"Error scoring output: {e}")
@@ -274,16 +343,8 @@ class TextToSpeechService(AIModelService):
         return filtered_axons
     
     def get_filtered_axons(self):
-        # Get the uids of all miners in the network.
-        uids = self.metagraph.uids.tolist()
-        queryable_uids = (self.metagraph.total_stake >= 0)
-        # Remove the weights of miners that are not queryable.
-        queryable_uids = queryable_uids * torch.Tensor([self.metagraph.neurons[uid].axon_info.ip != '0.0.0.0' for uid in uids])
-        queryable_uid = queryable_uids * torch.Tensor([
-            any(self.metagraph.neurons[uid].axon_info.ip == ip for ip in lib.BLACKLISTED_IPS) or
-            any(self.metagraph.neurons[uid].axon_info.ip.startswith(prefix) for prefix in lib.BLACKLISTED_IPS_SEG)
-            for uid in uids
-        ])
+        # Miners with stake and a served IP, from the index built at the last metagraph sync
+        queryable_uids = self.metagraph_index.queryable_mask()
         active_miners = torch.sum(queryable_uids)
         dendrites_per_query = self.total_dendrites_per_query
 
@@ -299,13 +360,9 @@ class TextToSpeechService(AIModelService):
         # less than 3 set to 3
         if dendrites_per_query < self.minimum_dendrites_per_query:
                 dendrites_per_query = self.minimum_dendrites_per_query
-        # zip uids and queryable_uids, filter only the uids that are queryable, unzip, and get the uids
-        zipped_uids = list(zip(uids, queryable_uids))
-        zipped_uid = list(zip(uids, queryable_uid))
-        filtered_zipped_uids = list(filter(lambda x: x[1], zipped_uids))
-        filtered_uids = [item[0] for item in filtered_zipped_uids] if filtered_zipped_uids else []
-        filtered_zipped_uid = list(filter(lambda x: x[1], zipped_uid))
-        filtered_uid = [item[0] for item in filtered_zipped_uid] if filtered_zipped_uid else []
+        # Get the uids that are queryable, and those of them that use a blacklisted IP
+        filtered_uids = self.metagraph_index.uids_where(queryable_uids)
+        filtered_uid = self.metagraph_index.uids_where(queryable_uids & self.metagraph_index.blacklisted_ip)
         self.filtered_axon = filtered_uid
         subset_length = min(dendrites_per_query, len(filtered_uids))
         # Shuffle the order of members
@@ -319,11 +376,8 @@ class TextToSpeechService(AIModelService):
     
     def update_weights(self, scores):
         # Process scores for blacklisted miners
-        for idx, uid in enumerate(self.metagraph.uids):
-            neuron = self.metagraph.neurons[uid]
-            if neuron.coldkey in lib.BLACKLISTED_MINER_COLDKEYS or neuron.hotkey in lib.BLACKLISTED_MINER_HOTKEYS:
-                scores[idx] = 0.0
-                bt.logging.info(f"Blacklisted miner detected: {uid}. Score set to 0.")
+        for uid in self.metagraph_index.zero_blacklisted(scores):
+            bt.logging.info(f"Blacklisted miner detected: {uid}. Score set to 0.")
 
         # Normalize scores to get weights
         weights = torch.nn.functional.normalize(scores, p=1, dim=0)
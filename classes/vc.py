@@ -17,6 +17,7 @@ import lib.protocol
 from lib.protocol import VoiceClone
 from lib.clone_score import CloneScore
 from classes.aimodel import AIModelService
+from classes.prompt_supply import PromptSupply
 import wandb
 import numpy as np
 
@@ -40,11 +41,16 @@ class VoiceCloningService(AIModelService):
         self.combinations = []
         self.lock = asyncio.Lock()
         self.best_uid = self.priority_uids(self.metagraph)
+        self.prompt_supply = PromptSupply("Voice Cloning", self.api.get_VC, self.prompts, self.convert_numeric_values)
         self.filtered_axon = []
         self.filtered_axons = []
         self.responses = None
         self.audio_file_path = ""
+        self.hf_voice_id = None
         self.text_input = ""
+        # Load the scoring models once, before the first round
+        lib.reward.SpeechScoringEngine.get_instance(device=self.config.scoring_device)
+        self.clone_score = CloneScore(device=self.config.scoring_device, similarity=self.config.vc_similarity, embedding_store=self.config.vc_embedding_store)
 
     def load_vc_prompts(self):
         gs_dev = load_dataset("etechgrid/Prompts_for_Voice_cloning_and_TTS")
@@ -76,42 +82,29 @@ class VoiceCloningService(AIModelService):
                 traceback.print_exc()
 
     async def process_huggingface_prompts(self, step):
-        try:
-            c_prompt = self.api.get_VC()
-        except Exception as e:
-            bt.logging.error(f"An error occurred while fetching prompt: {e}")
-            c_prompt = None
         if step % 150 == 0:
+            # Prompts are fetched, normalized and length-filtered in the background
+            text_input, source = await self.prompt_supply.get()
             async with self.lock:
-                if c_prompt:
-                    bt.logging.info(f"--------------------------------- Prompt and voices are being used from Corcel API for Voice Clone at Step: {step} ---------------------------------")
-                    self.text_input = self.convert_numeric_values(c_prompt)  # Use the prompt from the API
-                else:
-                    # Fetch prompts from HuggingFace if API failed
-                    bt.logging.info(f"--------------------------------- Prompt and voices are being used from HuggingFace Dataset for Voice Clone at Step: {step} ---------------------------------")
-                    self.text_input = random.choice(self.prompts)
-                    self.text_input = self.convert_numeric_values(self.text_input)
-                while len(self.text_input) > 256:
-                    bt.logging.error(f"The length of current Prompt is greater than 256. Skipping current prompt.")
-                    self.text_input = random.choice(self.prompts)
-                    self.text_input = self.convert_numeric_values(self.text_input)
-
+                bt.logging.info(f"--------------------------------- Prompt and voices are being used from {source} for Voice Clone at Step: {step} ---------------------------------")
+                self.text_input = text_input
                 bt.logging.info(f"______________VC-Prompt______________: {self.text_input}")
                 vc_voice = random.choice(self.audio_files)
                 audio_array = vc_voice['array']
                 sampling_rate = vc_voice['sampling_rate']
-                self.hf_voice_id = vc_voice['path'].split("/")[-1][:10]
+                # The full path identifies the reference voice, its speaker embedding is stored under it
+                self.hf_voice_id = vc_voice['path']
                 sf.write('input_file.wav', audio_array, sampling_rate)
                 self.audio_file_path = os.path.join(audio_subnet_path, "input_file.wav")
                 waveform, _ = torchaudio.load(self.audio_file_path)
-                clone_input = waveform.tolist()
+                clone_input = self.encode_clone_input(waveform, sampling_rate)
                 sample_rate = sampling_rate
                 await self.generate_voice_clone(self.text_input, clone_input, sample_rate)
 
     async def main_loop_logic(self, step):
         # Sync and update weights logic
         if step % 10 == 0:
-            self.metagraph.sync(subtensor=self.subtensor)
+            self.sync_metagraph()
             self.best_uid = self.priority_uids(self.metagraph)
 
         tasks = []
@@ -125,6 +118,15 @@ class VoiceCloningService(AIModelService):
         await asyncio.sleep(0.5)  # Delay at the end of each loop iteration
         return tasks
 
+    def encode_clone_input(self, waveform, sample_rate):
+        '''
+        The reference clip in the request format the miners accept. Miners that were not updated
+        only accept a list, so the AudioPayload is sent only with --vc_audio_payload.
+        '''
+        if self.config.vc_audio_payload:
+            return lib.protocol.AudioPayload.from_array(waveform, sample_rate)
+        return torch.as_tensor(waveform).tolist()
+
     def read_audio_file(self, path):
         try:
             # Read the audio file and return its content
@@ -137,43 +139,92 @@ class VoiceCloningService(AIModelService):
         try:
             filtered_axons = api_axon if api_axon else self.get_filtered_axons_from_combinations() 
             # for ax in self.filtered_axons:
-            self.responses = self.dendrite.query(
+            # Awaited so the event loop shared with TTS and TTM keeps running during the query
+            self.responses = await self.dendrite.forward(
                 filtered_axons,
                 lib.protocol.VoiceClone(text_input=text_input, clone_input=clone_input, sample_rate=sample_rate, hf_voice_id="name"), 
                 deserialize=True,
                 timeout=150
             )
-            # Process the responses if needed
-            processed_vc_file = self.process_voice_clone_responses(filtered_axons, text_input, input_file)
+            # Validation (and punishment) runs on the event loop, scoring runs off it
+            valid = [(axon, response) for axon, response in zip(filtered_axons, self.responses) if self.validate_response(axon, response)]
+            if input_file:
+                # API requests only need the cloned file, they do not change the scores
+                return await self.run_scoring("Voice Cloning", "clone", self.save_api_output, valid, text_input, input_file)
+            results = await self.run_scoring("Voice Cloning", "clone", self.score_responses, valid, text_input, self.audio_file_path, self.hf_voice_id)
+            self.apply_scores(results)
             bt.logging.info(f"Updated Scores for Voice Cloning: {self.scores}")
-            return processed_vc_file
         except Exception as e:
             print(f"An error occurred while processing the voice clone: {e}")
 
-    def process_voice_clone_responses(self,filtered_axons, text_input, input_file=None):
+    def validate_response(self, axon, response):
         try:
-            for axon, response in zip(filtered_axons, self.responses):
-                if response is not None and isinstance(response, lib.protocol.VoiceClone) and response.clone_output is not None and response.dendrite.status_code == 200:
-                    bt.logging.success(f"Received Voice Clone output from {axon.hotkey}")
-                    self.handle_clone_output(response, axon,  prompt=text_input, input_file=input_file)
-                    if input_file:
-                        vc_file = self.handle_clone_output(response, axon,  prompt=text_input, input_file=input_file)
-                        return vc_file
-                    else:
-                        self.handle_clone_output(response, axon,  prompt=text_input, input_file=input_file)
-                elif response.dendrite.status_code != 403:
-                    self.punish(axon, service="Voice Cloning", punish_message=response.dendrite.status_message)
-                else:
-                    pass
+            if response is not None and isinstance(response, lib.protocol.VoiceClone) and response.clone_output is not None and response.dendrite.status_code == 200:
+                bt.logging.success(f"Received Voice Clone output from {axon.hotkey}")
+                return True
+            elif response.dendrite.status_code != 403:
+                self.punish(axon, service="Voice Cloning", punish_message=response.dendrite.status_message)
         except Exception as e:
-            print(f"An error occurred while processing voice clone responses: {e}")
+            bt.logging.error(f"An error occurred while handling voice clone output: {e}")
+        return False
+
+    def save_api_output(self, responses, text_input, input_file):
+        '''Save the validated responses of an API request, returns the path of the first cloned file'''
+        for axon, response in responses:
+            saved = self.handle_clone_output(response, axon, prompt=text_input, input_file=input_file)
+            if saved is not None:
+                return saved[0]
+        return None
+
+    def score_responses(self, responses, text_input, reference_path, voice_id):
+        """
+        Save and score validated responses in one batched pass.
+
+        Parameters:
+        responses (list): (axon, response) pairs that passed validate_response.
+        text_input (str): The input prompt used to clone the voice.
+        reference_path (str): The reference clip sent to the miners.
+        voice_id (str): Identifier of the reference voice, used to store its speaker embedding.
+
+        Returns:
+        list: (axon, score) pairs for the outputs that could be saved.
+        """
+        outputs = []
+        for axon, response in responses:
+            saved = self.handle_clone_output(response, axon, prompt=text_input)
+            if saved is not None:
+                outputs.append((axon, saved))
+        if not outputs:
+            return []
+
+        # Every output of the round is scored against the same reference in one batch
+        scores = self.score_outputs(
+            reference_path,
+            [audio_data for _, (_, audio_data, _) in outputs],
+            [sampling_rate for _, (_, _, sampling_rate) in outputs],
+            text_input,
+            voice_id=voice_id)
+        return [(axon, score) for (axon, _), score in zip(outputs, scores)]
+
+    def apply_scores(self, results):
+        # Runs on the event loop so that score updates never race each other
+        for axon, score in results:
+            bt.logging.info(f"The score of the cloned file : {score}")
+            self.update_score(axon, score, service="Voice Cloning", ax=self.filtered_axon)
 
     def handle_clone_output(self, response, axon, prompt=None, input_file=None):
+        """
+        Normalize the cloned output, save it as a .wav file and upload it to wandb.
+
+        Returns:
+        tuple: (cloned_file_path, audio_data, sampling_rate) where audio_data is the
+        normalized waveform shaped [1, samples], or None on failure.
+        """
         try:
             if response is not None and response.clone_output is not None:
                 output = response.clone_output
-                # Convert the list to a tensor
-                clone_tensor = torch.Tensor(output)
+                # Convert the audio payload (or list from older miners) to a tensor
+                clone_tensor = torch.as_tensor(lib.protocol.decode_audio(output), dtype=torch.float32)
 
                 # Normalize the speech data
                 audio_data = clone_tensor / torch.max(torch.abs(clone_tensor))
@@ -181,46 +232,48 @@ class VoiceCloningService(AIModelService):
                 audio_data_int_ = (audio_data * 2147483647).type(torch.IntTensor)
                 # Add an extra dimension to make it a 2D tensor
                 audio_data_int = audio_data_int_.unsqueeze(0)
-                if response.model_name == "elevenlabs/eleven":
+                if isinstance(output, lib.protocol.AudioPayload):
+                    sampling_rate = output.sample_rate
+                elif response.model_name == "elevenlabs/eleven":
                     sampling_rate = 44000
                 else:
                     sampling_rate = 24000
-                if input_file:
-                    cloned_file_path = os.path.join('/tmp', 'API_cloned_'+ axon.hotkey[:] +'.wav' )
-                    torchaudio.save(cloned_file_path, src=audio_data_int, sample_rate=sampling_rate)
-                    score = self.score_output(input_file, cloned_file_path, prompt) # self.audio_file_path
-                    bt.logging.info(f"The cloned file for API have been saved successfully: {cloned_file_path}")
-                    try:
-                        uid_in_metagraph = self.metagraph.hotkeys.index(axon.hotkey)
-                        wandb.log({f"Voice Clone Prompt: {prompt}": wandb.Audio(np.array(audio_data_int_), caption=f'For HotKey: {axon.hotkey[:10]} and uid {uid_in_metagraph}', sample_rate=sampling_rate)})
-                        bt.logging.success(f"Voice Clone Audio file uploaded to wandb successfully for Hotkey {axon.hotkey} and uid {uid_in_metagraph}")
-                    except Exception as e:
-                        bt.logging.error(f"Error uploading Voice Clone Audio file to wandb: {e}")
-                    return cloned_file_path
-                else:
-                    cloned_file_path = os.path.join('/tmp', '_cloned_'+ axon.hotkey[:] +'.wav' )
-                    torchaudio.save(cloned_file_path, src=audio_data_int, sample_rate=sampling_rate)
-                    score = self.score_output(self.audio_file_path, cloned_file_path, prompt)
-                    bt.logging.info(f"The cloned file have been saved successfully: {cloned_file_path}")
+                # Scoring jobs run on several scheduler threads, file writes and wandb uploads go one at a time
+                with self.output_lock:
+                    if input_file:
+                        cloned_file_path = os.path.join('/tmp', 'API_cloned_'+ axon.hotkey[:] +'.wav' )
+                        torchaudio.save(cloned_file_path, src=audio_data_int, sample_rate=sampling_rate)
+                        bt.logging.info(f"The cloned file for API have been saved successfully: {cloned_file_path}")
+                        wandb_prompt = prompt
+                    else:
+                        cloned_file_path = os.path.join('/tmp', '_cloned_'+ axon.hotkey[:] +'.wav' )
+                        torchaudio.save(cloned_file_path, src=audio_data_int, sample_rate=sampling_rate)
+                        bt.logging.info(f"The cloned file have been saved successfully: {cloned_file_path}")
+                        wandb_prompt = response.text_input
                     try:
-                        uid_in_metagraph = self.metagraph.hotkeys.index(axon.hotkey)
-                        wandb.log({f"Voice Clone Prompt: {response.text_input}": wandb.Audio(np.array(audio_data_int_), caption=f'For HotKey: {axon.hotkey[:10]} and uid {uid_in_metagraph}', sample_rate=sampling_rate)})
+                        uid_in_metagraph = self.metagraph_index.uid_for_hotkey(axon.hotkey)
+                        wandb.log({f"Voice Clone Prompt: {wandb_prompt}": wandb.Audio(np.array(audio_data_int_), caption=f'For HotKey: {axon.hotkey[:10]} and uid {uid_in_metagraph}', sample_rate=sampling_rate)})
                         bt.logging.success(f"Voice Clone Audio file uploaded to wandb successfully for Hotkey {axon.hotkey} and uid {uid_in_metagraph}")
                     except Exception as e:
                         bt.logging.error(f"Error uploading Voice Clone Audio file to wandb: {e}")
-                bt.logging.info(f"The score of the cloned file : {score}")
-                self.update_score(axon, score, service="Voice Cloning") #, ax=self.filtered_axon
+                return cloned_file_path, audio_data.unsqueeze(0), sampling_rate
         except Exception as e:
-            pass
+            bt.logging.error(f"Error processing Voice Clone output: {e}")
+        return None
 
+    def score_outputs(self, input_path, waveforms, sampling_rates, text_input, voice_id=None):
+        '''Score all outputs of a round against the reference clip, 0.0 where scoring failed'''
+        try:
+            return self.clone_score.compare_audio_batch(input_path, waveforms, sampling_rates, text_input, voice_id=voice_id)
+        except Exception as e:
+            bt.logging.error(f"Error scoring outputs: {e}")
+            return [0.0] * len(waveforms)
 
     def score_output(self, input_path, output_path, text_input):
         '''Score the output based on the input and output paths'''
         try:
-            clone_score = CloneScore()
-            # Call the scoring function from lib.reward
-            score = clone_score.compare_audio(input_path , output_path, text_input)
-            # self.max_mse = max_mse
+            # Call the scoring function from lib.clone_score
+            score = self.clone_score.compare_audio(input_path , output_path, text_input)
             return score
         except Exception as e:
             bt.logging.error(f"Error scoring output: {e}")
@@ -243,16 +296,8 @@ class VoiceCloningService(AIModelService):
         return filtered_axons
 
     def get_filtered_axons(self):
-        # Get the uids of all miners in the network.
-        uids = self.metagraph.uids.tolist()
-        queryable_uids = (self.metagraph.total_stake >= 0)
-        # Remove the weights of miners that are not queryable.
-        queryable_uids = queryable_uids * torch.Tensor([self.metagraph.neurons[uid].axon_info.ip != '0.0.0.0' for uid in uids])
-        queryable_uid = queryable_uids * torch.Tensor([
-            any(self.metagraph.neurons[uid].axon_info.ip == ip for ip in lib.BLACKLISTED_IPS) or
-            any(self.metagraph.neurons[uid].axon_info.ip.startswith(prefix) for prefix in lib.BLACKLISTED_IPS_SEG)
-            for uid in uids
-        ])
+        # Miners with stake and a served IP, from the index built at the last metagraph sync
+        queryable_uids = self.metagraph_index.queryable_mask()
         active_miners = torch.sum(queryable_uids)
         dendrites_per_query = self.total_dendrites_per_query
 
@@ -268,13 +313,9 @@ class VoiceCloningService(AIModelService):
         # less than 3 set to 3
         if dendrites_per_query < self.minimum_dendrites_per_query:
                 dendrites_per_query = self.minimum_dendrites_per_query
-        # zip uids and queryable_uids, filter only the uids that are queryable, unzip, and get the uids
-        zipped_uids = list(zip(uids, queryable_uids))
-        zipped_uid = list(zip(uids, queryable_uid))
-        filtered_zipped_uids = list(filter(lambda x: x[1], zipped_uids))
-        filtered_uids = [item[0] for item in filtered_zipped_uids] if filtered_zipped_uids else []
-        filtered_zipped_uid = list(filter(lambda x: x[1], zipped_uid))
-        filtered_uid = [item[0] for item in filtered_zipped_uid] if filtered_zipped_uid else []
+        # Get the uids that are queryable, and those of them that use a blacklisted IP
+        filtered_uids = self.metagraph_index.uids_where(queryable_uids)
+        filtered_uid = self.metagraph_index.uids_where(queryable_uids & self.metagraph_index.blacklisted_ip)
         self.filtered_axon = filtered_uid
         subset_length = min(dendrites_per_query, len(filtered_uids))
         # Shuffle the order of members
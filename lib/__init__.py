@@ -75,9 +75,16 @@ legit_validators = ['5F4tQyWrhfGVcNhoqeiNsR6KjD4wMZ2kfhLj4oHYuyHbZAc3', '5HTZipx
 MIN_STAKE = 0
 WHITELISTED_VALIDATORS = legit_validators
 
-# Import all submodules.
+# Import the light submodules, the scoring ones (NISQA, Wav2Vec2, speechbrain) are only
+# imported on first use, e.g. lib.reward, so the miner does not load them at startup.
+import importlib
 from . import protocol
-from . import reward
-from . import clone_score
 from . import utils
-from . import subjective
+
+_LAZY_SUBMODULES = ("reward", "clone_score", "subjective")
+
+
+def __getattr__(name):
+    if name in _LAZY_SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,73 @@
+import json
+import os
+import bittensor as bt
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+
+class ConvertedCheckpoint(object):
+    """
+    Converted-weights cache for a pickled checkpoint.
+
+    The first load converts the checkpoint's state dict, with its keys already fixed up, to a
+    safetensors file next to it, together with the model arguments. Later loads memory-map
+    that file and place every tensor straight on the device, without unpickling the original
+    (or its optimizer state) and without redoing the key rewrites. The conversion is redone
+    when the original checkpoint changes.
+    """
+
+    def __init__(self, ckpt_path):
+        self.ckpt_path = ckpt_path
+        self.path = os.path.splitext(ckpt_path)[0] + ".safetensors"
+
+    def source_signature(self):
+        stat = os.stat(self.ckpt_path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self, device="cpu"):
+        """
+        Returns (state_dict, model_args) from the converted file, or None if there is no
+        up-to-date conversion.
+        """
+        if not self.exists():
+            return None
+        try:
+            with safe_open(self.path, framework="pt", device=str(device)) as f:
+                metadata = f.metadata() or {}
+                # A missing original is fine, the converted file is enough to run
+                if os.path.exists(self.ckpt_path) and metadata.get("source") != self.source_signature():
+                    bt.logging.info(f"Converted weights {self.path} are outdated, converting again.")
+                    return None
+                state_dict = {key: f.get_tensor(key) for key in f.keys()}
+            return state_dict, json.loads(metadata.get("model_args", "{}"))
+        except Exception as e:
+            bt.logging.error(f"An error occurred while loading converted weights {self.path}: {e}")
+            return None
+
+    def save(self, state_dict, model_args):
+        # safetensors refuses shared storage (e.g. tied embeddings), every tensor gets its own copy
+        tensors = {key: value.detach().cpu().clone().contiguous() for key, value in state_dict.items()}
+        try:
+            # The converted file must rebuild exactly the same config as the original checkpoint
+            model_args_json = json.dumps(model_args)
+            if json.loads(model_args_json) != model_args:
+                raise ValueError("the model arguments change in a JSON round trip")
+        except (TypeError, ValueError) as e:
+            bt.logging.error(f"Not converting {self.ckpt_path}, its model arguments cannot be stored exactly: {e}")
+            return
+        metadata = {
+            "source": self.source_signature(),
+            "model_args": model_args_json,
+        }
+        tmp_path = self.path + ".tmp"
+        try:
+            save_file(tensors, tmp_path, metadata=metadata)
+            os.replace(tmp_path, self.path)
+            bt.logging.info(f"Converted {self.ckpt_path} to {self.path}")
+        except Exception as e:
+            bt.logging.error(f"An error occurred while converting {self.ckpt_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -1,17 +1,137 @@
+import os
+import hashlib
+import threading
 import torch
 import torchaudio
 import torchaudio.transforms as T
 import bittensor as bt
-from lib.reward import score
-import math
-import numpy as np
-from scipy.spatial.distance import cosine
+from lib.reward import SpeechScoringEngine
 from torchaudio.transforms import Vad
+from speechbrain.pretrained import EncoderClassifier
+
+
+class SpeakerEmbeddingEngine(object):
+    '''
+    SpeakerEmbeddingEngine: fixed-size speaker embeddings (speechbrain ECAPA-TDNN)
+    for voice-clone similarity. The comparison cost does not depend on the clip
+    length. Reference embeddings are kept in a small on-disk store keyed by the
+    reference voice, so every reference voice is embedded only once. Each entry
+    is checked against a hash of the reference audio and rebuilt when it differs.
+    '''
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, source="speechbrain/spkrec-ecapa-voxceleb", store_dir=None, device=None):
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        self.sample_rate = 16000
+        model_slug = source.replace("/", "_")
+        self.encoder = EncoderClassifier.from_hparams(
+            source=source,
+            savedir=os.path.join(os.path.expanduser("~"), ".cache", "speechbrain", model_slug),
+            run_opts={"device": str(self.device)})
+        self.encoder.eval()
+        if store_dir is None:
+            store_dir = os.path.join(os.path.expanduser("~"), ".cache", "audio_subnet", "speaker_embeddings")
+        self.store_dir = os.path.join(store_dir, model_slug)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.references = {}
+        self.resamplers = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, store_dir=None, device=None):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(store_dir=store_dir, device=device)
+            return cls._instance
+
+    def prepare(self, waveform, sample_rate):
+        # Mono 16 kHz audio on the encoder device
+        waveform = torch.as_tensor(waveform, dtype=torch.float32).to(self.device)
+        waveform = waveform.reshape(-1, waveform.shape[-1]).mean(dim=0)
+        if sample_rate != self.sample_rate:
+            resampler = self.resamplers.get(sample_rate)
+            if resampler is None:
+                resampler = torchaudio.transforms.Resample(orig_freq=sample_rate, new_freq=self.sample_rate).to(self.device)
+                self.resamplers[sample_rate] = resampler
+            waveform = resampler(waveform)
+        return waveform
+
+    def embed_batch(self, waveforms, sample_rates, batch_size=8):
+        '''
+        Embeds clips in length-sorted batches. The relative lengths passed to the
+        encoder keep the padding out of its statistics pooling.
+        '''
+        audio = [self.prepare(waveform, sample_rate) for waveform, sample_rate in zip(waveforms, sample_rates)]
+        order = sorted(range(len(audio)), key=lambda i: audio[i].shape[0])
+        embeddings = [None] * len(audio)
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            batch = torch.nn.utils.rnn.pad_sequence([audio[i] for i in bucket], batch_first=True)
+            lengths = torch.tensor([audio[i].shape[0] for i in bucket], dtype=torch.float32, device=self.device)
+            with torch.no_grad():
+                batch_embeddings = self.encoder.encode_batch(batch, lengths / batch.shape[1]).squeeze(1)
+            for i, embedding in zip(bucket, batch_embeddings):
+                embeddings[i] = embedding
+        return torch.stack(embeddings)
+
+    @staticmethod
+    def signature(waveform, sample_rate):
+        '''Hash of the reference samples and sample rate, a stored embedding is only reused for the same audio'''
+        digest = hashlib.sha1(waveform.detach().cpu().float().contiguous().numpy().tobytes())
+        digest.update(str(sample_rate).encode())
+        return digest.hexdigest()
+
+    def reference_embedding(self, voice_id, file_path):
+        waveform, sample_rate = torchaudio.load(file_path)
+        if voice_id is None:
+            # Ad hoc references (e.g. API uploads) are not stored
+            return self.embed_batch([waveform], [sample_rate])[0]
+        signature = self.signature(waveform, sample_rate)
+        cached = self.references.get(voice_id)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        # The full voice_id is hashed, so ids sharing a prefix never share an entry
+        store_path = os.path.join(self.store_dir, hashlib.sha1(voice_id.encode()).hexdigest() + '.pt')
+        embedding = None
+        if os.path.exists(store_path):
+            stored = torch.load(store_path, map_location=self.device)
+            if isinstance(stored, dict) and stored.get("signature") == signature:
+                embedding = stored["embedding"]
+            else:
+                bt.logging.info(f"Stored speaker embedding of {voice_id} does not match the reference, embedding it again.")
+        if embedding is None:
+            embedding = self.embed_batch([waveform], [sample_rate])[0]
+            torch.save({"signature": signature, "embedding": embedding.cpu()}, store_path)
+        self.references[voice_id] = (signature, embedding)
+        return embedding
+
+    def similarities(self, voice_id, reference_path, waveforms, sample_rates):
+        with self.lock:
+            reference = self.reference_embedding(voice_id, reference_path)
+            embeddings = self.embed_batch(waveforms, sample_rates)
+            return torch.nn.functional.cosine_similarity(embeddings, reference[None, :], dim=1).tolist()
 
 class CloneScore:
-    def __init__(self, n_mels=128):
+    def __init__(self, n_mels=128, device=None, similarity="mel", embedding_store=None):
         self.n_mels = n_mels
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        # "mel" compares mel spectrograms, "speaker" compares speaker embeddings
+        self.similarity = similarity
+        if similarity == "speaker":
+            self.speaker = SpeakerEmbeddingEngine.get_instance(store_dir=embedding_store, device=device)
         self.vad = Vad(sample_rate=16000)  # Voice Activity Detection for trimming silence
+        # Transforms are built once per sampling rate and kept on the scoring device
+        self.mel_transforms = {}
+        self.db_transform = T.AmplitudeToDB().to(self.device)
+        # The reference clip is shared by every miner of a round, its spectrogram is computed once
+        self.reference_key = None
+        self.reference_spectrogram = None
+        self.lock = threading.Lock()
 
     def trim_silence(self, waveform,):
         # Assuming the audio is mono for simplicity; adjust or expand as needed for your use case
@@ -20,73 +140,127 @@ class CloneScore:
         trimmed_waveform = self.vad(waveform)
         return trimmed_waveform
 
-    def extract_mel_spectrogram(self, file_path):
-        waveform, sample_rate = torchaudio.load(file_path)
-        # Trim silence from the waveform
-        waveform = self.trim_silence(waveform)
-        mel_spectrogram_transform = T.MelSpectrogram(sample_rate=sample_rate, n_mels=self.n_mels)
-        mel_spectrogram = mel_spectrogram_transform(waveform)
-        # Convert power spectrogram to dB units and normalize
-        db_transform = T.AmplitudeToDB()
-        mel_spectrogram_db = db_transform(mel_spectrogram)
+    def mel_transform(self, sample_rate):
+        transform = self.mel_transforms.get(sample_rate)
+        if transform is None:
+            transform = T.MelSpectrogram(sample_rate=sample_rate, n_mels=self.n_mels).to(self.device)
+            self.mel_transforms[sample_rate] = transform
+        return transform
+
+    def spectrogram(self, waveform, sample_rate):
+        # VAD runs on the CPU, the spectrogram on the scoring device
+        waveform = torch.as_tensor(waveform, dtype=torch.float32).cpu()
+        waveform = self.trim_silence(waveform.reshape(-1, waveform.shape[-1]))
+        with torch.no_grad():
+            mel_spectrogram = self.mel_transform(sample_rate)(waveform.to(self.device))
+            # Convert power spectrogram to dB units and normalize
+            mel_spectrogram_db = self.db_transform(mel_spectrogram)
         norm_spectrogram = (mel_spectrogram_db - mel_spectrogram_db.mean()) / mel_spectrogram_db.std()
         return norm_spectrogram
 
-    def pad_or_trim_to_same_length(self, spec1, spec2):
-        if spec1.size(2) > spec2.size(2):
-            padding_size = spec1.size(2) - spec2.size(2)
-            spec2 = torch.nn.functional.pad(spec2, (0, padding_size))
-        elif spec2.size(2) > spec1.size(2):
-            padding_size = spec2.size(2) - spec1.size(2)
-            spec1 = torch.nn.functional.pad(spec1, (0, padding_size))
-        return spec1, spec2
+    def extract_mel_spectrogram(self, file_path):
+        waveform, sample_rate = torchaudio.load(file_path)
+        return self.spectrogram(waveform, sample_rate)
+
+    def reference(self, file_path):
+        # The validator rewrites the same reference file every round, so the file's stat is part of the key
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+        if key != self.reference_key:
+            self.reference_spectrogram = self.extract_mel_spectrogram(file_path)
+            self.reference_key = key
+        return self.reference_spectrogram
+
+    def calculate_cosine_similarities(self, reference, specs):
+        # Zero padding to a common length leaves every dot product and norm unchanged
+        frames = max([reference.size(-1)] + [spec.size(-1) for spec in specs])
+        reference = torch.nn.functional.pad(reference, (0, frames - reference.size(-1))).reshape(1, -1)
+        batch = torch.stack([torch.nn.functional.pad(spec, (0, frames - spec.size(-1))) for spec in specs]).reshape(len(specs), -1)
+        sims = torch.nn.functional.cosine_similarity(batch.double(), reference.double(), dim=1).tolist()
+        for i, sim in enumerate(sims):
+            # Inform the user if the initial similarity value is negative
+            if sim < 0:
+                bt.logging.error(f"Initial cosine similarity was negative: {sim}. Setting to 0.")
+                sims[i] = 0  # Zero out negative value
+        return sims
 
     def calculate_cosine_similarity(self, spec1, spec2):
-        # Flatten the spectrograms and convert them to NumPy arrays for the cosine similarity calculation
-        spec1_flat = spec1.numpy().flatten()
-        spec2_flat = spec2.numpy().flatten()
-        # Calculate the cosine similarity and ensure it is within the range [0, 1]
-        sim = 1 - cosine(spec1_flat, spec2_flat)
-        # Inform the user if the initial similarity value is negative
-        if sim < 0:
-            bt.logging.error(f"Initial cosine similarity was negative: {sim}. Setting to 0.")
-            sim = 0  # Zero out negative value
-        return sim
+        return self.calculate_cosine_similarities(spec1, [spec2])[0]
 
-    def compare_audio(self, file_path1, file_path2, input_text):
-        # Extract Mel Spectrograms
+    def mel_similarities(self, reference_path, waveforms, sample_rates):
+        bt.logging.info(f"Extracting Mel spectrograms...")
+        cosine_sims = [0] * len(waveforms)  # Default low value if spectrogram extraction fails
+        with self.lock:
+            try:
+                reference = self.reference(reference_path)
+                specs = {}
+                for i, (waveform, sample_rate) in enumerate(zip(waveforms, sample_rates)):
+                    try:
+                        specs[i] = self.spectrogram(waveform, sample_rate)
+                    except Exception as e:
+                        bt.logging.error(f"Error extracting Mel spectrograms: {e}")
+                if specs:
+                    for i, sim in zip(specs, self.calculate_cosine_similarities(reference, list(specs.values()))):
+                        cosine_sims[i] = sim
+            except Exception as e:
+                bt.logging.error(f"Error extracting Mel spectrograms: {e}")
+        return cosine_sims
+
+    def speaker_similarities(self, voice_id, reference_path, waveforms, sample_rates):
+        bt.logging.info(f"Extracting speaker embeddings...")
         try:
-            bt.logging.info(f"Extracting Mel spectrograms...")
-            bt.logging.info(f"File 1: {file_path1}")
-            bt.logging.info(f"File 2: {file_path2}")
-            bt.logging.info(f"Input Text:{input_text}")
-            spec1 = self.extract_mel_spectrogram(file_path1)
-            spec2 = self.extract_mel_spectrogram(file_path2)
+            sims = self.speaker.similarities(voice_id, reference_path, waveforms, sample_rates)
         except Exception as e:
-            bt.logging.error(f"Error extracting Mel spectrograms: {e}")
-            spec1 = spec2 = None
-
-        if spec1 is not None and spec2 is not None:
-            # Pad or Trim
-            spec1, spec2 = self.pad_or_trim_to_same_length(spec1, spec2)
-            # Calculate Cosine Similarity
-            cosine_sim = self.calculate_cosine_similarity(spec1, spec2)
-            bt.logging.info(f"Cosine Similarity for Voice Cloning: {cosine_sim}")
+            bt.logging.error(f"Error extracting speaker embeddings: {e}")
+            return [0] * len(waveforms)
+        for i, sim in enumerate(sims):
+            if sim < 0:
+                bt.logging.error(f"Initial cosine similarity was negative: {sim}. Setting to 0.")
+                sims[i] = 0  # Zero out negative value
+        return sims
+
+    def compare_audio_batch(self, reference_path, waveforms, sample_rates, input_text, voice_id=None):
+        """
+        Score every cloned output of a round against the same reference clip.
+
+        Parameters:
+        reference_path (str): The reference clip sent to the miners.
+        waveforms (list): Cloned outputs, each shaped [channels, samples].
+        sample_rates (list): Sampling rate of each output.
+        input_text (str): The text the miners were asked to speak.
+        voice_id (str): Full path of the reference voice in its dataset, used to store its speaker embedding.
+
+        Returns:
+        list: One final score per output.
+        """
+        bt.logging.info(f"Reference: {reference_path}")
+        bt.logging.info(f"Input Text:{input_text}")
+        if self.similarity == "speaker":
+            cosine_sims = self.speaker_similarities(voice_id, reference_path, waveforms, sample_rates)
         else:
-            cosine_sim = 0  # Assigning a default low value if spectrograms extraction failed
+            cosine_sims = self.mel_similarities(reference_path, waveforms, sample_rates)
 
         try:
-            nisqa_wer_score = score(file_path2, input_text)
+            nisqa_wer_scores = SpeechScoringEngine.get_instance().score_batch(waveforms, input_text, sample_rates)
         except Exception as e:
             bt.logging.error(f"Error calculating NISQA score inside compare_audio function: {e}")
-            nisqa_wer_score = 0
-
-        # Calculate Final Score with 40% weight for Cosine Similarity and 60% weight for NISQA score
-        final_score = 0.4 * cosine_sim + 0.6 * nisqa_wer_score
-        if cosine_sim == 0:
-            final_score = -0.1  # Assigning a negative score for zero or negative cosine similarity
-        # bt.logging.info(f"Final Score for Voice Cloning: {final_score}")
-        bt.logging.info(f"Final Score: {final_score} and Cosine Similarity: {cosine_sim} for Voice Cloning: ")
+            nisqa_wer_scores = [0] * len(waveforms)
 
+        final_scores = []
+        for cosine_sim, nisqa_wer_score in zip(cosine_sims, nisqa_wer_scores):
+            bt.logging.info(f"Cosine Similarity for Voice Cloning: {cosine_sim}")
+            # Calculate Final Score with 40% weight for Cosine Similarity and 60% weight for NISQA score
+            final_score = 0.4 * cosine_sim + 0.6 * (nisqa_wer_score or 0)
+            if cosine_sim == 0:
+                final_score = -0.1  # Assigning a negative score for zero or negative cosine similarity
+            bt.logging.info(f"Final Score: {final_score} and Cosine Similarity: {cosine_sim} for Voice Cloning: ")
+            final_scores.append(final_score)
+        return final_scores
 
-        return final_score
\ No newline at end of file
+    def compare_audio(self, file_path1, file_path2, input_text):
+        try:
+            waveform, sample_rate = torchaudio.load(file_path2)
+        except Exception as e:
+            bt.logging.error(f"Error loading the cloned audio {file_path2}: {e}")
+            return -0.1  # Same as a failed spectrogram extraction
+        return self.compare_audio_batch(file_path1, [waveform], [sample_rate], input_text)[0]
@@ -0,0 +1,57 @@
+import torch
+import lib
+
+
+class MetagraphIndex(object):
+    """
+    Lookup tables and eligibility masks for one metagraph snapshot.
+
+    Built once per metagraph.sync, so per-response work (finding an axon's UID,
+    selecting queryable miners, masking weights) no longer walks every neuron.
+    """
+
+    def __init__(self, metagraph):
+        self.uids = metagraph.uids.tolist()
+        self.total_stake = metagraph.total_stake
+        self.uid_by_hotkey = {hotkey: uid for uid, hotkey in zip(self.uids, metagraph.hotkeys)}
+        self.uid_by_axon = {self.axon_key(axon): uid for uid, axon in zip(self.uids, metagraph.axons)}
+
+        ips = [axon.ip for axon in metagraph.axons]
+        self.has_ip = torch.tensor([ip != '0.0.0.0' for ip in ips], dtype=torch.bool)
+        self.blacklisted_ip = torch.tensor([
+            ip in lib.BLACKLISTED_IPS or any(ip.startswith(prefix) for prefix in lib.BLACKLISTED_IPS_SEG)
+            for ip in ips
+        ], dtype=torch.bool)
+        self.blacklisted_key = torch.tensor([
+            coldkey in lib.BLACKLISTED_MINER_COLDKEYS or hotkey in lib.BLACKLISTED_MINER_HOTKEYS
+            for coldkey, hotkey in zip(metagraph.coldkeys, metagraph.hotkeys)
+        ], dtype=torch.bool)
+
+    @staticmethod
+    def axon_key(axon):
+        return (axon.hotkey, axon.ip, axon.port)
+
+    def uid_for_hotkey(self, hotkey):
+        return self.uid_by_hotkey.get(hotkey)
+
+    def uid_for_axon(self, axon):
+        '''UID of the axon, or None if the axon is not (or no longer) in the metagraph.'''
+        return self.uid_by_axon.get(self.axon_key(axon))
+
+    def queryable_mask(self):
+        '''Miners with stake and a served IP.'''
+        return (self.total_stake >= 0) & self.has_ip
+
+    def uids_where(self, mask):
+        return torch.nonzero(mask, as_tuple=True)[0].tolist()
+
+    def mask_weights(self, scores):
+        '''Scores with nodes that serve no IP set to 0.'''
+        return scores * self.has_ip.to(scores.dtype)
+
+    def zero_blacklisted(self, scores):
+        '''Sets the scores of blacklisted coldkeys and hotkeys to 0 in place, returns their UIDs.'''
+        blacklisted = self.uids_where(self.blacklisted_key)
+        if blacklisted:
+            scores[blacklisted] = 0.0
+        return blacklisted
@@ -16,9 +16,122 @@
 # THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
-from typing import List, Optional
+import io
+import base64
+from typing import List, Optional, Union
+import numpy as np
+import torch
 import bittensor as bt
-from pydantic import Field
+from pydantic import BaseModel, Field
+
+AUDIO_DTYPES = {
+    "int16": np.int16,
+    "int32": np.int32,
+    "float32": np.float32,
+}
+AUDIO_CODECS = ["raw", "flac"]
+
+class AudioPayload(BaseModel):
+    """
+    Compact binary audio carried inside a synapse. Samples are stored as PCM16, int32 or float32 bytes in
+    [channels, samples] order and base64 encoded, optionally FLAC compressed, together with the dtype, sample rate
+    and channel count needed to rebuild the waveform.
+    """
+    data: str = Field(
+        title="Data",
+        description="Base64 encoded audio bytes, raw samples or a FLAC stream depending on the codec."
+    )
+    dtype: str = Field(
+        default="float32",
+        title="Sample Type",
+        description="Sample type of the decoded audio. Supported types: 'int16', 'int32', 'float32'."
+    )
+    sample_rate: int = Field(
+        title="Sample Rate",
+        description="Sample rate of the audio in Hz."
+    )
+    channels: int = Field(
+        default=1,
+        title="Channels",
+        description="Number of audio channels."
+    )
+    codec: str = Field(
+        default="raw",
+        title="Codec",
+        description="Encoding of the data field. Supported codecs: 'raw', 'flac'."
+    )
+
+    @classmethod
+    def from_array(cls, audio, sample_rate: int, dtype: str = "float32", codec: str = "raw") -> "AudioPayload":
+        """
+        Builds a payload from a NumPy array or torch tensor shaped [samples] or [channels, samples]. Integer audio is
+        rescaled when the dtype changes; floating point audio converted to an integer dtype is scaled to full range,
+        and divided by its peak when that exceeds 1. FLAC stores integer samples, so float32 audio sent with the FLAC
+        codec is also divided by its peak when that exceeds 1 instead of being clipped; the raw codec keeps it as is.
+        """
+        if dtype not in AUDIO_DTYPES:
+            raise ValueError(f"Unsupported audio dtype: {dtype}")
+        if codec not in AUDIO_CODECS:
+            raise ValueError(f"Unsupported audio codec: {codec}")
+        if hasattr(audio, "detach"):
+            audio = audio.detach().cpu().numpy()
+        audio = np.asarray(audio)
+        if audio.ndim == 1:
+            audio = audio[None, :]
+        channels = audio.shape[0]
+
+        target = AUDIO_DTYPES[dtype]
+        if np.issubdtype(audio.dtype, np.integer) and audio.dtype != target:
+            audio = audio / np.iinfo(audio.dtype).max
+        if np.issubdtype(audio.dtype, np.floating) and np.issubdtype(target, np.integer):
+            peak = max(1.0, float(np.max(np.abs(audio))) if audio.size else 1.0)
+            audio = audio / peak * np.iinfo(target).max
+        elif codec == "flac" and np.issubdtype(target, np.floating):
+            peak = float(np.max(np.abs(audio))) if audio.size else 1.0
+            if peak > 1.0:
+                audio = audio / peak
+        audio = np.ascontiguousarray(audio, dtype=target)
+
+        if codec == "flac":
+            import soundfile as sf
+            buffer = io.BytesIO()
+            subtype = "PCM_16" if dtype == "int16" else "PCM_24"
+            sf.write(buffer, audio.T, sample_rate, format="FLAC", subtype=subtype)
+            raw = buffer.getvalue()
+        else:
+            raw = audio.tobytes()
+        return cls(data=base64.b64encode(raw).decode("ascii"), dtype=dtype, sample_rate=sample_rate, channels=channels, codec=codec)
+
+    def deserialize(self) -> np.ndarray:
+        """
+        Returns the waveform as a NumPy array, [samples] for mono and [channels, samples] otherwise. Raw payloads are
+        a view over the decoded buffer, no per-sample conversion takes place.
+        """
+        raw = bytearray(base64.b64decode(self.data))
+        if self.codec == "flac":
+            import soundfile as sf
+            audio, _ = sf.read(io.BytesIO(raw), dtype=self.dtype, always_2d=True)
+            audio = audio.T
+        else:
+            audio = np.frombuffer(raw, dtype=AUDIO_DTYPES[self.dtype]).reshape(self.channels, -1)
+        return audio[0] if self.channels == 1 else audio
+
+    def to_tensor(self):
+        """
+        Returns the waveform as a torch tensor sharing memory with the decoded buffer.
+        """
+        return torch.from_numpy(self.deserialize())
+
+def decode_audio(audio) -> Optional[np.ndarray]:
+    """
+    Returns the waveform of an audio field as a NumPy array. Accepts an AudioPayload as well as the plain lists
+    sent by peers that have not been updated yet.
+    """
+    if audio is None:
+        return None
+    if isinstance(audio, AudioPayload):
+        return audio.deserialize()
+    return np.asarray(audio, dtype=np.float32)
 
 class TextToSpeech(bt.Synapse):
     """
@@ -45,10 +158,10 @@ class TextToSpeech(bt.Synapse):
         title="Clone Input",
         description="A list of parameters used for enhancing the text-to-speech process, relevant for models supporting voice cloning."
     )
-    speech_output: List = Field(
+    speech_output: Optional[Union[AudioPayload, List]] = Field(
         default=None,
         title="Speech Output",
-        description="The resulting speech data produced from the text input."
+        description="The resulting speech data produced from the text input, as an AudioPayload (or a list from older miners)."
     )
 
     def deserialize(self) -> List:
@@ -77,10 +190,10 @@ class MusicGeneration(bt.Synapse):
         title="Model Name",
         description="The machine learning model employed for music generation. Supported models: 'facebook/musicgen-medium', 'facebook/musicgen-large'."
     )
-    music_output: List = Field(
+    music_output: Optional[Union[AudioPayload, List]] = Field(
         default=None,
         title="Music Output",
-        description="The resultant music data, encoded as a list, generated from the text input."
+        description="The resultant music data generated from the text input, as an AudioPayload (or a list from older miners)."
     )
     duration: int = Field(
         default=None,
@@ -109,15 +222,15 @@ class VoiceClone(bt.Synapse):
         title="Text Input",
         description="Text content to be synthesized using cloned voice attributes."
     )
-    clone_input: List = Field(
+    clone_input: Optional[Union[AudioPayload, List]] = Field(
         default=None,
         title="Clone Input",
-        description="Data used for analyzing and replicating the desired voice characteristics, an audio array constructed from mp3 or wav files."
+        description="Data used for analyzing and replicating the desired voice characteristics, an AudioPayload (or a list from older validators) constructed from mp3 or wav files."
     )
-    clone_output: List = Field(
+    clone_output: Optional[Union[AudioPayload, List]] = Field(
         default=None,
         title="Clone Output",
-        description="The synthesized voice output, incorporating cloned attributes, delivered as a list."
+        description="The synthesized voice output, incorporating cloned attributes, delivered as an AudioPayload (or a list from older miners)."
     )
     sample_rate: int = Field(
         default=None,
@@ -0,0 +1,52 @@
+import typing
+import bittensor as bt
+import lib
+
+
+class RequestGate(object):
+    """
+    Request admission for the miner axon, shared by all synapse types.
+
+    The metagraph is kept as a hotkey -> (uid, stake) dict that is replaced in a
+    single assignment when the miner resyncs, so the blacklist and priority
+    functions do O(1) lookups and never see a half-replaced metagraph.
+    """
+
+    def __init__(self, metagraph, min_stake=None, whitelist=None, blacklist=None):
+        self.min_stake = lib.MIN_STAKE if min_stake is None else min_stake
+        self.whitelist = frozenset(lib.WHITELISTED_VALIDATORS if whitelist is None else whitelist)
+        self.blacklist = frozenset(lib.BLACKLISTED_VALIDATORS if blacklist is None else blacklist)
+        self.neurons = {}
+        self.update(metagraph)
+
+    def update(self, metagraph):
+        '''Swap in a new metagraph snapshot.'''
+        self.neurons = {hotkey: (uid, float(stake)) for uid, (hotkey, stake) in enumerate(zip(metagraph.hotkeys, metagraph.S.tolist()))}
+
+    def check(self, synapse: bt.Synapse) -> typing.Tuple[bool, str]:
+        hotkey = synapse.dendrite.hotkey
+        neuron = self.neurons.get(hotkey)
+        if neuron is None:
+            # Ignore requests from unrecognized entities.
+            bt.logging.trace(f"Blacklisting unrecognized hotkey {hotkey}")
+            return True, "Unrecognized hotkey"
+        elif neuron[1] < self.min_stake:
+            # Ignore requests from entities with low stake.
+            bt.logging.trace(f"Blacklisting hotkey {hotkey} with low stake")
+            return True, "Low stake"
+        elif hotkey in self.blacklist:
+            bt.logging.trace(f"Blacklisting Key recognized as blacklisted hotkey {hotkey}")
+            return True, "Blacklisted hotkey"
+        elif hotkey in self.whitelist:
+            bt.logging.trace(f"Not Blacklisting recognized hotkey {hotkey}")
+            return False, "Hotkey recognized!"
+        else:
+            bt.logging.trace(f"Blacklisting recognized hotkey {hotkey}")
+            return True, "Hotkey recognized as Blacklisted!"
+
+    def priority(self, synapse: bt.Synapse) -> float:
+        # The stake of the caller is its priority
+        neuron = self.neurons.get(synapse.dendrite.hotkey)
+        priority = neuron[1] if neuron is not None else 0.0
+        bt.logging.trace(f"Prioritizing {synapse.dendrite.hotkey} with value: {priority}")
+        return priority
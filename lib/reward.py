@@ -22,6 +22,7 @@ import typing
 from lib.subjective import SpeechToTextEvaluator
 import bittensor as bt
 import os
+import threading
 import multiprocessing
 import copy
 import math
@@ -35,11 +36,13 @@ from scipy.optimize import minimize
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torchaudio
 from torch.nn.utils.rnn import pad_packed_sequence
 from torch.nn.utils.rnn import pack_padded_sequence
 from torch.utils.data import DataLoader
 from torch.utils.data import Dataset
 import lib
+from lib.checkpoints import ConvertedCheckpoint
 import pandas as pd
 
 
@@ -2321,7 +2324,29 @@ def get_librosa_melspec(
             y, sr = lb.load(file_path, sr=sr)
     except:
         raise ValueError('Could not load file {}'.format(file_path))
-    
+
+    return calc_librosa_melspec(
+        y,
+        sr,
+        n_fft=n_fft,
+        hop_length=hop_length,
+        win_length=win_length,
+        n_mels=n_mels,
+        fmax=fmax,
+        )
+
+def calc_librosa_melspec(
+    y,
+    sr,
+    n_fft=1024,
+    hop_length=80,
+    win_length=170,
+    n_mels=32,
+    fmax=16e3,
+    ):
+    '''
+    Calculate mel-spectrograms with Librosa from a waveform already in memory.
+    '''
     hop_length = int(sr * hop_length)
     win_length = int(sr * win_length)
 
@@ -2432,6 +2457,85 @@ class nisqaModel(object):
         print(self.ds_val.df.to_string(index=False))
         return self.ds_val.df
 
+    def predict_array(self, y, sr):
+        '''
+        Predicts MOS and dimensions of a waveform held in memory. Nothing is
+        read from or written to disk. Returns a NumPy array with the columns
+        [mos_pred, noi_pred, dis_pred, col_pred, loud_pred].
+        '''
+        x, n_wins = self._segment_array(y, sr)
+        return self._forward(x.unsqueeze(0), torch.as_tensor(n_wins).reshape(1))[0]
+
+    def predict_batch(self, waveforms, sample_rates):
+        '''
+        Predicts MOS and dimensions of several in-memory waveforms with one
+        forward pass. All segments are padded to ms_max_segments and masked
+        with n_wins, so every row matches predict_array for the same input.
+        Waveforms that cannot be segmented get a row of NaN.
+        '''
+        y_hat = np.full((len(waveforms), 5), np.nan, dtype=np.float32)
+        x_list, n_wins_list, idx_list = [], [], []
+        for idx, (y, sr) in enumerate(zip(waveforms, sample_rates)):
+            if torch.is_tensor(y):
+                y = y.detach().cpu().numpy()
+            try:
+                x, n_wins = self._segment_array(y, sr)
+            except Exception as e:
+                bt.logging.error(f"NISQA could not segment waveform {idx}: {e}")
+                continue
+            x_list.append(x)
+            n_wins_list.append(int(n_wins))
+            idx_list.append(idx)
+
+        if x_list:
+            y_hat[idx_list] = self._forward(torch.stack(x_list), torch.tensor(n_wins_list))
+        return y_hat
+
+    def _forward(self, x, n_wins):
+        self.model.to(self.dev)
+        self.model.eval()
+        with torch.no_grad():
+            y_hat = self.model(x.to(self.dev), n_wins.to(self.dev))
+        return y_hat.cpu().numpy()
+
+    def predict_tensor(self, waveform, sr):
+        '''
+        Same as predict_array for a torch waveform of shape [channels, samples].
+        '''
+        return self.predict_array(waveform.detach().cpu().numpy(), sr)
+
+    def _segment_array(self, y, sr):
+        '''
+        Mel-spectrogram and segmentation of a single waveform, identical to
+        what SpeechQualityDataset does for a file on disk.
+        '''
+        y = np.asarray(y, dtype=np.float32)
+        if y.ndim > 1:
+            if self.args['ms_channel'] is not None:
+                y = y[self.args['ms_channel'], :]
+            else:
+                y = lb.to_mono(y)
+        # ms_sr None keeps the native rate, like lb.load(sr=None) on the file path
+        if self.args['ms_sr'] is not None and sr != self.args['ms_sr']:
+            y = lb.resample(y, orig_sr=sr, target_sr=self.args['ms_sr'])
+            sr = self.args['ms_sr']
+
+        spec = calc_librosa_melspec(
+            y,
+            sr,
+            n_fft=self.args['ms_n_fft'],
+            hop_length=self.args['ms_hop_length'],
+            win_length=self.args['ms_win_length'],
+            n_mels=self.args['ms_n_mels'],
+            fmax=self.args['ms_fmax'],
+            )
+        return segment_specs(
+            '<array>',
+            spec,
+            self.args['ms_seg_length'],
+            self.args['ms_seg_hop_length'],
+            self.args['ms_max_segments'])
+
     def _train_mos(self):
         '''
         Trains speech quality model.
@@ -3090,6 +3194,8 @@ class nisqaModel(object):
             self._loadDatasetsCSVpredict()
         elif self.args['mode']=='main':
             self._loadDatasetsCSV()
+        elif self.args['mode']=='resident':
+            self.ds_val = None # predictions go through predict_array
         else:
             raise NotImplementedError('mode not available')                        
             
@@ -3287,7 +3393,15 @@ class nisqaModel(object):
                 model_path = os.path.join(self.args['pretrained_model'])
             else:
                 model_path = os.path.join(os.getcwd(), self.args['pretrained_model'])
-            checkpoint = torch.load(model_path, map_location=self.dev)
+            # Only the weights and arguments are kept, converted once to safetensors
+            converted = ConvertedCheckpoint(model_path)
+            loaded = converted.load(self.dev)
+            if loaded is None:
+                checkpoint = torch.load(model_path, map_location=self.dev)
+                checkpoint = {'args': checkpoint['args'], 'model_state_dict': checkpoint['model_state_dict']}
+                converted.save(checkpoint['model_state_dict'], checkpoint['args'])
+            else:
+                checkpoint = {'args': loaded[1], 'model_state_dict': loaded[0]}
             
             # update checkpoint arguments with new arguments
             checkpoint['args'].update(self.args)
@@ -3516,43 +3630,105 @@ def score(file, text) -> float:
     Returns:
     - float: The reward value for the miner.
     """
-    mode = 'predict_file'  # or 'predict_dir', 'predict_csv'
-    pretrained_model = 'nisqa.tar'  # e.g., 'model.pth'
-    deg = file  # e.g., 'test.wav'
-    output_dir = './'  # e.g., 'results/'
-    csv_file = 'results.csv'  # e.g., 'data.csv'
-    csv_deg = 'column_in_csv_with_files_name'  # e.g., 'filename'
-    num_workers = 5
-    bs = 1
-    ms_channel = None  # or the specific channel if stereo file
-    # Create a dictionary with the parameters
-    args = {
-        'mode': mode,
-        'pretrained_model': pretrained_model,
-        'deg': deg,
-        # 'data_dir': data_dir,
-        'output_dir': output_dir,
-        'csv_file': csv_file,
-        'csv_deg': csv_deg,
-        'num_workers': num_workers,
-        'bs': bs,
-        'ms_channel': ms_channel,
-        'tr_bs_val': bs,
-        'tr_num_workers': num_workers
-    }
-    # Word Error Rate prediction
-    wer = SpeechToTextEvaluator()
-    word_error_rate = wer.evaluate_wer(file, text)
-    print("Word Error Rate is:  ", word_error_rate)
-    # Instantiate the nisqaModel with hardcoded arguments
-    nisqa = nisqaModel(args)
-    # Print the device of the model
-    print(" The parameters Device of the NISQA MODEL:  ", next(nisqa.model.parameters()).device)
-    # Execute the prediction directly
-    nisqa.predict()
-    data = pd.read_csv('NISQA_results.csv')
-    # Include WER in the 'NISQA_results.csv' file
-    data['word_error_rate'] = word_error_rate
-    data.to_csv('NISQA_results.csv', index=False)
-    # Return the result from calculate_audio_quality_scores
-    return calculate_audio_quality_scores(data, word_error_rate)
\ No newline at end of file
+    waveform, sample_rate = torchaudio.load(file)
+    return SpeechScoringEngine.get_instance().score(waveform, text, sample_rate)
+
+
+class SpeechScoringEngine(object):
+    '''
+    SpeechScoringEngine: keeps the NISQA and wav2vec2 models resident on one
+    device for the lifetime of the validator process and scores miner speech
+    against the prompt it was generated from.
+    '''
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, pretrained_model='nisqa.tar', device=None):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        self.lock = threading.Lock()
+
+        # Word Error Rate model
+        self.wer = SpeechToTextEvaluator(device=self.device)
+
+        # NISQA model, predictions run on waveforms in memory
+        args = {
+            'mode': 'resident',
+            'pretrained_model': pretrained_model,
+            'output_dir': None,
+            'ms_channel': None,
+            'tr_bs_val': 1,
+            'tr_num_workers': 0,
+            'tr_device': self.device.type,
+        }
+        self.nisqa = nisqaModel(args)
+        self.nisqa.args['tr_parallel'] = False
+        self.nisqa.model.to(self.nisqa.dev)
+        self.nisqa.model.eval()
+        bt.logging.info(f"Speech scoring engine loaded NISQA and wav2vec2 on {self.device}")
+
+    @classmethod
+    def get_instance(cls, device=None):
+        '''
+        Returns the process wide engine, loading the models on first use.
+        '''
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(device=device)
+        return cls._instance
+
+    def score(self, waveform, text, sample_rate=16000) -> float:
+        '''
+        Scores a waveform of shape [channels, samples] (or [samples]) against
+        the text it should contain.
+        '''
+        waveform = self._as_tensor(waveform)
+
+        with self.lock:
+            # Word Error Rate prediction
+            word_error_rate = self.wer.evaluate_wer_waveform(waveform, sample_rate, text)
+            bt.logging.debug(f"Word Error Rate is: {word_error_rate}")
+
+            y_hat = self.nisqa.predict_tensor(waveform, sample_rate)
+
+        return self._composite_score(y_hat, word_error_rate)
+
+    def score_batch(self, waveforms, text, sample_rates):
+        '''
+        Scores every response of a round against the same text. wav2vec2 runs
+        on length-bucketed batches and NISQA runs a single batched forward
+        pass over all waveforms. Returns one score per
+        waveform, None where the waveform could not be scored.
+        '''
+        waveforms = [self._as_tensor(waveform) for waveform in waveforms]
+        if not waveforms:
+            return []
+
+        with self.lock:
+            try:
+                word_error_rates = self.wer.evaluate_wer_batch(waveforms, sample_rates, text)
+            except Exception as e:
+                bt.logging.error(f"Error calculating Word Error Rate: {e}")
+                word_error_rates = [None] * len(waveforms)
+            y_hat = self.nisqa.predict_batch(waveforms, sample_rates)
+
+        scores = []
+        for row, word_error_rate in zip(y_hat, word_error_rates):
+            if word_error_rate is None or np.isnan(row).any():
+                scores.append(None)
+            else:
+                scores.append(self._composite_score(row, word_error_rate))
+        return scores
+
+    def _as_tensor(self, waveform):
+        if not torch.is_tensor(waveform):
+            waveform = torch.tensor(np.asarray(waveform), dtype=torch.float)
+        if waveform.ndim == 1:
+            waveform = waveform.unsqueeze(0)
+        return waveform.float().cpu()
+
+    def _composite_score(self, y_hat, word_error_rate):
+        data = pd.DataFrame([y_hat], columns=['mos_pred', 'noi_pred', 'dis_pred', 'col_pred', 'loud_pred'])
+        data['word_error_rate'] = word_error_rate
+        return calculate_audio_quality_scores(data, word_error_rate)
@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import bittensor as bt
+
+
+# Lower values are admitted first when several services wait on the same model
+SERVICE_PRIORITIES = {
+    "Text-To-Speech": 0,
+    "Voice Cloning": 1,
+    "Text-To-Music": 2,
+}
+
+# Scoring models and how many jobs each may run on the GPU at the same time
+MODEL_CONCURRENCY = {
+    "speech": 1,  # NISQA + wav2vec2 (lib.reward.SpeechScoringEngine), also the VC jobs
+    "clap": 1,    # CLAP text consistency and SNR (lib.ttm_score)
+}
+
+# Jobs that score through another model's engine share its admission slot. VC scores
+# through the SpeechScoringEngine, which runs one job at a time under its own lock.
+MODEL_SLOTS = {
+    "clone": "speech",
+}
+
+
+class ScoringScheduler(object):
+    """
+    Shared scoring pool for the validator services.
+
+    Jobs are queued per scoring model and admitted by service priority, with at most
+    MODEL_CONCURRENCY[model] jobs of a model running at once. Models listed in
+    MODEL_SLOTS are queued and counted with the model they score through. Admitted jobs run on a
+    thread pool: the scoring models are resident in this process and torch releases
+    the GIL, so a slow CLAP score no longer stalls TTS and VC.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_workers=None, model_concurrency=None):
+        if max_workers is None:
+            max_workers = min(8, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scoring")
+        self.model_concurrency = dict(MODEL_CONCURRENCY)
+        for model, slots in (model_concurrency or {}).items():
+            self.model_concurrency[MODEL_SLOTS.get(model, model)] = slots
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.running = {}
+        self.counter = itertools.count()
+
+    @classmethod
+    def get_instance(cls, max_workers=None, model_concurrency=None):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(max_workers=max_workers, model_concurrency=model_concurrency)
+            return cls._instance
+
+    def submit(self, model, func, *args, priority=0, **kwargs):
+        """
+        Queue a scoring job for a model.
+
+        Parameters:
+        model (str): Name of the scoring model the job runs on, e.g. "speech" or "clap".
+        func (callable): The blocking scoring function.
+        priority (int): Lower values are admitted first, see SERVICE_PRIORITIES.
+
+        Returns:
+        concurrent.futures.Future: Resolves to the result of func.
+        """
+        future = Future()
+        model = MODEL_SLOTS.get(model, model)
+        with self.lock:
+            heapq.heappush(self.queues.setdefault(model, []), (priority, next(self.counter), future, func, args, kwargs))
+        self._dispatch(model)
+        return future
+
+    def _dispatch(self, model):
+        admitted = []
+        with self.lock:
+            queue = self.queues.get(model, [])
+            limit = self.model_concurrency.get(model, 1)
+            while queue and self.running.get(model, 0) < limit:
+                _, _, future, func, args, kwargs = heapq.heappop(queue)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.running[model] = self.running.get(model, 0) + 1
+                admitted.append((future, func, args, kwargs))
+        for future, func, args, kwargs in admitted:
+            self.executor.submit(self._run, model, future, func, args, kwargs)
+
+    def _run(self, model, future, func, args, kwargs):
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            bt.logging.error(f"An error occurred in a {model} scoring job: {e}")
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                self.running[model] -= 1
+            self._dispatch(model)
+
+    def pending(self, model):
+        model = MODEL_SLOTS.get(model, model)
+        with self.lock:
+            return len(self.queues.get(model, [])), self.running.get(model, 0)
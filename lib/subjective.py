@@ -4,21 +4,37 @@ from jiwer import wer
 import torchaudio
 
 class SpeechToTextEvaluator:
-    def __init__(self, model_name="facebook/wav2vec2-base-960h"):
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        self.model = Wav2Vec2ForCTC.from_pretrained(model_name).to(self.device) 
+    def __init__(self, model_name="facebook/wav2vec2-base-960h", device=None):
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        self.model = Wav2Vec2ForCTC.from_pretrained(model_name).to(self.device)
         self.processor = Wav2Vec2Processor.from_pretrained(model_name)
         self.model.to(self.device)
+        self.model.eval()
+        # Resamplers are cached per input rate, building one is not free
+        self.resamplers = {}
+        # Checkpoints trained without attention masks (e.g. wav2vec2-base) expect zero padding only
+        self.use_attention_mask = self.processor.feature_extractor.return_attention_mask
 
     def transcribe_audio(self, audio_file):
         # Load the audio file
         waveform, sampling_rate = torchaudio.load(audio_file)
+        return self.transcribe_waveform(waveform, sampling_rate)
 
-        # Resample if necessary
-        if sampling_rate != 16000:
+    def resample(self, waveform, sampling_rate):
+        if sampling_rate == 16000:
+            return waveform
+        resampler = self.resamplers.get(sampling_rate)
+        if resampler is None:
             resampler = torchaudio.transforms.Resample(orig_freq=sampling_rate, new_freq=16000)
-            waveform = resampler(waveform)
-            sampling_rate = 16000
+            self.resamplers[sampling_rate] = resampler
+        return resampler(waveform)
+
+    def transcribe_waveform(self, waveform, sampling_rate):
+        # Resample if necessary
+        waveform = self.resample(waveform, sampling_rate)
+        sampling_rate = 16000
 
         # Process the audio input
         inputs = self.processor(waveform.squeeze(), sampling_rate=sampling_rate, return_tensors="pt", padding=True)
@@ -37,8 +53,48 @@ class SpeechToTextEvaluator:
         return transcription
 
 
+    def transcribe_batch(self, waveforms, sample_rates, bucket_size=8):
+        # Resample everything to 16 kHz and keep the first channel, as transcribe_waveform does
+        audio = []
+        for waveform, sampling_rate in zip(waveforms, sample_rates):
+            waveform = self.resample(torch.as_tensor(waveform, dtype=torch.float), sampling_rate)
+            audio.append(waveform.reshape(-1, waveform.shape[-1])[0].numpy())
+
+        # Sort by length so that each bucket needs as little padding as possible
+        order = sorted(range(len(audio)), key=lambda i: audio[i].shape[0])
+        transcriptions = [None] * len(audio)
+        for start in range(0, len(order), bucket_size):
+            bucket = order[start:start + bucket_size]
+            # The mask is always requested so normalization ignores the padding
+            inputs = self.processor([audio[i] for i in bucket], sampling_rate=16000, return_tensors="pt", padding=True, return_attention_mask=True)
+            input_values = inputs.input_values.to(self.model.device)
+            model_kwargs = {}
+            if self.use_attention_mask:
+                model_kwargs["attention_mask"] = inputs.attention_mask.to(self.model.device)
+
+            with torch.no_grad():
+                logits = self.model(input_values, **model_kwargs).logits
+
+            predicted_ids = torch.argmax(logits, dim=-1)
+            for i, transcription in zip(bucket, self.processor.batch_decode(predicted_ids)):
+                transcriptions[i] = transcription
+        return transcriptions
+
+    def evaluate_wer_batch(self, waveforms, sample_rates, reference_text):
+        # reference_text is either one text for all waveforms or one text per waveform
+        if isinstance(reference_text, str):
+            reference_text = [reference_text] * len(waveforms)
+        transcriptions = self.transcribe_batch(waveforms, sample_rates)
+        return [wer(reference, transcription.lower()) for reference, transcription in zip(reference_text, transcriptions)]
+
     def evaluate_wer(self, audio_file, reference_text):
         transcription = self.transcribe_audio(audio_file)
         transcription = transcription.lower()
         wer_score = wer(reference_text, transcription)
-        return wer_score
\ No newline at end of file
+        return wer_score
+
+    def evaluate_wer_waveform(self, waveform, sampling_rate, reference_text):
+        transcription = self.transcribe_waveform(waveform, sampling_rate)
+        transcription = transcription.lower()
+        wer_score = wer(reference_text, transcription)
+        return wer_score
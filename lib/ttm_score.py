@@ -1,84 +1,227 @@
 from huggingface_hub import hf_hub_download
 import numpy as np
-import librosa
 import torch
 import torchaudio
 from scipy.signal import hilbert
 from audiocraft.metrics import CLAPTextConsistencyMetric
+from audiocraft.data.audio_utils import convert_audio
 import bittensor as bt
+import threading
+from lib.utils import LRUCache
 
 
 class MetricEvaluator:
     @staticmethod
     def calculate_snr(file_path, silence_threshold=1e-4, constant_signal_threshold=1e-2):
-        audio_signal, _ = librosa.load(file_path, sr=None)
-        if np.max(np.abs(audio_signal)) < silence_threshold:
-            return -np.inf
-        elif np.var(audio_signal) < constant_signal_threshold:
-            return -np.inf
-        signal_power = np.mean(audio_signal**2)
-        noise_signal = librosa.effects.preemphasis(audio_signal)
-        noise_power = np.mean(noise_signal**2)
-        if noise_power < 1e-10:
-            return np.inf
-        snr = 10 * np.log10(signal_power / noise_power)
-        return snr
+        audio_signal, _ = torchaudio.load(file_path)
+        return MetricEvaluator.calculate_snr_batch([audio_signal], silence_threshold, constant_signal_threshold)[0]
+
+    @staticmethod
+    def calculate_snr_batch(waveforms, silence_threshold=1e-4, constant_signal_threshold=1e-2, coef=0.97):
+        """
+        SNR of several clips at once, on the device that holds the waveforms.
+
+        Matches the librosa implementation: the clips are mixed down to mono and the
+        noise is librosa.effects.preemphasis of the signal, including its initial
+        state 2 * y[0] - y[1]. Padding is masked out of every mean.
+
+        Parameters:
+        waveforms (list): Audio tensors shaped [channels, samples] or [samples].
+
+        Returns:
+        list: One SNR in dB per clip, -inf for silent or constant clips.
+        """
+        signals = [torch.as_tensor(w, dtype=torch.float32) for w in waveforms]
+        signals = [w.reshape(-1, w.shape[-1]).mean(dim=0) for w in signals]
+        device = signals[0].device
+        lengths = torch.tensor([w.shape[0] for w in signals], device=device)
+        audio = torch.nn.utils.rnn.pad_sequence([w.to(device) for w in signals], batch_first=True)
+        mask = torch.arange(audio.shape[1], device=device)[None, :] < lengths[:, None]
+        n = lengths.to(audio.dtype)
+
+        peak = audio.abs().amax(dim=1)
+        mean = audio.sum(dim=1) / n
+        variance = (((audio - mean[:, None]) * mask) ** 2).sum(dim=1) / n
+        signal_power = (audio ** 2).sum(dim=1) / n
+
+        noise = torch.empty_like(audio)
+        noise[:, 1:] = audio[:, 1:] - coef * audio[:, :-1]
+        second = audio[:, 1] if audio.shape[1] > 1 else torch.zeros_like(audio[:, 0])
+        noise[:, 0] = audio[:, 0] + (2 * audio[:, 0] - second)
+        noise_power = ((noise * mask) ** 2).sum(dim=1) / n
+
+        snr = 10 * torch.log10(signal_power / noise_power)
+        snr = torch.where(noise_power < 1e-10, torch.full_like(snr, float('inf')), snr)
+        snr = torch.where((peak < silence_threshold) | (variance < constant_signal_threshold), torch.full_like(snr, -float('inf')), snr)
+        return snr.tolist()
 
     @staticmethod
     def calculate_consistency(file_path, text):
         try:
-            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            pt_file = hf_hub_download(repo_id="lukewys/laion_clap", filename="music_audioset_epoch_15_esc_90.14.pt")
-            clap_metric = CLAPTextConsistencyMetric(pt_file, model_arch='HTSAT-base').to(device)
-            def convert_audio(audio, from_rate, to_rate, to_channels):
-                resampler = torchaudio.transforms.Resample(orig_freq=from_rate, new_freq=to_rate)
-                audio = resampler(audio)
-                if to_channels == 1:
-                    audio = audio.mean(dim=0, keepdim=True)
-                return audio
-
             audio, sr = torchaudio.load(file_path)
-            audio = convert_audio(audio, from_rate=sr, to_rate=sr, to_channels=1)
-
-            clap_metric.update(audio.unsqueeze(0), [text], torch.tensor([audio.shape[1]]), torch.tensor([sr]))
-            consistency_score = clap_metric.compute()
-            return consistency_score
+            return ClapScoringEngine.get_instance().consistency_batch([audio], [sr], text)[0]
         except Exception as e:
             print(f"An error occurred while calculating music consistency score: {e}")
             return None
 
+
+class ClapScoringEngine(object):
+    """
+    Process-wide CLAP text consistency model. The checkpoint is downloaded and
+    loaded once, then kept resident for every TTM round.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, repo_id="lukewys/laion_clap", filename="music_audioset_epoch_15_esc_90.14.pt", device=None, text_cache_size=256):
+        if device is None:
+            device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.device = torch.device(device)
+        self.checkpoint_id = f"{repo_id}/{filename}"
+        self.checkpoint = hf_hub_download(repo_id=repo_id, filename=filename)
+        # Text embeddings keyed by (checkpoint, normalized prompt)
+        self.text_cache = LRUCache(maxsize=text_cache_size)
+        self.metric = CLAPTextConsistencyMetric(self.checkpoint, model_arch='HTSAT-base').to(self.device)
+        self.metric.eval()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, device=None):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(device=device)
+            return cls._instance
+
+    def prepare(self, waveform, sample_rate):
+        # Mono 48 kHz audio without a channel dimension, as CLAPTextConsistencyMetric.update does
+        waveform = torch.as_tensor(waveform, dtype=torch.float32)
+        waveform = waveform.reshape(-1, waveform.shape[-1])
+        return convert_audio(waveform, from_rate=sample_rate, to_rate=self.metric.model_sample_rate, to_channels=1)[0]
+
+    @staticmethod
+    def normalize_prompt(text):
+        return " ".join(text.split())
+
+    def text_embeddings(self, texts):
+        # Every miner in a round is scored against the same prompt, so each prompt is embedded once
+        keys = [(self.checkpoint_id, self.normalize_prompt(text)) for text in texts]
+        embeddings = {}
+        for key in keys:
+            embedding = self.text_cache.get(key)
+            if embedding is not None:
+                embeddings[key] = embedding
+
+        missing = [key for key in dict.fromkeys(keys) if key not in embeddings]
+        if missing:
+            # The normalized prompt is embedded, so a cached entry always matches its key
+            computed = self.metric.model.get_text_embedding([prompt for _, prompt in missing], tokenizer=self.metric._tokenizer, use_tensor=True)
+            for key, embedding in zip(missing, computed.detach()):
+                embeddings[key] = embedding
+                self.text_cache.put(key, embedding)
+        return torch.stack([embeddings[key] for key in keys])
+
+    def consistency_batch(self, waveforms, sample_rates, texts, batch_size=8):
+        """
+        Text consistency of several clips with one forward pass per batch.
+
+        CLAP fills or crops every clip to a fixed window, so zero padding would change
+        the embedding. Clips are therefore only batched with clips of the same length.
+        The cosine is taken per clip because the metric's compute() averages over the batch.
+
+        Parameters:
+        waveforms (list): Audio tensors shaped [channels, samples] or [samples].
+        sample_rates (list): Sampling rate of each clip.
+        texts (str or list): One prompt for all clips or one prompt per clip.
+
+        Returns:
+        list: One cosine similarity per clip, None where scoring failed.
+        """
+        if isinstance(texts, str):
+            texts = [texts] * len(waveforms)
+        scores = [None] * len(waveforms)
+
+        groups = {}
+        audio = []
+        for i, (waveform, sample_rate) in enumerate(zip(waveforms, sample_rates)):
+            try:
+                audio.append(self.prepare(waveform, sample_rate))
+                groups.setdefault(audio[-1].shape[-1], []).append(i)
+            except Exception as e:
+                audio.append(None)
+                bt.logging.error(f"Failed to prepare audio for the consistency score: {e}")
+
+        with self.lock, torch.no_grad():
+            for indices in groups.values():
+                for start in range(0, len(indices), batch_size):
+                    batch = indices[start:start + batch_size]
+                    try:
+                        audio_embeddings = self.metric.model.get_audio_embedding_from_data(torch.stack([audio[i] for i in batch]).to(self.device), use_tensor=True)
+                        text_embeddings = self.text_embeddings([texts[i] for i in batch])
+                        cosine_sim = torch.nn.functional.cosine_similarity(audio_embeddings, text_embeddings.to(audio_embeddings.device), dim=1, eps=1e-8)
+                        for i, score in zip(batch, cosine_sim.tolist()):
+                            scores[i] = score
+                    except Exception as e:
+                        bt.logging.error(f"An error occurred while calculating music consistency scores: {e}")
+        return scores
+
+
 class MusicQualityEvaluator:
     def __init__(self):
         pass
 
     def evaluate_music_quality(self, file_path, text=None):
+        audio, sr = torchaudio.load(file_path)
+        return self.evaluate_music_quality_batch([audio], [sr], text)[0]
+
+    def evaluate_music_quality_batch(self, waveforms, sample_rates, text=None):
+        """
+        Score decoded clips. Every metric reads the same in-memory buffers, which are
+        moved to the CLAP device once.
+
+        Parameters:
+        waveforms (list): Audio tensors shaped [channels, samples] or [samples].
+        sample_rates (list): Sampling rate of each clip.
+        text (str or list): One prompt for all clips or one prompt per clip.
+
+        Returns:
+        list: One aggregate score per clip.
+        """
+        engine = ClapScoringEngine.get_instance()
+        waveforms = [torch.as_tensor(w, dtype=torch.float32).to(engine.device) for w in waveforms]
+
         try:
-            snr_score = MetricEvaluator.calculate_snr(file_path)
-            bt.logging.info(f'.......SNR......: {snr_score} dB')
+            snr_scores = MetricEvaluator.calculate_snr_batch(waveforms)
+            for snr_score in snr_scores:
+                bt.logging.info(f'.......SNR......: {snr_score} dB')
         except:
+            snr_scores = [None] * len(waveforms)
             bt.logging.error(f"Failed to calculate SNR")
 
         try:
-            consistency_score = MetricEvaluator.calculate_consistency(file_path, text)
-            bt.logging.info(f'....... Consistency Score ......: {consistency_score}')
+            # All clips go through the resident CLAP model together
+            consistency_scores = engine.consistency_batch(waveforms, sample_rates, text)
         except:
+            consistency_scores = [None] * len(waveforms)
             bt.logging.error(f"Failed to calculate Consistency score")
 
+        return [self.aggregate_score(snr_score, consistency_score) for snr_score, consistency_score in zip(snr_scores, consistency_scores)]
+
+    def aggregate_score(self, snr_score, consistency_score):
+        bt.logging.info(f'....... Consistency Score ......: {consistency_score}')
+        if snr_score is None or consistency_score is None:
+            bt.logging.info(f'....... Aggregate Score ......: 0')
+            return 0
+
         # Normalize scores and calculate aggregate score
         normalized_snr = 1 / (1 + np.exp(-snr_score / 20))
-        normalized_consistency = (consistency_score + 1) / 2 if consistency_score is not None and consistency_score >= 0 else 0
-
-        if consistency_score is not None:
-            if consistency_score > 0:
-                normalized_consistency = (consistency_score + 1) / 2  # Normalizes from [0, 1] to [0.5, 1]
-            else:
-                normalized_consistency = 0  # Ensures that a consistency_score of 0 or any negative value yields a normalized score of 0
+        if consistency_score > 0:
+            normalized_consistency = (consistency_score + 1) / 2  # Normalizes from [0, 1] to [0.5, 1]
         else:
-            normalized_consistency = 0  # Handles cases where consistency_score is None
+            normalized_consistency = 0  # Ensures that a consistency_score of 0 or any negative value yields a normalized score of 0
 
         bt.logging.info(f'....... Normalized SNR {normalized_snr}DB - Normalized Consistency {normalized_consistency} ......')
         bt.logging.info(f'....... SNR {snr_score}DB - Consistency {consistency_score} ......')
         aggregate_score = 0.6 * normalized_snr + 0.4 * normalized_consistency 
         aggregate_score = aggregate_score if consistency_score >= 0.2 else 0
         bt.logging.info(f'....... Aggregate Score ......: {aggregate_score}')
-        return aggregate_score
\ No newline at end of file
+        return aggregate_score
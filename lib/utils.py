@@ -27,6 +27,8 @@ import git
 import subprocess
 import codecs
 import wandb
+import threading
+from collections import OrderedDict
 
 def version2number(version):
     return int(version.replace('.', '').replace('-', '').replace('_', ''))
@@ -149,4 +151,38 @@ def try_update():
                 try_update_packages()
                 restart_app()
     except Exception as e:
-        bt.logging.info(f"Try updating failed {e}")
\ No newline at end of file
+        bt.logging.info(f"Try updating failed {e}")
+
+
+class LRUCache(object):
+    """Thread-safe mapping that keeps at most maxsize entries, evicting the least recently used."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,71 @@
+import threading
+import time
+import bittensor as bt
+
+
+class ModelWarmup(object):
+    """
+    Loads the miner's models (one per route) on background threads.
+
+    Each route becomes ready as soon as its own loader returns, so the axon can serve
+    while the slower models are still loading. A loader that raises is recorded in
+    errors instead of bringing down the other routes.
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.errors = {}
+        self.events = {}
+        self.threads = {}
+        self.changed = threading.Condition()
+
+    def start(self, route, loader):
+        '''Run loader() on a daemon thread, its return value becomes the model of the route.'''
+        self.events[route] = threading.Event()
+        thread = threading.Thread(target=self._load, args=(route, loader), name=f"warmup-{route}", daemon=True)
+        self.threads[route] = thread
+        thread.start()
+        return thread
+
+    def _load(self, route, loader):
+        start = time.time()
+        try:
+            model = loader()
+            with self.changed:
+                self.models[route] = model
+            bt.logging.success(f"The {route} model is ready after {time.time() - start:.1f}s")
+        except Exception as e:
+            with self.changed:
+                self.errors[route] = e
+            bt.logging.error(f"An error occurred while loading the {route} model: {e}")
+        finally:
+            with self.changed:
+                self.events[route].set()
+                self.changed.notify_all()
+
+    def ready(self, route):
+        return route in self.models
+
+    def get(self, route):
+        return self.models.get(route)
+
+    def done(self):
+        return all(event.is_set() for event in self.events.values())
+
+    def wait(self, route, timeout=None):
+        '''Block until the route finished loading, returns whether it is ready.'''
+        self.events[route].wait(timeout)
+        return self.ready(route)
+
+    def wait_first(self, timeout=None):
+        '''Block until any route is ready or every loader finished, returns the ready routes.'''
+        with self.changed:
+            self.changed.wait_for(lambda: self.models or self.done(), timeout)
+            return list(self.models)
+
+    def status(self):
+        '''{route: "ready" | "warming" | "failed"}'''
+        return {
+            route: "ready" if route in self.models else "failed" if route in self.errors else "warming"
+            for route in self.events
+        }
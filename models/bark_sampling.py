@@ -0,0 +1,47 @@
+import torch
+import torch.nn.functional as F
+
+
+def filter_logits(logits, top_k=None, top_p=None):
+    """
+    Top-k and top-p (nucleus) filtering over the last dimension, for any number of
+    leading dimensions. Filtered entries are set to -inf. Everything stays on the
+    device of the logits, the model output itself is not modified.
+    """
+    logits = logits.float()
+    if top_p is not None:
+        sorted_logits, sorted_indices = torch.sort(logits, dim=-1, descending=True)
+        cumulative_probs = torch.cumsum(F.softmax(sorted_logits, dim=-1), dim=-1)
+        sorted_to_remove = cumulative_probs > top_p
+        # shift right, so the token that crosses top_p is kept
+        sorted_to_remove[..., 1:] = sorted_to_remove[..., :-1].clone()
+        sorted_to_remove[..., 0] = False
+        to_remove = torch.zeros_like(sorted_to_remove).scatter(-1, sorted_indices, sorted_to_remove)
+        logits = logits.masked_fill(to_remove, -float("inf"))
+    if top_k is not None:
+        v, _ = torch.topk(logits, min(top_k, logits.size(-1)), dim=-1)
+        logits = logits.masked_fill(logits < v[..., [-1]], -float("inf"))
+    return logits
+
+
+def sample_logits(logits, temp=1.0, top_k=None, top_p=None):
+    """
+    Draws one token for every row of logits [..., vocab] with a single torch.multinomial.
+
+    Parameters:
+    logits (torch.Tensor): Unnormalized scores, the last dimension is the vocabulary.
+    temp (float): Sampling temperature.
+    top_k (int): Keep only the top_k most likely tokens.
+    top_p (float): Keep the smallest set of tokens whose probability reaches top_p.
+
+    Returns:
+    tuple: Tokens shaped [..., 1] and the probabilities shaped [..., vocab].
+    """
+    probs = F.softmax(filter_logits(logits, top_k=top_k, top_p=top_p) / temp, dim=-1)
+    flat_probs = probs.reshape(-1, probs.size(-1))
+    # multinomial bugged on mps: shuttle to cpu if necessary
+    if flat_probs.device.type == "mps":
+        tokens = torch.multinomial(flat_probs.cpu(), num_samples=1).to(probs.device)
+    else:
+        tokens = torch.multinomial(flat_probs, num_samples=1)
+    return tokens.reshape(probs.shape[:-1] + (1,)), probs
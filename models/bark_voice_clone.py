@@ -35,25 +35,32 @@ import fairseq
 import logging
 import hashlib
 import contextlib
+import threading
+import queue
+import time
 import numpy as np
 import urllib.request
 import torch.nn as nn
 import huggingface_hub
 from pathlib import Path
+from collections import OrderedDict
 from zipfile import ZipFile
 from torch import nn, optim
 import torch.nn.functional as F
 from einops import pack, unpack
 from encodec import EncodecModel
 from dataclasses import dataclass
-from scipy.special import softmax
 from torch.nn import functional as F
 from transformers import BertTokenizer
 from torchaudio.functional import resample
 from huggingface_hub import hf_hub_download
+from concurrent.futures import Future
 from einops import rearrange, repeat, reduce
 from torch.serialization import MAP_LOCATION
 from audiolm_pytorch.utils import curtail_to_multiple
+from lib.utils import LRUCache
+from lib.checkpoints import ConvertedCheckpoint
+from models.bark_sampling import sample_logits
 logging.root.setLevel(logging.ERROR)
 
 
@@ -69,6 +76,39 @@ class LayerNorm(nn.Module):
     def forward(self, input):
         return F.layer_norm(input, self.weight.shape, self.weight, self.bias, 1e-5)
 
+class StaticKVCache:
+    """
+    Key/value buffers for every layer, preallocated at block_size on the first write. Each
+    decoding step writes its position in place, instead of growing past_kv with torch.cat.
+    """
+
+    def __init__(self, config, batch_size=1):
+        self.config = config
+        self.batch_size = batch_size
+        self.keys = None
+        self.values = None
+        self.length = 0  # number of positions already written
+
+    def update(self, layer_idx, k, v):
+        # k, v: (B, nh, T, hs) for positions [length, length + T)
+        if self.keys is None or self.keys.dtype != k.dtype or self.keys.device != k.device:
+            shape = (self.config.n_layer, self.batch_size, k.size(1), self.config.block_size, k.size(-1))
+            self.keys = torch.empty(shape, dtype=k.dtype, device=k.device)
+            self.values = torch.empty(shape, dtype=v.dtype, device=v.device)
+        end = self.length + k.size(-2)
+        assert end <= self.config.block_size, f"KV cache is full, block size is only {self.config.block_size}"
+        self.keys[layer_idx, :, :, self.length:end] = k
+        self.values[layer_idx, :, :, self.length:end] = v
+        return self.keys[layer_idx, :, :, :end], self.values[layer_idx, :, :, :end]
+
+    def advance(self, t):
+        self.length += t
+
+    def reset(self):
+        # Keeps the buffers, the next window overwrites them
+        self.length = 0
+
+
 class CausalSelfAttention(nn.Module):
 
     def __init__(self, config):
@@ -92,7 +132,7 @@ class CausalSelfAttention(nn.Module):
             self.register_buffer("bias", torch.tril(torch.ones(config.block_size, config.block_size))
                                         .view(1, 1, config.block_size, config.block_size))
 
-    def forward(self, x, past_kv=None, use_cache=False):
+    def forward(self, x, past_kv=None, use_cache=False, layer_idx=None):
         B, T, C = x.size() # batch size, sequence length, embedding dimensionality (n_embd)
 
         # calculate query, key, values for all heads in batch and move head forward to be the batch dim
@@ -101,24 +141,27 @@ class CausalSelfAttention(nn.Module):
         q = q.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
         v = v.view(B, T, self.n_head, C // self.n_head).transpose(1, 2) # (B, nh, T, hs)
 
-        if past_kv is not None:
+        if isinstance(past_kv, StaticKVCache):
+            # written in place, the returned keys and values are views up to the current position
+            k, v = past_kv.update(layer_idx, k, v)
+            FULL_T = k.shape[-2]
+            present = past_kv if use_cache else None
+        elif past_kv is not None:
             past_key = past_kv[0]
             past_value = past_kv[1]
             k = torch.cat((past_key, k), dim=-2)
             v = torch.cat((past_value, v), dim=-2)
-
-        FULL_T = k.shape[-2]
-
-        if use_cache is True:
-            present = (k, v)
+            FULL_T = k.shape[-2]
+            present = (k, v) if use_cache is True else None
         else:
-            present = None
+            FULL_T = k.shape[-2]
+            present = (k, v) if use_cache is True else None
 
         # causal self-attention; Self-attend: (B, nh, T, hs) x (B, nh, hs, T) -> (B, nh, T, T)
         if self.flash:
             # efficient attention using Flash Attention CUDA kernels
-            if past_kv is not None:
-                # When `past_kv` is provided, we're doing incremental decoding and `q.shape[2] == 1`: q only contains
+            if FULL_T > T:
+                # When past keys are provided, we're doing incremental decoding and `q.shape[2] == 1`: q only contains
                 # the query for the last token. scaled_dot_product_attention interprets this as the first token in the
                 # sequence, so if is_causal=True it will mask out all attention from it. This is not what we want, so 
                 # to work around this we set is_causal=False.
@@ -167,7 +210,7 @@ class Block(nn.Module):
         self.layer_idx = layer_idx
 
     def forward(self, x, past_kv=None, use_cache=False):
-        attn_output, prev_kvs = self.attn(self.ln_1(x), past_kv=past_kv, use_cache=use_cache)
+        attn_output, prev_kvs = self.attn(self.ln_1(x), past_kv=past_kv, use_cache=use_cache, layer_idx=self.layer_idx)
         x = x + attn_output
         x = x + self.mlp(self.ln_2(x))
         return (x, prev_kvs)
@@ -217,7 +260,13 @@ class GPT(nn.Module):
     def forward(self, idx, merge_context=False, past_kv=None, position_ids=None, use_cache=False, training=False):
         device = idx.device
         b, t = idx.size()
-        if past_kv is not None:
+        static_cache = isinstance(past_kv, StaticKVCache)
+        if static_cache and past_kv.length == 0:
+            # the first call fills the static cache with the whole context
+            incremental = False
+        else:
+            incremental = past_kv is not None
+        if incremental:
             assert t == 1
             tok_emb = self.transformer.wte(idx) # token embeddings of shape (b, t, n_embd)
         else:
@@ -236,11 +285,15 @@ class GPT(nn.Module):
             else:
                 tok_emb = self.transformer.wte(idx) # token embeddings of shape (b, t, n_embd)
 
-        if past_kv is None:
+        if static_cache:
+            past_length = past_kv.length
+            layer_kvs = [past_kv] * len(self.transformer.h)
+        elif past_kv is None:
             past_length = 0
-            past_kv = tuple([None] * len(self.transformer.h))
+            layer_kvs = tuple([None] * len(self.transformer.h))
         else:
             past_length = past_kv[0][0].size(-2)
+            layer_kvs = past_kv
 
         if position_ids is None:
             position_ids = torch.arange(past_length, t + past_length, dtype=torch.long, device=device)
@@ -253,12 +306,16 @@ class GPT(nn.Module):
 
         new_kv = () if use_cache else None
 
-        for i, (block, past_layer_kv) in enumerate(zip(self.transformer.h, past_kv)):
+        for i, (block, past_layer_kv) in enumerate(zip(self.transformer.h, layer_kvs)):
             x, kv = block(x, past_kv=past_layer_kv, use_cache=use_cache)
 
             if use_cache:
                 new_kv = new_kv + (kv,)
 
+        if static_cache:
+            past_kv.advance(t)
+            new_kv = past_kv if use_cache else None
+
         x = self.transformer.ln_f(x)
 
         
@@ -885,18 +942,8 @@ def clean_models(model_key=None):
     gc.collect()
 
 
-def _load_model(ckpt_path, device, use_small=False, model_type="text"):
-    if model_type == "text":
-        ConfigClass = GPTConfig
-        ModelClass = GPT
-    elif model_type == "coarse":
-        ConfigClass = GPTConfig
-        ModelClass = GPT
-    elif model_type == "fine":
-        ConfigClass = FineGPTConfig
-        ModelClass = FineGPT
-    else:
-        raise NotImplementedError()
+def _read_checkpoint(ckpt_path, device, use_small=False, model_type="text"):
+    """State dict with fixed-up keys and model arguments of a pickled checkpoint."""
     model_key = f"{model_type}_small" if use_small or USE_SMALL_MODELS else model_type
     model_info = REMOTE_MODEL_PATHS[model_key]
     # if (
@@ -923,8 +970,6 @@ def _load_model(ckpt_path, device, use_small=False, model_type="text"):
         model_args["input_vocab_size"] = model_args["vocab_size"]
         model_args["output_vocab_size"] = model_args["vocab_size"]
         del model_args["vocab_size"]
-    gptconf = ConfigClass(**model_args)
-    model = ModelClass(gptconf)
     if checkpoint.get("model", None) is not None:
         state_dict = checkpoint["model"]
     else:
@@ -961,6 +1006,34 @@ def _load_model(ckpt_path, device, use_small=False, model_type="text"):
         state_dict['lm_heads.5.weight'] = state_dict.pop('lm_heads.5.0.weight')
     if state_dict.get('lm_heads.6.0.weight', None) is not None:
         state_dict['lm_heads.6.weight'] = state_dict.pop('lm_heads.6.0.weight')
+    if checkpoint.get("best_val_loss", None) is not None:
+        val_loss = checkpoint["best_val_loss"].item()
+        logger.info(f"checkpoint loaded: {round(val_loss,3)} loss")
+    return state_dict, model_args
+
+
+def _load_model(ckpt_path, device, use_small=False, model_type="text"):
+    if model_type == "text":
+        ConfigClass = GPTConfig
+        ModelClass = GPT
+    elif model_type == "coarse":
+        ConfigClass = GPTConfig
+        ModelClass = GPT
+    elif model_type == "fine":
+        ConfigClass = FineGPTConfig
+        ModelClass = FineGPT
+    else:
+        raise NotImplementedError()
+    # converted once to safetensors with fixed keys, later loads map it straight to the device
+    converted = ConvertedCheckpoint(ckpt_path)
+    loaded = converted.load(device)
+    if loaded is None:
+        state_dict, model_args = _read_checkpoint(ckpt_path, device, use_small=use_small, model_type=model_type)
+        converted.save(state_dict, model_args)
+    else:
+        state_dict, model_args = loaded
+    gptconf = ConfigClass(**model_args)
+    model = ModelClass(gptconf)
     extra_keys = set(state_dict.keys()) - set(model.state_dict().keys())
     extra_keys = set([k for k in extra_keys if not k.endswith(".attn.bias")])
     missing_keys = set(model.state_dict().keys()) - set(state_dict.keys())
@@ -971,12 +1044,10 @@ def _load_model(ckpt_path, device, use_small=False, model_type="text"):
         raise ValueError(f"missing keys: {missing_keys}")
     model.load_state_dict(state_dict, strict=False)
     n_params = model.get_num_params()
-    if checkpoint.get("best_val_loss", None) is not None:
-        val_loss = checkpoint["best_val_loss"].item()
-        logger.info(f"model loaded: {round(n_params/1e6,1)}M params, {round(val_loss,3)} loss")
+    logger.info(f"model loaded: {round(n_params/1e6,1)}M params")
     model.eval()
     model.to(device)
-    del checkpoint, state_dict
+    del state_dict
     _clear_cuda_cache()
     if model_type == "text":
         tokenizer = BertTokenizer.from_pretrained("bert-base-multilingual-cased")
@@ -1076,6 +1147,100 @@ def preload_models(
     _ = load_codec_model(use_gpu=codec_use_gpu, force_reload=force_reload)
 
 
+class BarkModelRegistry:
+    """
+    Keeps the Bark text, coarse, fine and codec models resident on the GPU under a VRAM budget.
+
+    Every stage is loaded once. When moving a stage to the GPU would exceed the budget, the
+    least recently used resident stages are moved back to the CPU. Without a budget all four
+    stages stay on the GPU; SERP_OFFLOAD_CPU keeps a single stage on the GPU at a time.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+    STAGES = ("text", "coarse", "fine", "codec")
+
+    def __init__(self, vram_budget_gb=None, path="models", use_gpu=True):
+        self.device = _grab_best_device(use_gpu=use_gpu)
+        if vram_budget_gb is None and OFFLOAD_CPU:
+            vram_budget_gb = 0
+        self.budget = None if vram_budget_gb is None else int(vram_budget_gb * 1024 ** 3)
+        self.path = path
+        self.resident = OrderedDict()  # stage -> bytes, least recently used first
+        self.lock = threading.RLock()
+
+    @classmethod
+    def get_instance(cls, vram_budget_gb=None, path="models"):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(vram_budget_gb=vram_budget_gb, path=path)
+            return cls._instance
+
+    def stage_device(self, stage):
+        # encodec doesn't support mps
+        if stage == "codec" and self.device == "mps":
+            return "cpu"
+        return self.device
+
+    def module(self, stage):
+        model = models[stage]
+        return model["model"] if stage == "text" else model
+
+    def load(self, stage):
+        # loaded on the CPU, acquire places it
+        if stage == "codec":
+            load_codec_model(use_gpu=False)
+        else:
+            load_model(model_type=stage, use_gpu=False, path=self.path)
+        self.resident.pop(stage, None)
+
+    def size(self, stage):
+        module = self.module(stage)
+        tensors = list(module.parameters()) + list(module.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+
+    def acquire(self, stage):
+        """Model of the stage on its device, loading it or evicting other stages as needed."""
+        with self.lock:
+            if stage not in models:
+                self.load(stage)
+            if stage in self.resident:
+                self.resident.move_to_end(stage)
+                return models[stage]
+            device = self.stage_device(stage)
+            if device != "cpu":
+                size = self.size(stage)
+                evicted = False
+                while self.budget is not None and self.resident and sum(self.resident.values()) + size > self.budget:
+                    victim, _ = self.resident.popitem(last=False)
+                    if victim in models:
+                        self.module(victim).to("cpu")
+                    logger.info(f"evicted bark {victim} model to cpu")
+                    evicted = True
+                if evicted:
+                    _clear_cuda_cache()
+                self.resident[stage] = size
+            self.module(stage).to(device)
+            return models[stage]
+
+    def warmup(self):
+        """Loads every stage and places as many as the budget allows, in pipeline order."""
+        for stage in self.STAGES:
+            self.acquire(stage)
+        return self.report()
+
+    def report(self):
+        """Memory of each loaded stage in MB and where it currently is."""
+        with self.lock:
+            return {
+                stage: {
+                    "mb": round(self.size(stage) / 1024 ** 2, 1),
+                    "device": str(next(self.module(stage).parameters()).device),
+                }
+                for stage in self.STAGES
+                if stage in models
+            }
+
+
 ####
 # Generation Functionality
 ####
@@ -1091,38 +1256,41 @@ def _detokenize(tokenizer, enc_text):
 def _normalize_whitespace(text):
     return re.sub(r"\s+", " ", text).strip()
 
+
+def _load_history_prompt(history_prompt):
+    """
+    History prompt as a dict of arrays. A dict (e.g. from the voice prompt cache) is used as is,
+    a string is a .npz path or the name of a prompt under assets/prompts.
+    """
+    if isinstance(history_prompt, dict):
+        return history_prompt
+    if history_prompt.endswith(".npz"):
+        path = history_prompt
+    else:
+        path = os.path.join(CUR_PATH, "assets", "prompts", f"{history_prompt}.npz")
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _history_array(x_history, name):
+    # Older prompt files use "semantic", "coarse" and "fine" as keys
+    if f"{name}_prompt" in x_history:
+        return x_history[f"{name}_prompt"]
+    return x_history[name]
+
 TEXT_ENCODING_OFFSET = 10_048
 SEMANTIC_PAD_TOKEN = 10_000
 TEXT_PAD_TOKEN = 129_595
 SEMANTIC_INFER_TOKEN = 129_599
 
 
-def generate_text_semantic(
-    text,
-    history_prompt=None,
-    temp=0.7,
-    top_k=None,
-    top_p=None,
-    silent=False,
-    min_eos_p=0.2,
-    max_gen_duration_s=None,
-    allow_early_stop=True,
-    use_kv_caching=False,
-):
-    """Generate semantic tokens from text."""
+def _semantic_input(text, history_prompt, tokenizer):
+    """Text tokens, semantic history and infer token of one sequence, 256 + 256 + 1 tokens."""
     assert isinstance(text, str)
     text = _normalize_whitespace(text)
     assert len(text.strip()) > 0
     if history_prompt is not None:
-        if history_prompt.endswith(".npz"):
-            try:
-                semantic_history = np.load(history_prompt)["semantic_prompt"]
-            except:
-                semantic_history = np.load(history_prompt)["semantic"]
-        else:
-            semantic_history = np.load(
-                os.path.join(CUR_PATH, "assets", "prompts", f"{history_prompt}.npz")
-            )["semantic_prompt"]
+        semantic_history = _history_array(_load_history_prompt(history_prompt), "semantic")
         assert (
             isinstance(semantic_history, np.ndarray)
             and len(semantic_history.shape) == 1
@@ -1132,18 +1300,7 @@ def generate_text_semantic(
         )
     else:
         semantic_history = None
-    # load models if not yet exist
-    global models
-    global models_devices
-    if "text" not in models:
-        preload_models()
-    model_container = models["text"]
-    model = model_container["model"]
-    tokenizer = model_container["tokenizer"]
     encoded_text = np.array(_tokenize(tokenizer, text)) + TEXT_ENCODING_OFFSET
-    if OFFLOAD_CPU:
-        model.to(models_devices["text"])
-    device = next(model.parameters()).device
     if len(encoded_text) > 256:
         p = round((len(encoded_text) - 256) / len(encoded_text) * 100, 1)
         logger.warning(f"warning, text too long, lopping of last {p}%")
@@ -1166,12 +1323,69 @@ def generate_text_semantic(
         )
     else:
         semantic_history = np.array([SEMANTIC_PAD_TOKEN] * 256)
+    x = np.hstack([
+        encoded_text, semantic_history, np.array([SEMANTIC_INFER_TOKEN])
+    ]).astype(np.int64)
+    assert x.shape[0] == 256 + 256 + 1
+    return x
+
+
+def generate_text_semantic(
+    text,
+    history_prompt=None,
+    temp=0.7,
+    top_k=None,
+    top_p=None,
+    silent=False,
+    min_eos_p=0.2,
+    max_gen_duration_s=None,
+    allow_early_stop=True,
+    use_kv_caching=True,
+):
+    """Generate semantic tokens from text."""
+    return generate_text_semantic_batch(
+        [text],
+        history_prompts=[history_prompt],
+        temp=temp,
+        top_k=top_k,
+        top_p=top_p,
+        silent=silent,
+        min_eos_p=min_eos_p,
+        max_gen_duration_s=max_gen_duration_s,
+        allow_early_stop=allow_early_stop,
+        use_kv_caching=use_kv_caching,
+    )[0]
+
+
+def generate_text_semantic_batch(
+    texts,
+    history_prompts=None,
+    temp=0.7,
+    top_k=None,
+    top_p=None,
+    silent=False,
+    min_eos_p=0.2,
+    max_gen_duration_s=None,
+    allow_early_stop=True,
+    use_kv_caching=True,
+):
+    """
+    Generate semantic tokens for several texts in one batch, each with its own history prompt.
+    Every input is 256 + 256 + 1 tokens, so the sequences stay aligned. A sequence that reaches
+    eos keeps decoding pad tokens until the whole batch is done, and is cut at its own length.
+    """
+    if history_prompts is None:
+        history_prompts = [None] * len(texts)
+    assert len(history_prompts) == len(texts)
+    # load models if not yet exist
+    model_container = BarkModelRegistry.get_instance().acquire("text")
+    model = model_container["model"]
+    tokenizer = model_container["tokenizer"]
     x = torch.from_numpy(
-        np.hstack([
-            encoded_text, semantic_history, np.array([SEMANTIC_INFER_TOKEN])
-        ]).astype(np.int64)
-    )[None]
-    assert x.shape[1] == 256 + 256 + 1
+        np.stack([_semantic_input(text, history_prompt, tokenizer) for text, history_prompt in zip(texts, history_prompts)])
+    )
+    device = next(model.parameters()).device
+    n_seq = x.shape[0]
     with _inference_mode():
         x = x.to(device)
         n_tot_steps = 768
@@ -1179,52 +1393,37 @@ def generate_text_semantic(
         pbar = tqdm.tqdm(disable=silent, total=100)
         pbar_state = 0
         tot_generated_duration_s = 0
-        kv_cache = None
+        # number of generated tokens of each sequence, -1 until it reaches eos
+        lengths = torch.full((n_seq,), -1, dtype=torch.long, device=device)
+        done = torch.zeros(n_seq, dtype=torch.bool, device=device)
+        kv_cache = StaticKVCache(model.config, batch_size=n_seq) if use_kv_caching else None
         for n in range(n_tot_steps):
-            if use_kv_caching and kv_cache is not None:
+            if use_kv_caching and kv_cache.length > 0:
                 x_input = x[:, [-1]]
             else:
                 x_input = x
-            logits, kv_cache = model(
+            logits, _ = model(
                 x_input, merge_context=True, use_cache=use_kv_caching, past_kv=kv_cache
             )
-            relevant_logits = logits[0, 0, :SEMANTIC_VOCAB_SIZE]
+            relevant_logits = logits[:, 0, :SEMANTIC_VOCAB_SIZE]
             if allow_early_stop:
                 relevant_logits = torch.hstack(
-                    (relevant_logits, logits[0, 0, [SEMANTIC_PAD_TOKEN]])  # eos
+                    (relevant_logits, logits[:, 0, [SEMANTIC_PAD_TOKEN]])  # eos
                 )
-            if top_p is not None:
-                # faster to convert to numpy
-                original_device = relevant_logits.device
-                relevant_logits = relevant_logits.detach().cpu().type(torch.float32).numpy()
-                sorted_indices = np.argsort(relevant_logits)[::-1]
-                sorted_logits = relevant_logits[sorted_indices]
-                cumulative_probs = np.cumsum(softmax(sorted_logits))
-                sorted_indices_to_remove = cumulative_probs > top_p
-                sorted_indices_to_remove[1:] = sorted_indices_to_remove[:-1].copy()
-                sorted_indices_to_remove[0] = False
-                relevant_logits[sorted_indices[sorted_indices_to_remove]] = -np.inf
-                relevant_logits = torch.from_numpy(relevant_logits)
-                relevant_logits = relevant_logits.to(original_device)
-            if top_k is not None:
-                v, _ = torch.topk(relevant_logits, min(top_k, relevant_logits.size(-1)))
-                relevant_logits[relevant_logits < v[-1]] = -float("Inf")
-            probs = F.softmax(relevant_logits / temp, dim=-1)
-            # multinomial bugged on mps: shuttle to cpu if necessary
-            inf_device = probs.device
-            if probs.device.type == "mps":
-                probs = probs.to("cpu")
-            item_next = torch.multinomial(probs, num_samples=1)
-            probs = probs.to(inf_device)
-            item_next = item_next.to(inf_device)
-            if allow_early_stop and (
-                item_next == SEMANTIC_VOCAB_SIZE
-                or (min_eos_p is not None and probs[-1] >= min_eos_p)
-            ):
-                # eos found, so break
-                pbar.update(100 - pbar_state)
-                break
-            x = torch.cat((x, item_next[None]), dim=1)
+            item_next, probs = sample_logits(relevant_logits, temp=temp, top_k=top_k, top_p=top_p)
+            if allow_early_stop:
+                eos = item_next[:, 0] == SEMANTIC_VOCAB_SIZE
+                if min_eos_p is not None:
+                    eos |= probs[:, -1] >= min_eos_p
+                lengths = torch.where(eos & ~done, torch.full_like(lengths, n), lengths)
+                done |= eos
+                if bool(done.all()):
+                    # eos found in every sequence, so break
+                    pbar.update(100 - pbar_state)
+                    break
+                # finished sequences are padded, so the batch stays aligned
+                item_next = item_next.masked_fill(done[:, None], SEMANTIC_PAD_TOKEN)
+            x = torch.cat((x, item_next), dim=1)
             tot_generated_duration_s += 1 / SEMANTIC_RATE_HZ
             if max_gen_duration_s is not None and tot_generated_duration_s > max_gen_duration_s:
                 pbar.update(100 - pbar_state)
@@ -1238,12 +1437,15 @@ def generate_text_semantic(
                 pbar.update(req_pbar_state - pbar_state)
             pbar_state = req_pbar_state
         pbar.close()
-        out = x.detach().cpu().numpy().squeeze()[256 + 256 + 1 :]
-    if OFFLOAD_CPU:
-        model.to("cpu")
-    assert all(0 <= out) and all(out < SEMANTIC_VOCAB_SIZE)
+        out = x.detach().cpu().numpy()[:, 256 + 256 + 1 :]
+        lengths = lengths.cpu().tolist()
+    outputs = []
+    for row, length in zip(out, lengths):
+        row = row[:length] if length >= 0 else row
+        assert all(0 <= row) and all(row < SEMANTIC_VOCAB_SIZE)
+        outputs.append(row)
     _clear_cuda_cache()
-    return out
+    return outputs
 
 
 def _flatten_codebooks(arr, offset_size=CODEBOOK_SIZE):
@@ -1260,6 +1462,47 @@ COARSE_SEMANTIC_PAD_TOKEN = 12_048
 COARSE_INFER_TOKEN = 12_050
 
 
+def _coarse_histories(history_prompt, max_semantic_history, semantic_to_coarse_ratio):
+    """Trimmed semantic and flattened coarse history of one sequence."""
+    if history_prompt is None:
+        return np.array([], dtype=np.int32), np.array([], dtype=np.int32)
+    x_history = _load_history_prompt(history_prompt)
+    x_semantic_history = _history_array(x_history, "semantic")
+    x_coarse_history = _history_array(x_history, "coarse")
+    assert (
+        isinstance(x_semantic_history, np.ndarray)
+        and len(x_semantic_history.shape) == 1
+        and len(x_semantic_history) > 0
+        and x_semantic_history.min() >= 0
+        and x_semantic_history.max() <= SEMANTIC_VOCAB_SIZE - 1
+        and isinstance(x_coarse_history, np.ndarray)
+        and len(x_coarse_history.shape) == 2
+        and x_coarse_history.shape[0] == N_COARSE_CODEBOOKS
+        and x_coarse_history.shape[-1] >= 0
+        and x_coarse_history.min() >= 0
+        and x_coarse_history.max() <= CODEBOOK_SIZE - 1
+        and (
+            round(x_coarse_history.shape[-1] / len(x_semantic_history), 1)
+            == round(semantic_to_coarse_ratio / N_COARSE_CODEBOOKS, 1)
+        )
+    )
+    x_coarse_history = _flatten_codebooks(x_coarse_history) + SEMANTIC_VOCAB_SIZE
+    # trim histories correctly
+    n_semantic_hist_provided = np.min(
+        [
+            max_semantic_history,
+            len(x_semantic_history) - len(x_semantic_history) % 2,
+            int(np.floor(len(x_coarse_history) / semantic_to_coarse_ratio)),
+        ]
+    )
+    n_coarse_hist_provided = int(round(n_semantic_hist_provided * semantic_to_coarse_ratio))
+    x_semantic_history = x_semantic_history[-n_semantic_hist_provided:].astype(np.int32)
+    x_coarse_history = x_coarse_history[-n_coarse_hist_provided:].astype(np.int32)
+    # TODO: bit of a hack for time alignment (sounds better)
+    x_coarse_history = x_coarse_history[:-2]
+    return x_semantic_history, x_coarse_history
+
+
 def generate_coarse(
     x_semantic,
     history_prompt=None,
@@ -1269,179 +1512,151 @@ def generate_coarse(
     silent=False,
     max_coarse_history=630,  # min 60 (faster), max 630 (more context)
     sliding_window_len=60,
-    use_kv_caching=False,
+    use_kv_caching=True,
 ):
     """Generate coarse audio codes from semantic tokens."""
-    assert (
-        isinstance(x_semantic, np.ndarray)
-        and len(x_semantic.shape) == 1
-        and len(x_semantic) > 0
-        and x_semantic.min() >= 0
-        and x_semantic.max() <= SEMANTIC_VOCAB_SIZE - 1
-    )
+    return generate_coarse_batch(
+        [x_semantic],
+        history_prompts=[history_prompt],
+        temp=temp,
+        top_k=top_k,
+        top_p=top_p,
+        silent=silent,
+        max_coarse_history=max_coarse_history,
+        sliding_window_len=sliding_window_len,
+        use_kv_caching=use_kv_caching,
+    )[0]
+
+
+def generate_coarse_batch(
+    x_semantics,
+    history_prompts=None,
+    temp=0.7,
+    top_k=None,
+    top_p=None,
+    silent=False,
+    max_coarse_history=630,  # min 60 (faster), max 630 (more context)
+    sliding_window_len=60,
+    use_kv_caching=True,
+):
+    """
+    Generate coarse audio codes for several semantic sequences, each with its own history prompt.
+    Sequences whose coarse histories have the same length share one batch. Each batch runs
+    until its longest sequence is done, the shorter ones are cut at their own length.
+    """
+    for x_semantic in x_semantics:
+        assert (
+            isinstance(x_semantic, np.ndarray)
+            and len(x_semantic.shape) == 1
+            and len(x_semantic) > 0
+            and x_semantic.min() >= 0
+            and x_semantic.max() <= SEMANTIC_VOCAB_SIZE - 1
+        )
+    if history_prompts is None:
+        history_prompts = [None] * len(x_semantics)
+    assert len(history_prompts) == len(x_semantics)
     assert 60 <= max_coarse_history <= 630
     assert max_coarse_history + sliding_window_len <= 1024 - 256
     semantic_to_coarse_ratio = COARSE_RATE_HZ / SEMANTIC_RATE_HZ * N_COARSE_CODEBOOKS
     max_semantic_history = int(np.floor(max_coarse_history / semantic_to_coarse_ratio))
-    if history_prompt is not None:
-        if history_prompt.endswith(".npz"):
-            x_history = np.load(history_prompt)
-        else:
-            x_history = np.load(
-                os.path.join(CUR_PATH, "assets", "prompts", f"{history_prompt}.npz")
-            )
-        try:
-            x_semantic_history = x_history["semantic_prompt"]
-            x_coarse_history = x_history["coarse_prompt"]
-        except:
-            x_semantic_history = x_history["semantic"]
-            x_coarse_history = x_history["coarse"]
-        assert (
-            isinstance(x_semantic_history, np.ndarray)
-            and len(x_semantic_history.shape) == 1
-            and len(x_semantic_history) > 0
-            and x_semantic_history.min() >= 0
-            and x_semantic_history.max() <= SEMANTIC_VOCAB_SIZE - 1
-            and isinstance(x_coarse_history, np.ndarray)
-            and len(x_coarse_history.shape) == 2
-            and x_coarse_history.shape[0] == N_COARSE_CODEBOOKS
-            and x_coarse_history.shape[-1] >= 0
-            and x_coarse_history.min() >= 0
-            and x_coarse_history.max() <= CODEBOOK_SIZE - 1
-            and (
-                round(x_coarse_history.shape[-1] / len(x_semantic_history), 1)
-                == round(semantic_to_coarse_ratio / N_COARSE_CODEBOOKS, 1)
-            )
-        )
-        x_coarse_history = _flatten_codebooks(x_coarse_history) + SEMANTIC_VOCAB_SIZE
-        # trim histories correctly
-        n_semantic_hist_provided = np.min(
-            [
-                max_semantic_history,
-                len(x_semantic_history) - len(x_semantic_history) % 2,
-                int(np.floor(len(x_coarse_history) / semantic_to_coarse_ratio)),
-            ]
-        )
-        n_coarse_hist_provided = int(round(n_semantic_hist_provided * semantic_to_coarse_ratio))
-        x_semantic_history = x_semantic_history[-n_semantic_hist_provided:].astype(np.int32)
-        x_coarse_history = x_coarse_history[-n_coarse_hist_provided:].astype(np.int32)
-        # TODO: bit of a hack for time alignment (sounds better)
-        x_coarse_history = x_coarse_history[:-2]
-    else:
-        x_semantic_history = np.array([], dtype=np.int32)
-        x_coarse_history = np.array([], dtype=np.int32)
+    histories = [
+        _coarse_histories(history_prompt, max_semantic_history, semantic_to_coarse_ratio)
+        for history_prompt in history_prompts
+    ]
     # load models if not yet exist
-    global models
-    global models_devices
-    if "coarse" not in models:
-        preload_models()
-    model = models["coarse"]
-    if OFFLOAD_CPU:
-        model.to(models_devices["coarse"])
+    model = BarkModelRegistry.get_instance().acquire("coarse")
     device = next(model.parameters()).device
-    # start loop
-    n_steps = int(
-        round(
-            np.floor(len(x_semantic) * semantic_to_coarse_ratio / N_COARSE_CODEBOOKS)
-            * N_COARSE_CODEBOOKS
-        )
-    )
-    assert n_steps > 0 and n_steps % N_COARSE_CODEBOOKS == 0
-    x_semantic = np.hstack([x_semantic_history, x_semantic]).astype(np.int32)
-    x_coarse = x_coarse_history.astype(np.int32)
-    base_semantic_idx = len(x_semantic_history)
-    with _inference_mode():
-        x_semantic_in = torch.from_numpy(x_semantic)[None].to(device)
-        x_coarse_in = torch.from_numpy(x_coarse)[None].to(device)
-        n_window_steps = int(np.ceil(n_steps / sliding_window_len))
-        n_step = 0
-        for _ in tqdm.tqdm(range(n_window_steps), total=n_window_steps, disable=silent):
-            semantic_idx = base_semantic_idx + int(round(n_step / semantic_to_coarse_ratio))
-            # pad from right side
-            x_in = x_semantic_in[:, np.max([0, semantic_idx - max_semantic_history]) :]
-            x_in = x_in[:, :256]
-            x_in = F.pad(
-                x_in,
-                (0, 256 - x_in.shape[-1]),
-                "constant",
-                COARSE_SEMANTIC_PAD_TOKEN,
-            )
-            x_in = torch.hstack(
-                [
-                    x_in,
-                    torch.tensor([COARSE_INFER_TOKEN])[None].to(device),
-                    x_coarse_in[:, -max_coarse_history:],
-                ]
-            )
-            kv_cache = None
-            for _ in range(sliding_window_len):
-                if n_step >= n_steps:
-                    continue
-                is_major_step = n_step % N_COARSE_CODEBOOKS == 0
-
-                if use_kv_caching and kv_cache is not None:
-                    x_input = x_in[:, [-1]]
-                else:
-                    x_input = x_in
-
-                logits, kv_cache = model(x_input, use_cache=use_kv_caching, past_kv=kv_cache)
-                logit_start_idx = (
-                    SEMANTIC_VOCAB_SIZE + (1 - int(is_major_step)) * CODEBOOK_SIZE
+    groups = {}
+    for i, (_, x_coarse_history) in enumerate(histories):
+        groups.setdefault(len(x_coarse_history), []).append(i)
+    outputs = [None] * len(x_semantics)
+    for n_coarse_history, indices in groups.items():
+        # start loop
+        n_steps = [
+            int(
+                round(
+                    np.floor(len(x_semantics[i]) * semantic_to_coarse_ratio / N_COARSE_CODEBOOKS)
+                    * N_COARSE_CODEBOOKS
                 )
-                logit_end_idx = (
-                    SEMANTIC_VOCAB_SIZE + (2 - int(is_major_step)) * CODEBOOK_SIZE
+            )
+            for i in indices
+        ]
+        assert all(steps > 0 and steps % N_COARSE_CODEBOOKS == 0 for steps in n_steps)
+        max_steps = max(n_steps)
+        base_semantic_idx = [len(histories[i][0]) for i in indices]
+        with _inference_mode():
+            x_semantic_in = [
+                torch.from_numpy(np.hstack([histories[i][0], x_semantics[i]]).astype(np.int32)).to(device)
+                for i in indices
+            ]
+            x_coarse_in = torch.from_numpy(
+                np.stack([histories[i][1] for i in indices]).astype(np.int64)
+            ).to(device)
+            infer_token = torch.full((len(indices), 1), COARSE_INFER_TOKEN, dtype=x_coarse_in.dtype, device=device)
+            n_window_steps = int(np.ceil(max_steps / sliding_window_len))
+            n_step = 0
+            # one set of buffers, reused by every window
+            kv_cache = StaticKVCache(model.config, batch_size=len(indices)) if use_kv_caching else None
+            for _ in tqdm.tqdm(range(n_window_steps), total=n_window_steps, disable=silent):
+                x_in = []
+                for semantic_in, base_idx in zip(x_semantic_in, base_semantic_idx):
+                    semantic_idx = base_idx + int(round(n_step / semantic_to_coarse_ratio))
+                    # pad from right side
+                    window = semantic_in[np.max([0, semantic_idx - max_semantic_history]) :]
+                    window = window[:256]
+                    x_in.append(
+                        F.pad(window, (0, 256 - window.shape[-1]), "constant", COARSE_SEMANTIC_PAD_TOKEN)
+                    )
+                x_in = torch.hstack(
+                    [
+                        torch.stack(x_in).to(x_coarse_in.dtype),
+                        infer_token,
+                        x_coarse_in[:, -max_coarse_history:],
+                    ]
                 )
-                relevant_logits = logits[0, 0, logit_start_idx:logit_end_idx]
-                if top_p is not None:
-                    # faster to convert to numpy
-                    original_device = relevant_logits.device
-                    relevant_logits = relevant_logits.detach().cpu().type(torch.float32).numpy()
-                    sorted_indices = np.argsort(relevant_logits)[::-1]
-                    sorted_logits = relevant_logits[sorted_indices]
-                    cumulative_probs = np.cumsum(softmax(sorted_logits))
-                    sorted_indices_to_remove = cumulative_probs > top_p
-                    sorted_indices_to_remove[1:] = sorted_indices_to_remove[:-1].copy()
-                    sorted_indices_to_remove[0] = False
-                    relevant_logits[sorted_indices[sorted_indices_to_remove]] = -np.inf
-                    relevant_logits = torch.from_numpy(relevant_logits)
-                    relevant_logits = relevant_logits.to(original_device)
-                if top_k is not None:
-                    v, _ = torch.topk(relevant_logits, min(top_k, relevant_logits.size(-1)))
-                    relevant_logits[relevant_logits < v[-1]] = -float("Inf")
-                probs = F.softmax(relevant_logits / temp, dim=-1)
-                # multinomial bugged on mps: shuttle to cpu if necessary
-                inf_device = probs.device
-                if probs.device.type == "mps":
-                    probs = probs.to("cpu")
-                item_next = torch.multinomial(probs, num_samples=1)
-                probs = probs.to(inf_device)
-                item_next = item_next.to(inf_device)
-                item_next += logit_start_idx
-                x_coarse_in = torch.cat((x_coarse_in, item_next[None]), dim=1)
-                x_in = torch.cat((x_in, item_next[None]), dim=1)
-                del logits, relevant_logits, probs, item_next
-                n_step += 1
-            del x_in
-        del x_semantic_in
-    if OFFLOAD_CPU:
-        model.to("cpu")
-    gen_coarse_arr = x_coarse_in.detach().cpu().numpy().squeeze()[len(x_coarse_history) :]
-    del x_coarse_in
-    assert len(gen_coarse_arr) == n_steps
-    gen_coarse_audio_arr = gen_coarse_arr.reshape(-1, N_COARSE_CODEBOOKS).T - SEMANTIC_VOCAB_SIZE
-    for n in range(1, N_COARSE_CODEBOOKS):
-        gen_coarse_audio_arr[n, :] -= n * CODEBOOK_SIZE
+                if use_kv_caching:
+                    kv_cache.reset()
+                for _ in range(sliding_window_len):
+                    if n_step >= max_steps:
+                        continue
+                    is_major_step = n_step % N_COARSE_CODEBOOKS == 0
+
+                    if use_kv_caching and kv_cache.length > 0:
+                        x_input = x_in[:, [-1]]
+                    else:
+                        x_input = x_in
+
+                    logits, _ = model(x_input, use_cache=use_kv_caching, past_kv=kv_cache)
+                    logit_start_idx = (
+                        SEMANTIC_VOCAB_SIZE + (1 - int(is_major_step)) * CODEBOOK_SIZE
+                    )
+                    logit_end_idx = (
+                        SEMANTIC_VOCAB_SIZE + (2 - int(is_major_step)) * CODEBOOK_SIZE
+                    )
+                    relevant_logits = logits[:, 0, logit_start_idx:logit_end_idx]
+                    item_next, probs = sample_logits(relevant_logits, temp=temp, top_k=top_k, top_p=top_p)
+                    item_next += logit_start_idx
+                    x_coarse_in = torch.cat((x_coarse_in, item_next), dim=1)
+                    x_in = torch.cat((x_in, item_next), dim=1)
+                    del logits, relevant_logits, probs, item_next
+                    n_step += 1
+                del x_in
+            del x_semantic_in
+            gen_coarse = x_coarse_in.detach().cpu().numpy()[:, n_coarse_history:]
+            del x_coarse_in
+        for i, steps, gen_coarse_arr in zip(indices, n_steps, gen_coarse):
+            gen_coarse_arr = gen_coarse_arr[:steps]
+            assert len(gen_coarse_arr) == steps
+            gen_coarse_audio_arr = gen_coarse_arr.reshape(-1, N_COARSE_CODEBOOKS).T - SEMANTIC_VOCAB_SIZE
+            for n in range(1, N_COARSE_CODEBOOKS):
+                gen_coarse_audio_arr[n, :] -= n * CODEBOOK_SIZE
+            outputs[i] = gen_coarse_audio_arr
     _clear_cuda_cache()
-    return gen_coarse_audio_arr
+    return outputs
 
 
-def generate_fine(
-    x_coarse_gen,
-    history_prompt=None,
-    temp=0.5,
-    silent=True,
-):
-    """Generate full audio codes from coarse audio codes."""
+def _fine_input(x_coarse_gen, history_prompt):
+    """Input codes of one sequence with its history prepended, padded to at least 1024 frames."""
     assert (
         isinstance(x_coarse_gen, np.ndarray)
         and len(x_coarse_gen.shape) == 2
@@ -1451,15 +1666,7 @@ def generate_fine(
         and x_coarse_gen.max() <= CODEBOOK_SIZE - 1
     )
     if history_prompt is not None:
-        if history_prompt.endswith(".npz"):
-            try:
-                x_fine_history = np.load(history_prompt)["fine_prompt"]
-            except:
-                x_fine_history = np.load(history_prompt)["fine"]
-        else:
-            x_fine_history = np.load(
-                os.path.join(CUR_PATH, "assets", "prompts", f"{history_prompt}.npz")
-            )["fine_prompt"]
+        x_fine_history = _history_array(_load_history_prompt(history_prompt), "fine")
         assert (
             isinstance(x_fine_history, np.ndarray)
             and len(x_fine_history.shape) == 2
@@ -1471,15 +1678,6 @@ def generate_fine(
     else:
         x_fine_history = None
     n_coarse = x_coarse_gen.shape[0]
-    # load models if not yet exist
-    global models
-    global models_devices
-    if "fine" not in models:
-        preload_models()
-    model = models["fine"]
-    if OFFLOAD_CPU:
-        model.to(models_devices["fine"])
-    device = next(model.parameters()).device
     # make input arr
     in_arr = np.vstack(
         [
@@ -1512,72 +1710,111 @@ def generate_fine(
         )
     # we can be lazy about fractional loop and just keep overwriting codebooks
     n_loops = np.max([0, int(np.ceil((x_coarse_gen.shape[1] - (1024 - n_history)) / 512))]) + 1
+    return in_arr, n_history, n_remove_from_end, n_loops
+
+
+def generate_fine(
+    x_coarse_gen,
+    history_prompt=None,
+    temp=0.5,
+    silent=True,
+):
+    """Generate full audio codes from coarse audio codes."""
+    return generate_fine_batch([x_coarse_gen], history_prompts=[history_prompt], temp=temp, silent=silent)[0]
+
+
+def generate_fine_batch(
+    x_coarse_gens,
+    history_prompts=None,
+    temp=0.5,
+    silent=True,
+):
+    """
+    Generate full audio codes for several coarse sequences, each with its own history prompt.
+    Every loop fills one 1024-frame window per sequence, the windows of all sequences that still
+    have frames to fill are predicted together and every codebook is sampled in one draw.
+    """
+    if history_prompts is None:
+        history_prompts = [None] * len(x_coarse_gens)
+    assert len(history_prompts) == len(x_coarse_gens)
+    inputs = [_fine_input(x_coarse_gen, history_prompt) for x_coarse_gen, history_prompt in zip(x_coarse_gens, history_prompts)]
+    n_coarse = x_coarse_gens[0].shape[0]
+    assert all(x_coarse_gen.shape[0] == n_coarse for x_coarse_gen in x_coarse_gens)
+    # load models if not yet exist
+    model = BarkModelRegistry.get_instance().acquire("fine")
+    device = next(model.parameters()).device
+    n_loops = max(loops for _, _, _, loops in inputs)
     with _inference_mode():
-        in_arr = torch.tensor(in_arr.T).to(device)
+        in_arrs = [torch.tensor(in_arr.T).to(device) for in_arr, _, _, _ in inputs]
+        positions = torch.arange(1024, device=device)[None]
         for n in tqdm.tqdm(range(n_loops), disable=silent):
-            start_idx = np.min([n * 512, in_arr.shape[0] - 1024])
-            start_fill_idx = np.min([n_history + n * 512, in_arr.shape[0] - 512])
-            rel_start_fill_idx = start_fill_idx - start_idx
-            in_buffer = in_arr[start_idx : start_idx + 1024, :][None]
+            active = [i for i, (_, _, _, loops) in enumerate(inputs) if n < loops]
+            windows = []
+            for i in active:
+                n_history = inputs[i][1]
+                start_idx = np.min([n * 512, in_arrs[i].shape[0] - 1024])
+                start_fill_idx = np.min([n_history + n * 512, in_arrs[i].shape[0] - 512])
+                windows.append((start_idx, start_fill_idx, start_fill_idx - start_idx))
+            in_buffer = torch.stack([in_arrs[i][start_idx : start_idx + 1024, :] for i, (start_idx, _, _) in zip(active, windows)])
+            rel_start_fill_idx = torch.tensor([rel for _, _, rel in windows], device=device)[:, None]
+            fill_mask = positions >= rel_start_fill_idx
             for nn in range(n_coarse, N_FINE_CODEBOOKS):
                 logits = model(nn, in_buffer)
+                relevant_logits = logits[:, :, :CODEBOOK_SIZE]
                 if temp is None:
-                    relevant_logits = logits[0, rel_start_fill_idx:, :CODEBOOK_SIZE]
                     codebook_preds = torch.argmax(relevant_logits, -1)
                 else:
-                    relevant_logits = logits[0, :, :CODEBOOK_SIZE] / temp
-                    probs = F.softmax(relevant_logits, dim=-1)
-                    # multinomial bugged on mps: shuttle to cpu if necessary
-                    inf_device = probs.device
-                    if probs.device.type == "mps":
-                        probs = probs.to("cpu")
-                    codebook_preds = torch.hstack(
-                        [
-                            torch.multinomial(probs[nnn], num_samples=1).to(inf_device)
-                            for nnn in range(rel_start_fill_idx, 1024)
-                        ]
-                    )
-                in_buffer[0, rel_start_fill_idx:, nn] = codebook_preds
+                    # one draw for every position of every window
+                    codebook_preds, _ = sample_logits(relevant_logits, temp=temp)
+                    codebook_preds = codebook_preds.squeeze(-1)
+                in_buffer[:, :, nn] = torch.where(fill_mask, codebook_preds.to(in_buffer.dtype), in_buffer[:, :, nn])
                 del logits, codebook_preds
             # transfer over info into model_in and convert to numpy
-            for nn in range(n_coarse, N_FINE_CODEBOOKS):
-                in_arr[
-                    start_fill_idx : start_fill_idx + (1024 - rel_start_fill_idx), nn
-                ] = in_buffer[0, rel_start_fill_idx:, nn]
+            for j, (i, (_, start_fill_idx, rel)) in enumerate(zip(active, windows)):
+                in_arrs[i][
+                    start_fill_idx : start_fill_idx + (1024 - rel), n_coarse:
+                ] = in_buffer[j, rel:, n_coarse:]
             del in_buffer
-        gen_fine_arr = in_arr.detach().cpu().numpy().squeeze().T
-        del in_arr
-    if OFFLOAD_CPU:
-        model.to("cpu")
-    gen_fine_arr = gen_fine_arr[:, n_history:]
-    if n_remove_from_end > 0:
-        gen_fine_arr = gen_fine_arr[:, :-n_remove_from_end]
-    assert gen_fine_arr.shape[-1] == x_coarse_gen.shape[-1]
+        gen_fine_arrs = [in_arr.detach().cpu().numpy().T for in_arr in in_arrs]
+        del in_arrs
+    outputs = []
+    for gen_fine_arr, x_coarse_gen, (_, n_history, n_remove_from_end, _) in zip(gen_fine_arrs, x_coarse_gens, inputs):
+        gen_fine_arr = gen_fine_arr[:, n_history:]
+        if n_remove_from_end > 0:
+            gen_fine_arr = gen_fine_arr[:, :-n_remove_from_end]
+        assert gen_fine_arr.shape[-1] == x_coarse_gen.shape[-1]
+        outputs.append(gen_fine_arr)
     _clear_cuda_cache()
-    return gen_fine_arr
+    return outputs
 
 
 def codec_decode(fine_tokens):
     """Turn quantized audio codes into audio array using encodec."""
+    return codec_decode_batch([fine_tokens])[0]
+
+
+def codec_decode_batch(fine_tokens_list):
+    """
+    Decode several code sequences in one encodec call. Shorter sequences are padded to the
+    longest one and their audio is cut at their own number of frames.
+    """
     # load models if not yet exist
-    global models
-    global models_devices
-    if "codec" not in models:
-        preload_models()
-    model = models["codec"]
-    if OFFLOAD_CPU:
-        model.to(models_devices["codec"])
+    model = BarkModelRegistry.get_instance().acquire("codec")
     device = next(model.parameters()).device
-    arr = torch.from_numpy(fine_tokens)[None]
+    n_frames = [fine_tokens.shape[-1] for fine_tokens in fine_tokens_list]
+    arr = np.zeros((len(fine_tokens_list), fine_tokens_list[0].shape[0], max(n_frames)), dtype=np.int64)
+    for i, fine_tokens in enumerate(fine_tokens_list):
+        arr[i, :, : fine_tokens.shape[-1]] = fine_tokens
+    arr = torch.from_numpy(arr)
     arr = arr.to(device)
     arr = arr.transpose(0, 1)
     emb = model.quantizer.decode(arr)
     out = model.decoder(emb)
-    audio_arr = out.detach().cpu().numpy().squeeze()
+    audio_arr = out.detach().cpu().numpy()[:, 0]
     del arr, emb, out
-    if OFFLOAD_CPU:
-        model.to("cpu")
-    return audio_arr
+    # samples per frame of the decoder
+    hop = audio_arr.shape[-1] // max(n_frames)
+    return [audio[: frames * hop] for audio, frames in zip(audio_arr, n_frames)]
 
 
 
@@ -1592,7 +1829,7 @@ class ModelLoader:
 
 
    def load_codec_model(self):
-       return load_codec_model(use_gpu=True if self.device == 'cuda' else False)
+       return BarkModelRegistry.get_instance().acquire("codec")
 
    def load_hubert_manager(self):
        hubert_manager = HuBERTManager()
@@ -1617,11 +1854,22 @@ class ModelLoader:
    
 
 class AudioProcessor:
-  def __init__(self, filepath, model, device):
-      self.filepath = filepath
+  def __init__(self, audio, model, device, sample_rate=None):
       self.model = model
       self.device = device
-      self.wav, self.sr = torchaudio.load(self.filepath)
+      if isinstance(audio, str):
+          self.wav, self.sr = torchaudio.load(audio)
+      else:
+          # In-memory waveform, [samples] or [channels, samples]
+          self.wav = torch.as_tensor(audio, dtype=torch.float32)
+          if self.wav.ndim == 1:
+              self.wav = self.wav.unsqueeze(0)
+          self.sr = sample_rate
+
+  def content_hash(self):
+      # Identifies the reference clip, the validator sends the same one for many steps
+      wav = self.wav.detach().cpu().contiguous()
+      return hashlib.sha1(wav.numpy().tobytes() + str(self.sr).encode()).hexdigest()
 
   def process_audio(self):
       self.wav = convert_audio(self.wav, self.sr, self.model.sample_rate, self.model.channels)
@@ -1654,61 +1902,64 @@ class Encoder:
 
 
 class AudioGenerator:
-  def __init__(self, text_prompt, voice_name):
+  def __init__(self, text_prompt, history_prompt):
       self.text_prompt = text_prompt
-      self.voice_name = voice_name
+      # A prompt name, a .npz path or a dict of prompt arrays
+      self.history_prompt = history_prompt
 
   def generate_audio(self):
-      preload_models(
-          text_use_gpu=True,
-          text_use_small=False,
-          coarse_use_gpu=True,
-          coarse_use_small=False,
-          fine_use_gpu=True,
-          fine_use_small=False,
-          codec_use_gpu=True,
-          force_reload=False,
-          path="models"
-      )
+      return self.generate_batch([self.text_prompt], [self.history_prompt])[0]
 
+  @staticmethod
+  def generate_batch(text_prompts, history_prompts):
+      # Each stage is placed by BarkModelRegistry when it runs
       # Generation with more control
-      x_semantic = generate_text_semantic(
-          self.text_prompt,
-          history_prompt=self.voice_name,
+      x_semantics = generate_text_semantic_batch(
+          text_prompts,
+          history_prompts=history_prompts,
           temp=0.7,
           top_k=50,
           top_p=0.95,
       )
 
-      x_coarse_gen = generate_coarse(
-          x_semantic,
-          history_prompt=self.voice_name,
+      x_coarse_gens = generate_coarse_batch(
+          x_semantics,
+          history_prompts=history_prompts,
           temp=0.7,
           top_k=50,
           top_p=0.95,
       )
 
-      x_fine_gen = generate_fine(
-          x_coarse_gen,
-          history_prompt=self.voice_name,
+      x_fine_gens = generate_fine_batch(
+          x_coarse_gens,
+          history_prompts=history_prompts,
           temp=0.5,
       )
 
-      audio_array = codec_decode(x_fine_gen)
+      audio_arrays = codec_decode_batch(x_fine_gens)
 
-      return audio_array
+      return audio_arrays
 
 
 class BarkVoiceCloning:
+    # Voice prompts of recent reference clips, keyed by a hash of the clip audio.
+    # Shared by all instances, the miner creates one per request.
+    prompt_cache = LRUCache(maxsize=32)
+
     def __init__(self) -> None:
         pass
 
-    def clone_voice(self, prompt, voice_name, input_audio_file, model_loader=None):
+    def voice_prompt(self, input_audio, model_loader, sample_rate=None):
+        '''Semantic, coarse and fine prompt arrays of the reference clip, computed once per clip'''
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        # model_loader = ModelLoader(device)
-        # Process audio
         try:
-            audio_processor = AudioProcessor(input_audio_file, model_loader.model, device)
+            audio_processor = AudioProcessor(input_audio, model_loader.model, device, sample_rate=sample_rate)
+            key = audio_processor.content_hash()
+            voice_prompt = self.prompt_cache.get(key)
+            if voice_prompt is not None:
+                return voice_prompt
+            # the codec may have been evicted to the CPU since the last clone
+            BarkModelRegistry.get_instance().acquire("codec")
             processed_audio = audio_processor.process_audio()
         except:
             raise Exception(f"Audio file not found or model issue: {model_loader.model}")
@@ -1720,19 +1971,81 @@ class BarkVoiceCloning:
         encoder = Encoder(model_loader.model, processed_audio)
         codes = encoder.encode()
 
-        # Get the current file location
-        current_file_location = os.path.dirname(os.path.abspath(__file__))
-
-        # Create 'assets' and 'prompts' directories
-        assets_directory = os.path.join(current_file_location, 'assets')
-        prompts_directory = os.path.join(assets_directory, 'prompts')
-
-        os.makedirs(prompts_directory, exist_ok=True)
+        voice_prompt = {
+            "semantic_prompt": semantic_tokens.cpu().numpy(),
+            "coarse_prompt": codes[:2, :].cpu().numpy(),
+            "fine_prompt": codes.cpu().numpy(),
+        }
+        self.prompt_cache.put(key, voice_prompt)
+        return voice_prompt
 
-        # Save prompts
-        output_path = os.path.join(prompts_directory, voice_name + '.npz')
-        np.savez(output_path, fine_prompt=codes.cpu(), coarse_prompt=codes[:2, :].cpu(), semantic_prompt=semantic_tokens.cpu())
-        audio_generator = AudioGenerator(prompt, voice_name)
+    def clone_voice(self, prompt, voice_name, input_audio, model_loader=None, sample_rate=None):
+        '''input_audio is a file path, or a waveform sampled at sample_rate'''
+        # model_loader = ModelLoader(device)
+        # The prompts stay in memory, voice_name no longer names a file under assets/prompts
+        voice_prompt = self.voice_prompt(input_audio, model_loader, sample_rate=sample_rate)
+        audio_generator = AudioGenerator(prompt, voice_prompt)
         audio_array = audio_generator.generate_audio()
 
         return audio_array
+
+
+class VoiceCloneBatcher:
+    """
+    Batching front-end for Bark voice cloning.
+
+    Requests that arrive within `window` seconds of each other are generated
+    together, up to max_batch_size per batch, through the batched semantic,
+    coarse, fine and codec stages. A single worker thread owns the models, and
+    each caller blocks until its own output is ready.
+    """
+    def __init__(self, model_loader, window=0.5, max_batch_size=4):
+        self.model_loader = model_loader
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.cloning = BarkVoiceCloning()
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.run, name="clone-batcher", daemon=True)
+        self.worker.start()
+
+    def clone_voice(self, prompt, input_audio, sample_rate=None):
+        future = Future()
+        self.requests.put((prompt, input_audio, sample_rate, future))
+        return future.result()
+
+    def collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            self.generate(self.collect())
+
+    def generate(self, requests):
+        # A reference clip that cannot be processed only fails its own request
+        ready = []
+        for prompt, input_audio, sample_rate, future in requests:
+            try:
+                voice_prompt = self.cloning.voice_prompt(input_audio, self.model_loader, sample_rate=sample_rate)
+                ready.append((prompt, voice_prompt, future))
+            except Exception as e:
+                future.set_exception(e)
+        if not ready:
+            return
+        try:
+            outputs = AudioGenerator.generate_batch([prompt for prompt, _, _ in ready], [voice_prompt for _, voice_prompt, _ in ready])
+        except Exception as e:
+            for _, _, future in ready:
+                future.set_exception(e)
+            return
+        for (_, _, future), output in zip(ready, outputs):
+            future.set_result(output)
@@ -21,6 +21,10 @@ import numpy as np
 import librosa
 import torch
 import torchaudio
+import threading
+import queue
+import time
+from concurrent.futures import Future
 
 class MusicGenerator:
     def __init__(self, model_path="facebook/musicgen-medium"):
@@ -32,13 +36,71 @@ class MusicGenerator:
 
     def generate_music(self, prompt,token):
         try:
-            inputs = self.processor(
-                text=[prompt],
-                padding=True,
-                return_tensors="pt",
-            ).to(self.device)
-            audio_values = self.model.generate(**inputs, max_new_tokens=token)
-            return audio_values[0, 0].cpu().numpy()
+            return self.generate_batch([prompt], token)[0]
         except Exception as e:
             print(f"An error occurred with {self.model_name}: {e}")
             return None
+
+    def generate_batch(self, prompts, token):
+        # The prompts are padded to a common length, the attention mask keeps the padding out
+        inputs = self.processor(
+            text=prompts,
+            padding=True,
+            return_tensors="pt",
+        ).to(self.device)
+        audio_values = self.model.generate(**inputs, max_new_tokens=token)
+        return [audio[0].cpu().numpy() for audio in audio_values]
+
+
+class MusicBatcher:
+    """
+    Batching front-end for MusicGenerator.
+
+    Requests that arrive within `window` seconds of each other are grouped by
+    max_new_tokens and generated together, up to max_batch_size prompts per
+    model.generate call. A single worker thread owns the model, and each caller
+    blocks until its own output is ready.
+    """
+    def __init__(self, generator, window=0.5, max_batch_size=4):
+        self.generator = generator
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self.run, name="music-batcher", daemon=True)
+        self.worker.start()
+
+    def generate_music(self, prompt, token):
+        future = Future()
+        self.requests.put((prompt, token, future))
+        return future.result()
+
+    def collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.window
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            groups = {}
+            for prompt, token, future in self.collect():
+                groups.setdefault(token, []).append((prompt, future))
+            for token, requests in groups.items():
+                for start in range(0, len(requests), self.max_batch_size):
+                    self.generate(token, requests[start:start + self.max_batch_size])
+
+    def generate(self, token, requests):
+        try:
+            outputs = self.generator.generate_batch([prompt for prompt, _ in requests], token)
+        except Exception as e:
+            print(f"An error occurred with {self.generator.model_name}: {e}")
+            outputs = [None] * len(requests)
+        for (_, future), output in zip(requests, outputs):
+            future.set_result(output)
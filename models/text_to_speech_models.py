@@ -16,55 +16,169 @@
 # THE AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
 # OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
 # DEALINGS IN THE SOFTWARE.
-from transformers import SpeechT5Processor, SpeechT5ForTextToSpeech, SpeechT5HifiGan
-from transformers import AutoProcessor, AutoModelForTextToWaveform
-from speechbrain.pretrained import EncoderClassifier
 from transformers import AutoProcessor, BarkModel
 from transformers import VitsModel, AutoTokenizer
-from torchaudio.transforms import Resample
-from datasets import load_dataset
 from elevenlabs import generate, voices
 from elevenlabs import set_api_key
+from dataclasses import dataclass, replace
 import torchaudio
 import random
 import torch
 import os
 
 
+TORCH_DTYPES = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+
+@dataclass
+class InferenceProfile:
+    """
+    How a Text-To-Speech backend runs its model.
+
+    dtype: weights and activations, "float32", "float16" or "bfloat16".
+    sdpa: load the model with scaled-dot-product attention where transformers supports it.
+    compile: torch.compile mode of the decoder step, "reduce-overhead" also captures CUDA graphs. None runs eagerly.
+    cache_presets: keep the voice presets on the device instead of reloading them on every call.
+    device: None picks cuda when it is available.
+    """
+    dtype: str = "float32"
+    sdpa: bool = False
+    compile: str = None
+    cache_presets: bool = False
+    device: str = None
+
+    def resolve(self, device=None, dtype=None):
+        '''Copy of the profile with the overrides applied, falling back to what this machine can run.'''
+        profile = replace(self, device=device or self.device, dtype=dtype or self.dtype)
+        if profile.device is None:
+            profile.device = "cuda" if torch.cuda.is_available() else "cpu"
+        if torch.device(profile.device).type == "cpu":
+            # Half precision is slow or unsupported on the CPU, and CUDA graphs need a GPU
+            profile.dtype = "float32"
+            if profile.compile == "reduce-overhead":
+                profile.compile = "default"
+        elif profile.dtype == "bfloat16" and not torch.cuda.is_bf16_supported():
+            profile.dtype = "float16"
+        return profile
+
+    @property
+    def torch_dtype(self):
+        return TORCH_DTYPES[self.dtype]
+
+
+def load_pretrained(model_class, model_path, profile):
+    '''from_pretrained in the dtype of the profile, with SDPA attention if asked for and supported'''
+    if profile.sdpa:
+        try:
+            return model_class.from_pretrained(model_path, torch_dtype=profile.torch_dtype, attn_implementation="sdpa")
+        except (ValueError, ImportError) as e:
+            print(f"SDPA attention is not available for {model_path}, using the default attention: {e}")
+    return model_class.from_pretrained(model_path, torch_dtype=profile.torch_dtype)
+
+
+def compile_forward(module, mode):
+    '''Swap module.forward for its compiled version, returns the eager forward to undo it'''
+    forward = module.forward
+    module.forward = torch.compile(forward, mode=mode, dynamic=True)
+    return forward
+
+
 # Text-to-Speech Generation Using Suno Bark's Pretrained Model
 class SunoBark:
-    def __init__(self, model_path="suno/bark"):
+    PROFILES = {
+        "baseline": InferenceProfile(),
+        "fast": InferenceProfile(dtype="float16", sdpa=True, cache_presets=True),
+        "compiled": InferenceProfile(dtype="float16", sdpa=True, cache_presets=True, compile="reduce-overhead"),
+    }
+
+    def __init__(self, model_path="suno/bark", profile="baseline", device=None, dtype=None):
+        self.profile = self.PROFILES[profile].resolve(device, dtype)
+        self.device = torch.device(self.profile.device)
         #Load the processor and model
         self.processor = AutoProcessor.from_pretrained(model_path)
-        self.model = BarkModel.from_pretrained(model_path)
-        self.device = torch.device("cuda")
+        self.model = load_pretrained(BarkModel, model_path, self.profile)
+        self.sample_rate = self.model.generation_config.sample_rate
         self.speaker_list = ["v2/en_speaker_0","v2/en_speaker_1","v2/en_speaker_2","v2/en_speaker_3","v2/en_speaker_4","v2/en_speaker_5","v2/en_speaker_6","v2/en_speaker_7","v2/en_speaker_8","v2/en_speaker_9"]
+        self.presets = {}
         self.model.to(self.device)
+        self.model.eval()
+        if self.profile.compile:
+            self.compile()
+
+    def compile(self):
+        # The three GPT stages run once per generated token, the codec only once per request
+        stages = [self.model.semantic, self.model.coarse_acoustics, self.model.fine_acoustics]
+        eager = [compile_forward(stage, self.profile.compile) for stage in stages]
+        try:
+            # Compile (and capture) on a short prompt, so the first request does not pay for it
+            self.generate_speech("Hello, this is a warm up.")
+        except Exception as e:
+            print(f"An error occurred while compiling the Bark model, running it eagerly: {e}")
+            for stage, forward in zip(stages, eager):
+                stage.forward = forward
+            self.profile.compile = None
+
+    def voice_preset(self, speaker):
+        '''History prompt of the speaker, loaded once and kept on the device'''
+        preset = self.presets.get(speaker)
+        if preset is None:
+            preset = self.processor("", voice_preset=speaker, return_tensors="pt")["history_prompt"].to(self.device)
+            self.presets[speaker] = preset
+        return preset
+
     def generate_speech(self, text_input):
         # Process the text wit speaker
         speaker = self.speaker_list[torch.multinomial(torch.ones(len(self.speaker_list)), 1).item()]
-        inputs = self.processor(text_input, voice_preset= speaker, return_tensors="pt")
+        if self.profile.cache_presets:
+            inputs = self.processor(text_input, return_tensors="pt")
+            inputs["history_prompt"] = self.voice_preset(speaker)
+        else:
+            inputs = self.processor(text_input, voice_preset= speaker, return_tensors="pt")
 
         # Move inputs to the same device as model
         inputs = {k: v.to(self.device) for k, v in inputs.items()}
 
         # Generate audio
-        speech = self.model.generate(**inputs)
-        return speech
-    
+        with torch.inference_mode():
+            speech = self.model.generate(**inputs)
+        return speech.float()
+
 
 class EnglishTextToSpeech:
-    def __init__(self, model_path="facebook/mms-tts-eng"):
-        self.model = VitsModel.from_pretrained(model_path)
+    # transformers has no SDPA attention for VITS, its attention uses relative positions
+    PROFILES = {
+        "baseline": InferenceProfile(),
+        "fast": InferenceProfile(dtype="float16"),
+        "compiled": InferenceProfile(dtype="float16", compile="reduce-overhead"),
+    }
+
+    def __init__(self, model_path="facebook/mms-tts-eng", profile="baseline", device=None, dtype=None):
+        self.profile = self.PROFILES[profile].resolve(device, dtype)
+        self.device = torch.device(self.profile.device)
+        self.model = load_pretrained(VitsModel, model_path, self.profile)
         self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.device = torch.device("cuda")
+        self.sample_rate = self.model.config.sampling_rate
+        self.model.to(self.device)
+        self.model.eval()
+        if self.profile.compile:
+            self.compile()
 
+    def compile(self):
+        # VITS is not autoregressive, the whole forward is the decoder step
+        eager = compile_forward(self.model, self.profile.compile)
+        try:
+            self.generate_speech("Hello, this is a warm up.")
+        except Exception as e:
+            print(f"An error occurred while compiling the VITS model, running it eagerly: {e}")
+            self.model.forward = eager
+            self.profile.compile = None
 
     def generate_speech(self, text_input):
         inputs = self.tokenizer(text_input, return_tensors="pt")
-        with torch.no_grad():
+        inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        with torch.inference_mode():
             speech = self.model(**inputs).waveform
-        return speech
+        return speech.float()
 
 class ElevenLabsTTS:
     def __init__(self, api_key):
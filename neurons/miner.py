@@ -21,7 +21,6 @@
 # Bittensor Miner lib:
 
 # Step 1: Import necessary libraries and modules
-from scipy.io.wavfile import write as write_wav
 import bittensor as bt
 import numpy as np
 import torchaudio
@@ -29,7 +28,9 @@ import traceback
 import argparse
 import typing
 import torch
-import wave
+import tempfile
+import uuid
+import io
 import time
 import sys
 import os
@@ -51,11 +52,10 @@ sys.path.insert(0, project_root)
 sys.path.insert(0, audio_subnet_path)
 
 # import this repo
-from models.text_to_music import MusicGenerator
-from models.text_to_speech_models import SunoBark, ElevenLabsTTS, EnglishTextToSpeech
-from models.voice_clone import ElevenLabsClone  
-from models.bark_voice_clone import BarkVoiceCloning, ModelLoader
+# The model backends are imported by their loaders, only for the models that were selected
 import lib.protocol
+import lib.request_gate
+import lib.warmup
 import lib.utils
 import lib
 
@@ -71,6 +71,15 @@ def get_config():
     parser.add_argument(
         "--bark_model_path", default=None , help="The bark tts model to be used for text-to-speech." 
     )
+    parser.add_argument(
+        "--tts_profile", default='baseline', choices=['baseline', 'fast', 'compiled'], help="Inference profile of the Facebook and Bark text-to-speech models."
+    )
+    parser.add_argument(
+        "--tts_device", default=None, help="Device of the text-to-speech model, cuda when available by default."
+    )
+    parser.add_argument(
+        "--tts_dtype", default=None, choices=['float32', 'float16', 'bfloat16'], help="Overrides the precision of the text-to-speech inference profile."
+    )
     parser.add_argument(
         "--clone_model", default= 'bark/voiceclone' , help="The model to be used for Voice cloning." 
     )
@@ -80,15 +89,39 @@ def get_config():
     parser.add_argument(
         "--music_path", default=None , help="The Finetuned model to be used for Music Generation." 
     )
+    parser.add_argument(
+        "--music_batch_window", type=float, default=0.5, help="Seconds to wait for more Text-To-Music requests to batch together."
+    )
+    parser.add_argument(
+        "--music_batch_size", type=int, default=4, help="Maximum number of Text-To-Music requests generated in one batch."
+    )
     parser.add_argument(
         "--eleven_api", default=os.getenv('ELEVEN_API') , help="API key to be used for Eleven Labs." 
     )
+    parser.add_argument(
+        "--clone_batch_window", type=float, default=0.5, help="Seconds to wait for more Bark voice clone requests to batch together."
+    )
+    parser.add_argument(
+        "--clone_batch_size", type=int, default=4, help="Maximum number of Bark voice clone requests generated in one batch."
+    )
+    parser.add_argument(
+        "--bark_vram_budget", type=float, default=None, help="GPU memory in GB the Bark voice clone models may keep resident, least recently used stages are moved to the CPU."
+    )
     parser.add_argument(
         "--bark_vc_path", default=None, help="Custom directory path for the Bark Voice Clone model."
     )
     parser.add_argument(
         "--auto_update", type=str, default='yes', help="Auto update option for github repository updates."
     )
+    parser.add_argument(
+        "--audio_dtype", default='float32', choices=list(lib.protocol.AUDIO_DTYPES), help="Sample type of the audio sent back to validators."
+    )
+    parser.add_argument(
+        "--audio_codec", default='raw', choices=lib.protocol.AUDIO_CODECS, help="Encoding of the audio sent back to validators, 'flac' compresses it."
+    )
+    parser.add_argument(
+        "--save_audio_dir", default=None, help="Debug option, writes the audio of every request to this directory."
+    )
 
     # Adds override arguments for network and netuid.
     parser.add_argument("--netuid", type=int, default=1, help="The chain subnet uid.")
@@ -134,21 +167,28 @@ def main(config):
 
     # Check the supplied model and log the appropriate information.
     # =========================================== Text To Speech model selection ============================================ 
-    try:
+    def load_tts_model():
         if config.fb_model_path or config.model == "facebook/mms-tts-eng":
+            from models.text_to_speech_models import EnglishTextToSpeech
             model_path = config.fb_model_path if config.fb_model_path else config.model
-            tts_models = EnglishTextToSpeech(model_path=model_path)
             bt.logging.info(f"Using the Facebook TTS model from: {model_path}")
+            tts_models = EnglishTextToSpeech(model_path=model_path, profile=config.tts_profile, device=config.tts_device, dtype=config.tts_dtype)
+            bt.logging.info(f"Text-To-Speech inference profile '{config.tts_profile}': {tts_models.profile}")
+            return tts_models
 
         elif config.bark_model_path or config.model == "suno/bark":
+            from models.text_to_speech_models import SunoBark
             model_path = config.bark_model_path if config.bark_model_path else config.model
-            tts_models = SunoBark(model_path=model_path)
             bt.logging.info(f"Using the SunoBark model from: {model_path}")
+            tts_models = SunoBark(model_path=model_path, profile=config.tts_profile, device=config.tts_device, dtype=config.tts_dtype)
+            bt.logging.info(f"Text-To-Speech inference profile '{config.tts_profile}': {tts_models.profile}")
+            return tts_models
 
         elif config.model == "elevenlabs/eleven":
             if config.eleven_api is not None:
-                tts_models = ElevenLabsTTS(config.eleven_api)
+                from models.text_to_speech_models import ElevenLabsTTS
                 bt.logging.info("Using the Eleven Labs TTS model.")
+                return ElevenLabsTTS(config.eleven_api)
             else:
                 bt.logging.error("Eleven Labs API key is required for the model: elevenlabs/eleven")
                 raise ValueError("API key required for Eleven Labs model.")
@@ -159,35 +199,52 @@ def main(config):
     # =========================================== Text To Speech model selection ============================================
     
     # =========================================== Text To Music model selection ============================================
+    def load_music_model():
         # Assuming `config` is an object holding command-line arguments
         if config.music_path:
             bt.logging.info(f"Using the custom model path for Text-To-Music: {config.music_path}")
-            ttm_models = MusicGenerator(model_path=config.music_path)
+            model_path = config.music_path
         elif config.music_model in ["facebook/musicgen-medium", "facebook/musicgen-large"]:
             bt.logging.info(f"Using the Text-To-Music with the supplied model: {config.music_model}")
-            ttm_models = MusicGenerator(model_path=config.music_model)
+            model_path = config.music_model
         else:
             bt.logging.error(f"Wrong model supplied for Text-To-Music: {config.music_model}")
-            exit(1)
+            raise ValueError("Invalid Text-To-Music model.")
+        from models.text_to_music import MusicGenerator, MusicBatcher
+        ttm_models = MusicGenerator(model_path=model_path)
+        # Concurrent requests from several validators share one generate call
+        return MusicBatcher(ttm_models, window=config.music_batch_window, max_batch_size=config.music_batch_size)
     # =========================================== Text To Music model selection ============================================
                         
     # =========================================== Voice Clone model selection ===============================================    
+    def load_clone_model():
         if config.bark_vc_path or config.clone_model == "bark/voiceclone":
+            from models.bark_voice_clone import VoiceCloneBatcher, ModelLoader, BarkModelRegistry
             bt.logging.info(f"Checking the path of the model supplies: {config.bark_vc_path}")
             bt.logging.info(f"Using the Voice Clone with the supplied model: {config.clone_model}")
             bark_vc_model = config.bark_vc_path if config.bark_vc_path else None
+            # Bark stages stay on the GPU within the budget, loaded once at startup
+            bark_registry = BarkModelRegistry.get_instance(vram_budget_gb=config.bark_vram_budget)
             voice_clone_model = ModelLoader(model_dir=bark_vc_model)
+            for stage, usage in bark_registry.warmup().items():
+                bt.logging.info(f"Bark {stage} model: {usage['mb']} MB on {usage['device']}")
+            # Concurrent clone requests share the batched Bark stages
+            return VoiceCloneBatcher(voice_clone_model, window=config.clone_batch_window, max_batch_size=config.clone_batch_size)
         elif config.clone_model is not None and config.clone_model == "elevenlabs/eleven" and config.eleven_api is not None:
+            from models.voice_clone import ElevenLabsClone
             bt.logging.info(f"Using the Voice Clone with the supplied model: {config.clone_model}")
-            voice_clone_model = ElevenLabsClone(config.eleven_api)
+            return ElevenLabsClone(config.eleven_api)
         else:
             bt.logging.error(f"Eleven Labs API key is required for the model: {config.clone_model}")
-            exit(1)        
-    except Exception as e:
-        bt.logging.info(f"An error occurred while model initilization: {e}")
-        exit(1)
+            raise ValueError("Invalid Voice Clone model configuration.")
     # =========================================== Voice Clone model selection ===============================================    
 
+    # The three models load concurrently, each route serves as soon as its own model is ready
+    warmup = lib.warmup.ModelWarmup()
+    warmup.start("speech", load_tts_model)
+    warmup.start("music", load_music_model)
+    warmup.start("clone", load_clone_model)
+
     bt.logging.info("Setting up bittensor objects.")
     wallet = bt.wallet(config=config)
     bt.logging.info(f"Wallet: {wallet}")
@@ -227,6 +284,9 @@ def main(config):
         tags.append(lib.__version__)
         return tags
 
+    # Admission checks shared by all synapse types, refreshed with the metagraph
+    request_gate = lib.request_gate.RequestGate(metagraph)
+
     # Each miner gets a unique identity (UID) in the network for differentiation.
     my_subnet_uid = metagraph.hotkeys.index(wallet.hotkey.ss58_address)
     bt.logging.info(f"Running miner on uid: {my_subnet_uid}")
@@ -253,116 +313,82 @@ def main(config):
     start_wandb_run()  # Start the first WandB run
     start_time = time.time()  # Mark the start time
 
+    def warming_check(synapse, route):
+        '''Admission check, plus a "warming" answer while the model of the route is still loading'''
+        blacklisted, reason = request_gate.check(synapse)
+        if blacklisted:
+            return blacklisted, reason
+        if not warmup.ready(route):
+            bt.logging.trace(f"Rejecting {route} request from {synapse.dendrite.hotkey}: {warmup.status()[route]}")
+            return True, f"The {route} model is {warmup.status()[route]}"
+        return blacklisted, reason
+
 ############################### Voice Clone ##########################################
 
     # The blacklist function decides if a request should be ignored.
     def vc_blacklist_fn(synapse: lib.protocol.VoiceClone) -> typing.Tuple[bool, str]:
-        #  blacklist( synapse: VoiceClone ) -> Tuple[bool, str]:
-        if synapse.dendrite.hotkey not in metagraph.hotkeys:
-            # Ignore requests from unrecognized entities.
-            bt.logging.trace(
-                f"Blacklisting unrecognized hotkey {synapse.dendrite.hotkey}"
-            )
-            return True, "Unrecognized hotkey"
-        elif synapse.dendrite.hotkey in metagraph.hotkeys and metagraph.S[metagraph.hotkeys.index(synapse.dendrite.hotkey)] < lib.MIN_STAKE:
-            # Ignore requests from entities with low stake.
-            bt.logging.trace(
-                f"Blacklisting hotkey {synapse.dendrite.hotkey} with low stake"
-            )
-            return True, "Low stake"
-        elif synapse.dendrite.hotkey in lib.BLACKLISTED_VALIDATORS:
-            bt.logging.trace(
-                f"Blacklisting Key recognized as blacklisted hotkey {synapse.dendrite.hotkey}"
-            )
-            return True, "Blacklisted hotkey"
-        elif synapse.dendrite.hotkey in lib.WHITELISTED_VALIDATORS:
-            bt.logging.trace(
-                f"Not Blacklisting recognized hotkey {synapse.dendrite.hotkey}"
-            )
-            return False, "Hotkey recognized!"
-        else:
-            bt.logging.trace(
-                f"Blacklisting recognized hotkey {synapse.dendrite.hotkey}"
-            )
-            return True, "Hotkey recognized as Blacklisted!"
+        return warming_check(synapse, "clone")
 
     # The priority function determines the order in which requests are handled.
     # More valuable or higher-priority requests are processed before others.
     def vc_priority_fn(synapse: lib.protocol.VoiceClone) -> float:
-        caller_uid = metagraph.hotkeys.index(
-            synapse.dendrite.hotkey
-        )  # Get the caller index.
-        prirority = float(metagraph.S[caller_uid])  # Return the stake as the priority.
-        bt.logging.trace(
-            f"Prioritizing {synapse.dendrite.hotkey} with value: ", prirority
-        )
-        return prirority
+        return request_gate.priority(synapse)
     
-    def save_audio(speech):
-        '''Save the audio file to disk'''
-        try:
-            # Check the first few bytes to determine the format
-            header = speech[:4]
-            if header.startswith(b'RIFF'):
-                format = 'WAV'
-            elif header.startswith(b'\xFF\xFB') or header.startswith(b'ID3'):
-                format = 'MP3'
-            else:
-                return 'Unknown Format'
-
-            # Generate a file name (You can modify this part as needed)
-            new_file_path = 'output_converted.' + format.lower()
-
-            # Save the bytes to a new file
-            with open(new_file_path, 'wb') as new_file:
-                new_file.write(speech)
+    def decode_audio_bytes(data):
+        '''Decode the WAV or MP3 bytes returned by the Eleven Labs API in memory'''
+        # Check the first few bytes to determine the format
+        header = data[:4]
+        if header.startswith(b'RIFF'):
+            format = 'wav'
+        elif header.startswith(b'\xFF\xFB') or header.startswith(b'ID3'):
+            format = 'mp3'
+        else:
+            bt.logging.error("Unknown audio format returned by the API")
+            return None, None
+        return torchaudio.load(io.BytesIO(data), format=format)
 
-            bt.logging.success(f"File has been successfully saved as {new_file_path}")
-            return new_file_path
+    def save_debug_audio(synapse, name, audio, sample_rate):
+        '''Write a copy of the request audio under --save_audio_dir, for debugging only'''
+        if not config.save_audio_dir:
+            return None
+        try:
+            os.makedirs(config.save_audio_dir, exist_ok=True)
+            # Unique per request, so concurrent requests never share a file
+            file_path = os.path.join(config.save_audio_dir, f"{synapse.dendrite.hotkey}_{uuid.uuid4().hex}_{name}.wav")
+            audio = torch.as_tensor(audio).detach().cpu().float()
+            torchaudio.save(file_path, audio.reshape(-1, audio.shape[-1]), sample_rate)
+            bt.logging.debug(f"Saved {name} audio to: {file_path}")
+            return file_path
         except Exception as e:
-            bt.logging.error(f"Error Occurred while saving the file: {e}")
+            bt.logging.error(f"An error occurred while saving the {name} audio: {e}")
 
-    
-    
-    def ElevenlabsClone_call(text, source_file, hf_voice_id):
+    def ElevenlabsClone_call(text, input_audio, sample_rate, hf_voice_id):
         '''Call the Eleven Labs API to clone the voice'''
-        speech = None
+        # The API uploads files, so the reference goes through a per-request temporary file
+        source = tempfile.NamedTemporaryFile(suffix=".wav", delete=False)
+        source.close()
         try:
-            speech = voice_clone_model.clone_voice(text, source_file,hf_voice_id)
-            elevenlab_file = save_audio(speech)
-            return elevenlab_file
+            torchaudio.save(source.name, src=input_audio, sample_rate=sample_rate)
+            speech = warmup.get("clone").clone_voice(text, source.name, hf_voice_id)
+            return decode_audio_bytes(speech)
         except Exception as e:
             bt.logging.error(f"An error occurred while calling the model: {e}")
+            return None, None
+        finally:
+            os.remove(source.name)
 
-    def BarkVoiceClone_call(text, source_file, hf_voice_id):
+    def BarkVoiceClone_call(text, input_audio, sample_rate, hf_voice_id):
         '''Call the Bark Voice Clone API to clone the voice'''
-        speech = None
         try:
-            bvc = BarkVoiceCloning()
-            speech = bvc.clone_voice(text, hf_voice_id, source_file, voice_clone_model )
-            bark_clone_file_path = "bark_voice_gen.wav" # synapse.dendrite.hotkey + "_bark_voice_gen.wav"
-            write_wav(bark_clone_file_path, rate=24000, data=speech)
-            return bark_clone_file_path
+            speech = warmup.get("clone").clone_voice(text, input_audio, sample_rate=sample_rate)
+            return speech, 24000
         except Exception as e:
             bt.logging.error(f"An error occurred while calling the model: {e}")
+            return None, None
 
-    def convert_audio_to_tensor(audio_file):
-        '''Convert the audio file to a tensor'''
-        try:
-            # Get the file extension
-            _, file_extension = os.path.splitext(audio_file)
-
-            if file_extension.lower() in ['.wav', '.mp3']:
-                # load the audio file
-                audio, sample_rate = torchaudio.load(audio_file)
-                # convert the audio file to a tensor/list
-                audio = audio[0].tolist()
-                return audio
-            else:
-                bt.logging.error(f"Unsupported file format: {file_extension}")
-                return None
-        except Exception as e:
-            bt.logging.error(f"An error occurred while converting the file: {e}")
+    def encode_audio(audio, sample_rate):
+        '''Pack the audio into the binary payload sent back to validators'''
+        return lib.protocol.AudioPayload.from_array(audio, sample_rate, dtype=config.audio_dtype, codec=config.audio_codec)
 
     def ProcessClone(synapse: lib.protocol.VoiceClone) -> lib.protocol.VoiceClone:
         '''Process the Voice Clone request'''
@@ -370,38 +396,43 @@ def main(config):
         speech = None
         try:
             input_text = synapse.text_input
-            input_clone = synapse.clone_input
+            input_clone = lib.protocol.decode_audio(synapse.clone_input)
             sample_rate = synapse.sample_rate
+            if isinstance(synapse.clone_input, lib.protocol.AudioPayload):
+                sample_rate = synapse.clone_input.sample_rate
             hf_voice_id = synapse.hf_voice_id
 
-            input_tensor = torch.tensor(input_clone, dtype=torch.float32)
-            if input_tensor.ndim == 1:
-                input_tensor = input_tensor.unsqueeze(0)
-            torchaudio.save('input.wav', src=input_tensor, sample_rate=sample_rate) # synapse.dendrite.hotkey + "_input.wav"
-
             # Check if the input text is valid.
             if input_text is None or input_text == "":
                 bt.logging.error("No text was supplied. Please supply a valid text.")
                 return None
             
             # Check if the input clone is valid.
-            if input_clone is None or input_clone == []:
+            if input_clone is None or input_clone.size == 0:
                 bt.logging.error("No clone was supplied. Please supply a valid clone.")
                 return None
+
+            input_tensor = torch.as_tensor(input_clone, dtype=torch.float32)
+            if input_tensor.ndim == 1:
+                input_tensor = input_tensor.unsqueeze(0)
+            save_debug_audio(synapse, "clone_input", input_tensor, sample_rate)
             
         except Exception as e:
             bt.logging.error(f"An error occurred, No input text or input voice recieved: {e}")
             return None
 
         try:
+            audio, output_rate = None, None
             if config.clone_model == "elevenlabs/eleven":
-                speech_file_path = ElevenlabsClone_call(input_text, 'input.wav',hf_voice_id)
+                audio, output_rate = ElevenlabsClone_call(input_text, input_tensor, sample_rate, hf_voice_id)
                 synapse.model_name = config.clone_model
-                speech = convert_audio_to_tensor(speech_file_path)
             elif config.clone_model == "bark/voiceclone":
-                speech_file_path = BarkVoiceClone_call(input_text, 'input.wav',hf_voice_id)
+                audio, output_rate = BarkVoiceClone_call(input_text, input_tensor, sample_rate, hf_voice_id)
                 synapse.model_name = config.clone_model
-                speech = convert_audio_to_tensor(speech_file_path)
+            if audio is not None:
+                save_debug_audio(synapse, "clone_output", audio, output_rate)
+                # Only the first channel is sent back
+                speech = encode_audio(audio.reshape(-1, audio.shape[-1])[0], output_rate)
             if speech is not None:
                 bt.logging.success(f"Voice Clone has been generated by {config.clone_model}!")
         except Exception as e:
@@ -415,86 +446,24 @@ def main(config):
 
     # The blacklist function decides if a request should be ignored.
     def speech_blacklist_fn(synapse: lib.protocol.TextToSpeech) -> typing.Tuple[bool, str]:
-        if synapse.dendrite.hotkey not in metagraph.hotkeys:
-            # Ignore requests from unrecognized entities.
-            bt.logging.trace(
-                f"Blacklisting unrecognized hotkey {synapse.dendrite.hotkey}"
-            )
-            return True, "Unrecognized hotkey"
-        elif synapse.dendrite.hotkey in metagraph.hotkeys and metagraph.S[metagraph.hotkeys.index(synapse.dendrite.hotkey)] < lib.MIN_STAKE:
-            # Ignore requests from entities with low stake.
-            bt.logging.trace(
-                f"Blacklisting hotkey {synapse.dendrite.hotkey} with low stake"
-            )
-            return True, "Low stake"
-        elif synapse.dendrite.hotkey in lib.BLACKLISTED_VALIDATORS:
-            bt.logging.trace(
-                f"Blacklisting Key recognized as blacklisted hotkey {synapse.dendrite.hotkey}"
-            )
-            return True, "Blacklisted hotkey"
-        elif synapse.dendrite.hotkey in lib.WHITELISTED_VALIDATORS:
-            bt.logging.trace(
-                f"Not Blacklisting recognized hotkey {synapse.dendrite.hotkey}"
-            )
-            return False, "Hotkey recognized!"
-        else:
-            bt.logging.trace(
-                f"Not Blacklisting recognized hotkey {synapse.dendrite.hotkey}"
-            )
-            return True, "Hotkey recognized as Blacklisted!"
+        return warming_check(synapse, "speech")
 
     # The priority function determines the order in which requests are handled.
     # More valuable or higher-priority requests are processed before others.
     def speech_priority_fn(synapse: lib.protocol.TextToSpeech) -> float:
-        caller_uid = metagraph.hotkeys.index(
-            synapse.dendrite.hotkey
-        )  # Get the caller index.
-        prirority = float(metagraph.S[caller_uid])  # Return the stake as the priority.
-        bt.logging.trace(
-            f"Prioritizing {synapse.dendrite.hotkey} with value: ", prirority
-        )
-        return prirority
+        return request_gate.priority(synapse)
 
     def ProcessSpeech(synapse: lib.protocol.TextToSpeech) -> lib.protocol.TextToSpeech:
         bt.logging.success("The prompt received from validator!")
+        tts_models = warmup.get("speech")
         if config.model == "elevenlabs/eleven":
             speech = tts_models.generate_speech(synapse.text_input)
         elif config.bark_model_path or config.model == "suno/bark":
             speech = tts_models.generate_speech(synapse.text_input)
         elif config.fb_model_path or config.model == "facebook/mms-tts-eng":
             speech = tts_models.generate_speech(synapse.text_input)
-            audio_data = speech / torch.max(torch.abs(speech))
-            # If the audio is mono, ensure it has a channel dimension
-            if audio_data.ndim == 1:
-                audio_data = audio_data.unsqueeze(0)
-            # convert to 32-bit PCM
-            audio_data_int = (audio_data * 2147483647).type(torch.IntTensor)
-            # Save the audio data as integers
-            torchaudio.save('speech.wav', src=audio_data_int, sample_rate=16000) # synapse.dendrite.hotkey + "_speech.wav"
-            # Open the WAV file and read the frames
-            sample_width = None
-            try:
-                with wave.open('speech.wav', 'rb') as wav_file:
-                    frames = wav_file.readframes(wav_file.getnframes())
-                    sample_width = wav_file.getsampwidth()
-            except Exception as e:
-                print(f"An error occurred while reading the audio data: {e}")
-            # Initialize dtype to a default value
-            dtype = None
-            if sample_width == 2:
-                dtype = np.int16
-            elif sample_width == 1:
-                dtype = np.int8
-            elif sample_width == 4:
-                dtype = np.int32
-            # Check if dtype has been assigned a value
-            if dtype is None:
-                print(f"Unexpected sample width: {sample_width}")
-                return
-            # Convert the bytes data to a numpy array
-            audio_array = np.frombuffer(frames, dtype=dtype)
-            # Convert the numpy array to a list
-            speech = audio_array.tolist()
+            # Peak-normalize on the tensor, encode_audio does the dtype conversion
+            speech = speech / torch.abs(speech).max().clamp(min=1e-8)
 
         # Check if 'speech' contains valid audio data
         if speech is None:
@@ -504,34 +473,25 @@ def main(config):
             try:
                 bt.logging.success(f"Text to Speech has been generated by {config.model}!")
                 if config.fb_model_path or config.model == "facebook/mms-tts-eng":
-                    # Convert the list to a tensor
-                    speech_tensor = torch.Tensor(speech)
-
-                    # Normalize the speech data
-                    audio_data = speech_tensor / torch.max(torch.abs(speech_tensor))
-
-                    # Convert to 32-bit PCM
-                    audio_data_int = (audio_data * 2147483647).type(torch.IntTensor)
-
-                    # Add an extra dimension to make it a 2D tensor
-                    audio_data_int = audio_data_int.unsqueeze(0)
-
-                    # Save the audio data as a .wav file
-                    synapse.speech_output = speech  # Convert PyTorch tensor to a list
+                    save_debug_audio(synapse, "speech", speech, tts_models.sample_rate)
+                    synapse.speech_output = encode_audio(speech.squeeze(0), tts_models.sample_rate)
 
                 elif config.model == "suno/bark":
-                    speech = speech.cpu().numpy().squeeze()
+                    speech = speech.squeeze()
+                    save_debug_audio(synapse, "speech", speech, tts_models.sample_rate)
                     synapse.model_name = config.model
-                    synapse.speech_output = speech.tolist()
+                    synapse.speech_output = encode_audio(speech, tts_models.sample_rate)
 
                 elif config.model == "elevenlabs/eleven":
-                    speech_file = save_audio(speech)
+                    audio, sample_rate = decode_audio_bytes(speech)
                     synapse.model_name = config.model
-                    speech = convert_audio_to_tensor(speech_file)
-                    synapse.speech_output = speech
+                    if audio is not None:
+                        save_debug_audio(synapse, "speech", audio, sample_rate)
+                        # Only the first channel is sent back
+                        synapse.speech_output = encode_audio(audio[0], sample_rate)
                 else:
                     
-                    synapse.speech_output = speech.tolist()  # Convert PyTorch tensor to a list
+                    synapse.speech_output = encode_audio(speech, tts_models.sample_rate)
                 return synapse
             except Exception as e:
                 print(f"An error occurred while processing speech output: {e}")
@@ -540,67 +500,16 @@ def main(config):
 
     # The blacklist function decides if a request should be ignored.
     def music_blacklist_fn(synapse: lib.protocol.MusicGeneration) -> typing.Tuple[bool, str]:
-        if synapse.dendrite.hotkey not in metagraph.hotkeys:
-            # Ignore requests from unrecognized entities.
-            bt.logging.trace(
-                f"Blacklisting unrecognized hotkey {synapse.dendrite.hotkey}"
-            )
-            return True, "Unrecognized hotkey"
-        elif synapse.dendrite.hotkey in metagraph.hotkeys and metagraph.S[metagraph.hotkeys.index(synapse.dendrite.hotkey)] < lib.MIN_STAKE:
-            # Ignore requests from entities with low stake.
-            bt.logging.trace(
-                f"Blacklisting hotkey {synapse.dendrite.hotkey} with low stake"
-            )
-            return True, "Low stake"
-        elif synapse.dendrite.hotkey in lib.BLACKLISTED_VALIDATORS:
-            bt.logging.trace(
-                f"Blacklisting Key recognized as blacklisted hotkey {synapse.dendrite.hotkey}"
-            )
-            return True, "Blacklisted hotkey"
-        elif synapse.dendrite.hotkey in lib.WHITELISTED_VALIDATORS:
-            bt.logging.trace(
-                f"Not Blacklisting recognized hotkey {synapse.dendrite.hotkey}"
-            )
-            return False, "Hotkey recognized!"
-        else:
-            bt.logging.trace(
-                f"Not Blacklisting recognized hotkey {synapse.dendrite.hotkey}"
-            )
-            return True, "Hotkey recognized as Blacklisted!"
+        return warming_check(synapse, "music")
 
     # The priority function determines the order in which requests are handled.
     # More valuable or higher-priority requests are processed before others.
     def music_priority_fn(synapse: lib.protocol.MusicGeneration) -> float:
-        caller_uid = metagraph.hotkeys.index(
-            synapse.dendrite.hotkey
-        )  # Get the caller index.
-        prirority = float(metagraph.S[caller_uid])  # Return the stake as the priority.
-        bt.logging.trace(
-            f"Prioritizing {synapse.dendrite.hotkey} with value: ", prirority
-        )
-        return prirority
-
-    def convert_music_to_tensor(audio_file):
-        '''Convert the audio file to a tensor'''
-        try:
-            # Get the file extension
-            _, file_extension = os.path.splitext(audio_file)
-
-            if file_extension.lower() in ['.wav', '.mp3']:
-                # load the audio file
-                audio, sample_rate = torchaudio.load(audio_file)
-                # convert the audio file to a tensor/list
-                audio = audio[0].tolist()
-                return audio
-            else:
-                bt.logging.error(f"Unsupported file format: {file_extension}")
-                return None
-        except Exception as e:
-            bt.logging.error(f"An error occurred while converting the file: {e}")
+        return request_gate.priority(synapse)
 
     def ProcessMusic(synapse: lib.protocol.MusicGeneration) -> lib.protocol.MusicGeneration:
         bt.logging.info(f"Generating music with the model: {config.music_model}")
-        music = ttm_models.generate_music(synapse.text_input, synapse.duration)
+        music = warmup.get("music").generate_music(synapse.text_input, synapse.duration)
 
         # Check if 'music' contains valid audio data
         if music is None:
@@ -609,12 +518,10 @@ def main(config):
         else:
             try:
                 sampling_rate = 32000
-                # Assuming write_wav function exists and works as intended
-                write_wav("musicgen_out.wav", rate=sampling_rate, data=music) # synapse.dendrite.hotkey + "_musicgen_out.wav"
-                bt.logging.success(f"Text to Music has been generated! and saved to: musicgen_out.wav")
-                # Assuming convert_music_to_tensor function exists to convert WAV to tensor
-                music_tensor = convert_music_to_tensor("musicgen_out.wav")
-                synapse.music_output = music_tensor
+                save_debug_audio(synapse, "music", music, sampling_rate)
+                bt.logging.success(f"Text to Music has been generated!")
+                # Only the first channel is sent back
+                synapse.music_output = encode_audio(music.reshape(-1, music.shape[-1])[0], sampling_rate)
                 return synapse
             except Exception as e:
                 bt.logging.error(f"An error occurred while processing music output: {e}")
@@ -640,6 +547,12 @@ def main(config):
         priority_fn= music_priority_fn,
     )
 
+    # Serve as soon as the first model is ready, the other routes answer "warming" until theirs is
+    if not warmup.wait_first():
+        bt.logging.error(f"No model could be initialized: {warmup.errors}")
+        exit(1)
+    bt.logging.info(f"Model status: {warmup.status()}")
+
     # Serve passes the axon information to the network + netuid we are hosting on.
     # This will auto-update if the axon port of external ip have changed.
     bt.logging.info(
@@ -663,10 +576,17 @@ def main(config):
                 wandb.finish()  # Finish the current run
                 start_wandb_run()  # Start a new run
                 start_time = time.time()  # Reset the start time
+            # A model that failed to load leaves its route dead, restart like a failed startup
+            if warmup.errors:
+                bt.logging.error(f"An error occurred while model initilization: {warmup.errors}")
+                axon.stop()
+                wandb.finish()
+                exit(1)
             # TODO(developer): Define any additional operations to be performed by the miner.
             # Below: Periodically update our knowledge of the network graph.
             if step % 500 == 0:
                 metagraph = subtensor.metagraph(config.netuid)
+                request_gate.update(metagraph)
                 log = (
                     f"Step:{step} | "
                     f"Block:{metagraph.block.item()} | "
@@ -0,0 +1,105 @@
+# Compares the inference profiles of a Text-To-Speech backend on latency and output length.
+#
+#   python scripts/benchmark_tts.py --model suno/bark --profiles baseline fast compiled --runs 5
+#   python scripts/benchmark_tts.py --model facebook/mms-tts-eng --device cuda
+import argparse
+import statistics
+import time
+import gc
+import os
+import sys
+
+import torch
+
+# Set the project root path
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+from models.text_to_speech_models import SunoBark, EnglishTextToSpeech
+
+BACKENDS = {
+    "suno/bark": SunoBark,
+    "facebook/mms-tts-eng": EnglishTextToSpeech,
+}
+
+PROMPTS = [
+    "The quick brown fox jumps over the lazy dog.",
+    "In the early morning light, the old harbor slowly came back to life as the fishing boats returned.",
+    "Please remember to bring your notes, we will review the results of the last experiment together.",
+]
+
+
+def get_config():
+    parser = argparse.ArgumentParser(description="Benchmark the inference profiles of a Text-To-Speech model.")
+    parser.add_argument("--model", default="suno/bark", choices=list(BACKENDS), help="The text-to-speech backend to benchmark.")
+    parser.add_argument("--model_path", default=None, help="Finetuned model path, the --model name by default.")
+    parser.add_argument("--profiles", nargs="+", default=None, help="Profiles to compare, all profiles of the backend by default.")
+    parser.add_argument("--device", default=None, help="Device to run on, cuda when available by default.")
+    parser.add_argument("--dtype", default=None, choices=["float32", "float16", "bfloat16"], help="Overrides the precision of every profile.")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs per prompt.")
+    parser.add_argument("--text", nargs="+", default=None, help="Prompts to synthesize, a few built-in sentences by default.")
+    return parser.parse_args()
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def benchmark_profile(backend, model_path, profile, config, prompts):
+    '''Returns {load, latencies, seconds} for one profile, seconds is the length of every output'''
+    start = time.time()
+    model = backend(model_path=model_path, profile=profile, device=config.device, dtype=config.dtype)
+    synchronize(model.device)
+    load_time = time.time() - start
+
+    # One untimed call, so lazy initialization and voice preset loading are not measured
+    model.generate_speech(prompts[0])
+
+    latencies, seconds = [], []
+    for run in range(config.runs):
+        for prompt in prompts:
+            torch.manual_seed(run)
+            synchronize(model.device)
+            start = time.time()
+            speech = model.generate_speech(prompt)
+            synchronize(model.device)
+            latencies.append(time.time() - start)
+            seconds.append(speech.shape[-1] / model.sample_rate)
+
+    result = {"resolved": model.profile, "load": load_time, "latencies": latencies, "seconds": seconds}
+    del model
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    return result
+
+
+def main(config):
+    backend = BACKENDS[config.model]
+    model_path = config.model_path or config.model
+    profiles = config.profiles or list(backend.PROFILES)
+    prompts = config.text or PROMPTS
+
+    results = {}
+    for profile in profiles:
+        print(f"Benchmarking {config.model} with the '{profile}' profile ...")
+        results[profile] = benchmark_profile(backend, model_path, profile, config, prompts)
+        print(f"  {results[profile]['resolved']}")
+
+    header = f"{'Profile':<10} | {'Load (s)':>8} | {'Mean (s)':>8} | {'Median (s)':>10} | {'Max (s)':>7} | {'Audio (s)':>9} | {'RTF':>5}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for profile, result in results.items():
+        latencies, seconds = result["latencies"], result["seconds"]
+        # Real-time factor: seconds of compute per second of audio
+        rtf = sum(latencies) / max(sum(seconds), 1e-8)
+        print(
+            f"{profile:<10} | {result['load']:>8.2f} | {statistics.mean(latencies):>8.3f} | {statistics.median(latencies):>10.3f} | "
+            f"{max(latencies):>7.3f} | {statistics.mean(seconds):>9.2f} | {rtf:>5.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(get_config())
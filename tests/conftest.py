@@ -0,0 +1,50 @@
+import os
+import sys
+import math
+
+import pytest
+
+# Set the project root path, so the tests import this repo the way the neurons do
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, project_root)
+
+
+def voiced_clip(seconds, sample_rate, f0=120.0, seed=0):
+    '''
+    A short speech-like test clip shaped [1, samples]: a leading pause, then a harmonic tone
+    with a syllable-rate envelope and a little noise, so VAD and the scorers have something to keep.
+    '''
+    import torch
+    generator = torch.Generator().manual_seed(seed)
+    t = torch.arange(int(seconds * sample_rate), dtype=torch.float32) / sample_rate
+    tone = sum(torch.sin(2 * math.pi * f0 * h * t) / h for h in range(1, 6))
+    envelope = 0.5 * (1 - torch.cos(2 * math.pi * 4 * t))
+    clip = 0.3 * tone * envelope + 0.01 * torch.randn(t.shape, generator=generator)
+    clip[: int(0.1 * sample_rate)] = 0.0
+    return clip.unsqueeze(0)
+
+
+@pytest.fixture
+def speech_clips():
+    '''Two clips of different lengths and sample rates, as (waveforms, sample_rates).'''
+    return [voiced_clip(0.8, 16000, seed=0), voiced_clip(1.1, 22050, f0=180.0, seed=1)], [16000, 22050]
+
+
+@pytest.fixture(scope="session")
+def speech_engine():
+    '''
+    The resident NISQA + wav2vec2 engine on the CPU, registered as the process singleton so
+    CloneScore uses it too. Skipped when the scoring dependencies or weights are unavailable.
+    '''
+    reward = pytest.importorskip("lib.reward")
+    pretrained_model = os.path.join(project_root, "nisqa.tar")
+    if not os.path.exists(pretrained_model):
+        pytest.skip("nisqa.tar is not available")
+    engine = reward.SpeechScoringEngine
+    with engine._instance_lock:
+        if engine._instance is None:
+            try:
+                engine._instance = engine(pretrained_model=pretrained_model, device="cpu")
+            except OSError as e:
+                pytest.skip(f"The wav2vec2 model could not be loaded: {e}")
+    return engine._instance
@@ -0,0 +1,53 @@
+import pytest
+import torch
+
+bark = pytest.importorskip("models.bark_voice_clone")
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(0)
+    config = bark.GPTConfig(block_size=32, input_vocab_size=50, output_vocab_size=50, n_layer=2, n_head=2, n_embd=16)
+    return bark.GPT(config).eval()
+
+
+def test_static_cache_matches_full_forward(model):
+    idx = torch.randint(0, 50, (2, 12), generator=torch.Generator().manual_seed(1))
+    cache = bark.StaticKVCache(model.config, batch_size=2)
+
+    with torch.no_grad():
+        # The first call fills the cache with the context, then one token per step
+        logits, cache = model(idx[:, :8], past_kv=cache, use_cache=True)
+        steps = [logits]
+        for t in range(8, idx.shape[1]):
+            logits, cache = model(idx[:, t:t + 1], past_kv=cache, use_cache=True)
+            steps.append(logits)
+        full = [model(idx[:, :t])[0] for t in range(8, idx.shape[1] + 1)]
+
+    assert cache.length == idx.shape[1]
+    for cached, expected in zip(steps, full):
+        torch.testing.assert_close(cached, expected, atol=1e-5, rtol=1e-4)
+
+
+def test_static_cache_matches_dynamic_cache(model):
+    idx = torch.randint(0, 50, (1, 10), generator=torch.Generator().manual_seed(2))
+    with torch.no_grad():
+        static_logits, static = model(idx[:, :6], past_kv=bark.StaticKVCache(model.config), use_cache=True)
+        dynamic_logits, dynamic = model(idx[:, :6], use_cache=True)
+        for t in range(6, idx.shape[1]):
+            static_logits, static = model(idx[:, t:t + 1], past_kv=static, use_cache=True)
+            dynamic_logits, dynamic = model(idx[:, t:t + 1], past_kv=dynamic, use_cache=True)
+            torch.testing.assert_close(static_logits, dynamic_logits, atol=1e-5, rtol=1e-4)
+
+
+def test_reset_reuses_the_buffers(model):
+    cache = bark.StaticKVCache(model.config)
+    idx = torch.randint(0, 50, (1, 5), generator=torch.Generator().manual_seed(3))
+    with torch.no_grad():
+        first, _ = model(idx, past_kv=cache, use_cache=True)
+        keys = cache.keys
+        cache.reset()
+        again, _ = model(idx, past_kv=cache, use_cache=True)
+
+    assert cache.keys is keys and cache.length == 5
+    torch.testing.assert_close(first, again)
@@ -0,0 +1,41 @@
+import torch
+
+from models.bark_sampling import filter_logits, sample_logits
+
+
+def test_top_k_keeps_the_k_largest():
+    logits = torch.tensor([[1.0, 4.0, 3.0, 2.0], [0.0, -1.0, 5.0, 2.0]])
+    filtered = filter_logits(logits, top_k=2)
+
+    assert torch.isfinite(filtered).tolist() == [[False, True, True, False], [False, False, True, True]]
+    assert torch.equal(filtered[torch.isfinite(filtered)], logits[torch.isfinite(filtered)])
+
+
+def test_top_p_keeps_the_token_that_crosses_p():
+    # probabilities 0.5, 0.3, 0.2: top_p=0.6 keeps the first two, the second crosses 0.6
+    logits = torch.log(torch.tensor([[0.2, 0.5, 0.3]]))
+    assert torch.isfinite(filter_logits(logits, top_p=0.6)).tolist() == [[False, True, True]]
+    # the most likely token is always kept
+    assert torch.isfinite(filter_logits(logits, top_p=0.1)).tolist() == [[False, True, False]]
+
+
+def test_filter_works_on_leading_dimensions():
+    generator = torch.Generator().manual_seed(0)
+    logits = torch.randn(2, 3, 16, generator=generator)
+    filtered = filter_logits(logits, top_k=4, top_p=0.9)
+
+    assert filtered.shape == logits.shape
+    for row, expected in zip(filtered.reshape(-1, 16), logits.reshape(-1, 16)):
+        assert torch.equal(row, filter_logits(expected[None], top_k=4, top_p=0.9)[0])
+
+
+def test_sample_logits_shapes_and_support():
+    torch.manual_seed(0)
+    logits = torch.tensor([[[0.0, 10.0, -10.0, 9.0]] * 3] * 2)
+    tokens, probs = sample_logits(logits, temp=0.7, top_k=2)
+
+    assert tokens.shape == (2, 3, 1)
+    assert probs.shape == logits.shape
+    assert probs.sum(dim=-1).allclose(torch.ones(2, 3))
+    # only the two tokens left by top_k can be drawn
+    assert set(tokens.flatten().tolist()) <= {1, 3}
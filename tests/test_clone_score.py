@@ -0,0 +1,48 @@
+import pytest
+import torch
+
+from conftest import voiced_clip
+
+clone_score = pytest.importorskip("lib.clone_score")
+
+
+@pytest.fixture
+def scorer():
+    return clone_score.CloneScore(device="cpu")
+
+
+def test_cosine_similarities_match_single_pairs(scorer):
+    generator = torch.Generator().manual_seed(0)
+    reference = torch.randn(1, 128, 40, generator=generator)
+    specs = [torch.randn(1, 128, frames, generator=generator) + 0.5 * reference[..., :1] for frames in (25, 40, 57)]
+
+    batch = scorer.calculate_cosine_similarities(reference, specs)
+    assert batch == pytest.approx([scorer.calculate_cosine_similarity(reference, spec) for spec in specs], abs=1e-9)
+
+
+def test_mel_similarities_match_single_clips(scorer, tmp_path):
+    torchaudio = pytest.importorskip("torchaudio")
+    reference_path = str(tmp_path / "reference.wav")
+    torchaudio.save(reference_path, voiced_clip(1.0, 16000, seed=2), 16000)
+    waveforms, sample_rates = [voiced_clip(0.8, 16000, seed=0), voiced_clip(1.1, 24000, f0=180.0, seed=1)], [16000, 24000]
+
+    batch = scorer.mel_similarities(reference_path, waveforms, sample_rates)
+    single = [scorer.mel_similarities(reference_path, [waveform], [rate])[0] for waveform, rate in zip(waveforms, sample_rates)]
+    assert batch == pytest.approx(single, abs=1e-6)
+
+
+def test_compare_audio_batch_matches_compare_audio(speech_engine, scorer, tmp_path):
+    torchaudio = pytest.importorskip("torchaudio")
+    reference_path = str(tmp_path / "reference.wav")
+    torchaudio.save(reference_path, voiced_clip(1.0, 16000, seed=2), 16000)
+    waveforms, sample_rates = [voiced_clip(0.8, 16000, seed=0), voiced_clip(1.1, 24000, f0=180.0, seed=1)], [16000, 24000]
+    text = "the quick brown fox"
+
+    batch = scorer.compare_audio_batch(reference_path, waveforms, sample_rates, text)
+
+    single = []
+    for i, (waveform, sample_rate) in enumerate(zip(waveforms, sample_rates)):
+        output_path = str(tmp_path / f"output_{i}.wav")
+        torchaudio.save(output_path, waveform, sample_rate)
+        single.append(scorer.compare_audio(reference_path, output_path, text))
+    assert batch == pytest.approx(single, abs=1e-4)
@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+import torch
+
+import lib
+from lib.metagraph_index import MetagraphIndex
+
+
+def fake_metagraph(neurons):
+    '''neurons: (hotkey, coldkey, ip, port, stake) per uid'''
+    return SimpleNamespace(
+        uids=torch.arange(len(neurons)),
+        hotkeys=[hotkey for hotkey, _, _, _, _ in neurons],
+        coldkeys=[coldkey for _, coldkey, _, _, _ in neurons],
+        axons=[SimpleNamespace(hotkey=hotkey, ip=ip, port=port) for hotkey, _, ip, port, _ in neurons],
+        total_stake=torch.tensor([stake for _, _, _, _, stake in neurons], dtype=torch.float32),
+    )
+
+
+NEURONS = [
+    ("hk-a", "ck-a", "1.1.1.1", 8091, 10.0),
+    ("hk-b", "ck-b", "0.0.0.0", 8091, 5.0),
+    ("hk-c", "ck-c", "3.3.3.3", 8092, 0.0),
+]
+
+
+def test_lookups():
+    metagraph = fake_metagraph(NEURONS)
+    index = MetagraphIndex(metagraph)
+
+    assert index.uid_for_hotkey("hk-c") == 2
+    assert index.uid_for_hotkey("unknown") is None
+    assert index.uid_for_axon(metagraph.axons[0]) == 0
+    assert index.uid_for_axon(SimpleNamespace(hotkey="hk-a", ip="9.9.9.9", port=8091)) is None
+    assert index.uids_where(index.queryable_mask()) == [0, 2]
+
+
+def test_lookups_after_resync():
+    old = MetagraphIndex(fake_metagraph(NEURONS))
+    # hk-b deregistered, hk-d took its UID and hk-a moved to a new IP
+    resynced = fake_metagraph([
+        ("hk-a", "ck-a", "4.4.4.4", 8091, 10.0),
+        ("hk-d", "ck-d", "5.5.5.5", 8093, 1.0),
+        ("hk-c", "ck-c", "3.3.3.3", 8092, 0.0),
+    ])
+    index = MetagraphIndex(resynced)
+
+    assert index.uid_for_hotkey("hk-b") is None
+    assert index.uid_for_hotkey("hk-d") == 1
+    assert index.uid_for_axon(resynced.axons[0]) == 0
+    assert index.uid_for_axon(SimpleNamespace(hotkey="hk-a", ip="1.1.1.1", port=8091)) is None
+    assert index.uids_where(index.queryable_mask()) == [0, 1, 2]
+    # The index of the previous snapshot is left untouched
+    assert old.uid_for_hotkey("hk-b") == 1
+
+
+def test_masks_and_blacklist(monkeypatch):
+    monkeypatch.setattr(lib, "BLACKLISTED_MINER_HOTKEYS", ["hk-c"])
+    monkeypatch.setattr(lib, "BLACKLISTED_MINER_COLDKEYS", [])
+    index = MetagraphIndex(fake_metagraph(NEURONS))
+
+    scores = torch.ones(3)
+    assert index.mask_weights(scores).tolist() == [1.0, 0.0, 1.0]
+    assert index.zero_blacklisted(scores) == [2]
+    assert scores.tolist() == [1.0, 1.0, 0.0]
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+import lib.protocol
+from lib.protocol import AudioPayload, decode_audio
+
+
+def sine(sample_rate=16000, seconds=0.25, channels=1, amplitude=0.5):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    audio = np.stack([amplitude * np.sin(2 * np.pi * 220 * (c + 1) * t) for c in range(channels)])
+    return audio.astype(np.float32)
+
+
+@pytest.mark.parametrize("codec", lib.protocol.AUDIO_CODECS)
+@pytest.mark.parametrize("channels", [1, 2])
+def test_float32_round_trip(codec, channels):
+    if codec == "flac":
+        pytest.importorskip("soundfile")
+    audio = sine(channels=channels)
+    payload = AudioPayload.from_array(audio, 16000, dtype="float32", codec=codec)
+    decoded = AudioPayload.parse_raw(payload.json()).deserialize()
+
+    assert payload.sample_rate == 16000 and payload.channels == channels
+    assert decoded.dtype == np.float32
+    expected = audio[0] if channels == 1 else audio
+    assert decoded.shape == expected.shape
+    # FLAC stores 24-bit integers, raw float32 is exact
+    np.testing.assert_allclose(decoded, expected, atol=1e-6 if codec == "flac" else 0)
+
+
+@pytest.mark.parametrize("codec", lib.protocol.AUDIO_CODECS)
+def test_int16_round_trip(codec):
+    if codec == "flac":
+        pytest.importorskip("soundfile")
+    audio = (sine()[0] * np.iinfo(np.int16).max).astype(np.int16)
+    payload = AudioPayload.from_array(audio, 24000, dtype="int16", codec=codec)
+    decoded = payload.deserialize()
+
+    assert decoded.dtype == np.int16
+    np.testing.assert_array_equal(decoded, audio)
+
+
+def test_float_to_int16_scales_to_full_range():
+    audio = sine(amplitude=2.0)[0]
+    decoded = AudioPayload.from_array(audio, 16000, dtype="int16").deserialize()
+
+    # Audio louder than 1 is divided by its peak instead of wrapping around
+    assert np.abs(decoded).max() == np.iinfo(np.int16).max
+    np.testing.assert_allclose(decoded / np.iinfo(np.int16).max, audio / 2.0, atol=1e-4)
+
+
+def test_flac_normalizes_float_above_one():
+    pytest.importorskip("soundfile")
+    audio = sine(amplitude=2.0)[0]
+    flac = AudioPayload.from_array(audio, 16000, dtype="float32", codec="flac").deserialize()
+    raw = AudioPayload.from_array(audio, 16000, dtype="float32", codec="raw").deserialize()
+
+    np.testing.assert_allclose(flac, audio / 2.0, atol=1e-6)
+    np.testing.assert_array_equal(raw, audio)
+
+
+def test_decode_audio_accepts_legacy_lists():
+    audio = sine(channels=2)
+    decoded = decode_audio(audio.tolist())
+
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, audio)
+    assert decode_audio(None) is None
+
+
+def test_decode_audio_accepts_payloads():
+    audio = sine()[0]
+    np.testing.assert_array_equal(decode_audio(AudioPayload.from_array(audio, 16000)), audio)
@@ -0,0 +1,47 @@
+from types import SimpleNamespace
+
+import torch
+
+from lib.request_gate import RequestGate
+
+
+def fake_metagraph(stakes):
+    '''stakes: {hotkey: stake} in UID order'''
+    return SimpleNamespace(hotkeys=list(stakes), S=torch.tensor(list(stakes.values()), dtype=torch.float32))
+
+
+def request(hotkey):
+    return SimpleNamespace(dendrite=SimpleNamespace(hotkey=hotkey))
+
+
+def gate():
+    metagraph = fake_metagraph({"validator": 1000.0, "poor": 1.0, "banned": 1000.0, "stranger": 1000.0})
+    return RequestGate(metagraph, min_stake=10, whitelist=["validator", "poor", "banned"], blacklist=["banned"])
+
+
+def test_admits_whitelisted_validator():
+    assert gate().check(request("validator")) == (False, "Hotkey recognized!")
+
+
+def test_rejects():
+    request_gate = gate()
+    assert request_gate.check(request("unknown")) == (True, "Unrecognized hotkey")
+    assert request_gate.check(request("poor")) == (True, "Low stake")
+    assert request_gate.check(request("banned")) == (True, "Blacklisted hotkey")
+    # Registered with enough stake, but not a whitelisted validator
+    assert request_gate.check(request("stranger"))[0] is True
+
+
+def test_priority_is_stake():
+    request_gate = gate()
+    assert request_gate.priority(request("validator")) == 1000.0
+    assert request_gate.priority(request("unknown")) == 0.0
+
+
+def test_update_swaps_the_metagraph():
+    request_gate = gate()
+    request_gate.update(fake_metagraph({"poor": 50.0, "stranger": 1000.0}))
+
+    assert request_gate.check(request("validator")) == (True, "Unrecognized hotkey")
+    assert request_gate.check(request("poor")) == (False, "Hotkey recognized!")
+    assert request_gate.priority(request("poor")) == 50.0
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+
+def test_nisqa_predict_batch_matches_predict_tensor(speech_engine, speech_clips):
+    waveforms, sample_rates = speech_clips
+    batch = speech_engine.nisqa.predict_batch(waveforms, sample_rates)
+
+    assert batch.shape == (len(waveforms), 5)
+    for row, waveform, sample_rate in zip(batch, waveforms, sample_rates):
+        np.testing.assert_allclose(row, speech_engine.nisqa.predict_tensor(waveform, sample_rate).reshape(-1), atol=1e-4)
+
+
+def test_score_batch_matches_score(speech_engine, speech_clips):
+    waveforms, sample_rates = speech_clips
+    text = "the quick brown fox"
+    batch = speech_engine.score_batch(waveforms, text, sample_rates)
+
+    single = [speech_engine.score(waveform, text, sample_rate) for waveform, sample_rate in zip(waveforms, sample_rates)]
+    assert batch == pytest.approx(single, abs=1e-4)
+
+
+def test_score_batch_of_nothing(speech_engine):
+    assert speech_engine.score_batch([], "text", []) == []
@@ -0,0 +1,40 @@
+import math
+
+import numpy as np
+import pytest
+import torch
+
+ttm_score = pytest.importorskip("lib.ttm_score")
+MetricEvaluator = ttm_score.MetricEvaluator
+
+
+def music_clips():
+    t = torch.arange(8000, dtype=torch.float32) / 8000
+    mono = 0.5 * torch.sin(2 * math.pi * 440 * t) + 0.05 * torch.randn(t.shape, generator=torch.Generator().manual_seed(0))
+    stereo = torch.stack([mono[:6000], 0.5 * torch.sin(2 * math.pi * 660 * t[:6000])])
+    return [mono, stereo]
+
+
+def test_snr_batch_matches_single_clips():
+    clips = music_clips()
+    batch = MetricEvaluator.calculate_snr_batch(clips)
+
+    single = [MetricEvaluator.calculate_snr_batch([clip])[0] for clip in clips]
+    assert batch == pytest.approx(single, abs=1e-4)
+
+
+def test_snr_matches_librosa():
+    librosa = pytest.importorskip("librosa")
+    for clip in music_clips():
+        y = clip.reshape(-1, clip.shape[-1]).mean(dim=0).numpy()
+        noise = librosa.effects.preemphasis(y, coef=0.97)
+        expected = 10 * np.log10(np.mean(y ** 2) / np.mean(noise ** 2))
+        assert MetricEvaluator.calculate_snr_batch([clip])[0] == pytest.approx(expected, abs=1e-3)
+
+
+def test_snr_of_silent_clip_is_minus_inf():
+    clips = [torch.zeros(4000)] + music_clips()
+    snr = MetricEvaluator.calculate_snr_batch(clips)
+
+    assert snr[0] == -float("inf")
+    assert all(math.isfinite(value) for value in snr[1:])